@@ -0,0 +1,80 @@
+'''
+Benchmark of the element centroid computation used by get_mesh_coordinates.
+Compares the original per-element Python loop against the array based
+compute_centroids on synthetic structured meshes.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_centroids
+    python -m benchmarks.bench_centroids --sizes 10000 100000 --skip-loop-above 1000000
+'''
+import argparse
+from time import perf_counter
+
+import numpy as np
+
+from mesh import compute_centroids
+
+
+def synthetic_mesh(n_elems):
+    '''
+    Builds a regular triangulated rectangle with roughly n_elems triangles.
+    Returns nodes with shape (2, n_nodes) and zero based elems (n_elems, 3).
+    '''
+    nx = max(int(np.sqrt(n_elems / 2)), 1)
+    ny = max(int(np.ceil(n_elems / (2 * nx))), 1)
+
+    lon, lat = np.meshgrid(np.linspace(0, 4.5, nx + 1), np.linspace(0, 18, ny + 1), indexing='ij')
+    nodes = np.vstack((lon.ravel(), lat.ravel()))
+
+    nodnum = np.arange((nx + 1) * (ny + 1)).reshape(nx + 1, ny + 1)
+    sw, se = nodnum[:-1, :-1].ravel(), nodnum[1:, :-1].ravel()
+    nw, ne = nodnum[:-1, 1:].ravel(), nodnum[1:, 1:].ravel()
+    elems = np.concatenate((np.stack((sw, se, nw), axis=1), np.stack((se, ne, nw), axis=1)))
+
+    return nodes, elems[:n_elems]
+
+
+def centroids_loop(nodes, elems):
+    '''Reference implementation, as get_mesh_coordinates used to compute it.'''
+    coords_elems = []
+    for elem in elems:
+        lon_nodes = nodes[0, elem]
+        lat_nodes = nodes[1, elem]
+        coords_elems.append([lon_nodes.sum()/3, lat_nodes.sum()/3])
+
+    return np.asarray(coords_elems).T
+
+
+def time_call(func, *args, repeat=3):
+    best = np.inf
+    for _ in range(repeat):
+        t0 = perf_counter()
+        result = func(*args)
+        best = min(best, perf_counter() - t0)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10_000, 100_000, 1_000_000, 5_000_000])
+    parser.add_argument('--skip-loop-above', type=int, default=None,
+                        help='Do not time the Python loop for meshes larger than this.')
+    args = parser.parse_args()
+
+    print(f"{'n_elems':>10} {'loop [s]':>10} {'array [s]':>10} {'speedup':>8}")
+    for size in args.sizes:
+        nodes, elems = synthetic_mesh(size)
+        t_array, (lon_elems, lat_elems) = time_call(compute_centroids, nodes, elems)
+
+        if args.skip_loop_above is not None and size > args.skip_loop_above:
+            print(f'{len(elems):>10d} {"-":>10} {t_array:>10.4f} {"-":>8}')
+            continue
+
+        t_loop, (lon_ref, lat_ref) = time_call(centroids_loop, nodes, elems, repeat=1)
+        assert np.array_equal(lon_ref, lon_elems) and np.array_equal(lat_ref, lat_elems)
+        print(f'{len(elems):>10d} {t_loop:>10.4f} {t_array:>10.4f} {t_loop / t_array:>7.0f}x')
+
+
+if __name__ == '__main__':
+    main()
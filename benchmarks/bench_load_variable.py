@@ -0,0 +1,80 @@
+'''
+Benchmark of the chunk policy of load_variable. Writes synthetic yearly
+(time, nz1, nod2) files to a temporary folder and compares one chunk per file
+(chunks=None) with chunks='auto' for a horizontal mean (the vertical
+diagnostics) and a time mean, with the default memory budget (Dask's
+array.chunk-size) and a smaller one. Reports wall time and peak memory
+allocated during the computation (tracemalloc), the best of --repeat runs.
+The default of 73 time steps per file is a 5-daily output, a length with no
+divisor but itself.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_load_variable
+    python -m benchmarks.bench_load_variable --years 5 --time 365 --nod2 20000 --budget default 64MB 16MB
+'''
+import argparse
+import tempfile
+import tracemalloc
+from pathlib import Path
+from time import perf_counter
+
+import numpy as np
+import xarray as xr
+
+from data_loader import load_variable
+
+
+def write_synthetic_run(path, n_years, n_time, nz1, n_nod2, seed=0):
+    rng = np.random.default_rng(seed)
+    for year in range(1901, 1901 + n_years):
+        data = rng.normal(size=(n_time, nz1, n_nod2)).astype(np.float32)
+        time = np.datetime64(f'{year}-01-01') + np.arange(n_time).astype('timedelta64[D]')
+        ds = xr.Dataset({'temp': (('time', 'nz1', 'nod2'), data)}, coords={'time': time})
+        ds.to_netcdf(Path(path) / f'temp.fesom.{year}.nc')
+
+
+def measure(func):
+    tracemalloc.start()
+    t0 = perf_counter()
+    func()
+    elapsed = perf_counter() - t0
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--years', type=int, default=3)
+    parser.add_argument('--time', type=int, default=73)
+    parser.add_argument('--nz1', type=int, default=40)
+    parser.add_argument('--nod2', type=int, default=20_000)
+    parser.add_argument('--repeat', type=int, default=3, help='Runs of each case, the fastest is reported.')
+    parser.add_argument('--budget', nargs='+', default=['default', '16MB'],
+                        help='memory_budget values for chunks="auto", "default" for Dask\'s array.chunk-size.')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as path:
+        write_synthetic_run(path, args.years, args.time, args.nz1, args.nod2)
+
+        cases = {
+            'horizontal mean': ('nod2', lambda temp: temp.mean('nod2')),
+            'time mean': ('time', lambda temp: temp.mean('time')),
+        }
+
+        policies = [(None, None)] + [('auto', None if budget == 'default' else budget) for budget in args.budget]
+
+        print(f"{'reduction':>16} {'chunks':>8} {'budget':>8} {'n chunks':>9} {'time [s]':>10} {'peak [MB]':>10}")
+        for name, (reduce_dims, reduction) in cases.items():
+            for chunks, budget in policies:
+                temp = load_variable(path, 'temp', zerostonan=False, chunks=chunks,
+                                     reduce_dims=reduce_dims, memory_budget=budget)
+                elapsed, peak = min(measure(lambda: reduction(temp).compute()) for _ in range(args.repeat))
+                label = '-' if chunks is None else budget or 'default'
+                print(f'{name:>16} {str(chunks):>8} {label:>8} {temp.data.npartitions:>9} '
+                      f'{elapsed:>10.3f} {peak / 1e6:>10.1f}')
+
+
+if __name__ == '__main__':
+    main()
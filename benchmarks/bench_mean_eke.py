@@ -0,0 +1,102 @@
+'''
+Benchmark of mean_EKE: the xarray expression against the fused, blocked
+reduction (fused=True). Reports wall time and peak memory allocated during
+the call (tracemalloc, which tracks numpy allocations) on synthetic
+(time, nz1, elem) velocity fields with a static land mask. The fields are in
+memory, Dask backed (--dask) or written to yearly files and read back lazily
+with load_variable and its default chunks (--files), as in the diagnostics.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_mean_eke
+    python -m benchmarks.bench_mean_eke --time 365 --nz1 40 --elem 50000 --dask
+    python -m benchmarks.bench_mean_eke --files --years 3 --memory-budget 32MB
+'''
+import argparse
+import tempfile
+import tracemalloc
+from pathlib import Path
+from time import perf_counter
+
+import numpy as np
+import xarray as xr
+
+from data_loader import load_variable
+from vertical_diagnostics import mean_EKE
+
+
+def synthetic_velocities(n_time, nz1, n_elem, dry_fraction=0.3, seed=0):
+    rng = np.random.default_rng(seed)
+    bottom = rng.integers(int(nz1 * (1 - dry_fraction)), nz1 + 1, n_elem)
+    wet = np.arange(nz1)[:, None] < bottom[None, :]
+
+    def field():
+        data = rng.normal(size=(n_time, nz1, n_elem)).astype(np.float32)
+        data[:, ~wet] = np.nan
+        return xr.DataArray(data, dims=('time', 'nz1', 'elem'))
+
+    elem_area = xr.DataArray(rng.uniform(1, 2, n_elem), dims='elem')
+    return field(), field(), elem_area
+
+
+def write_yearly_files(path, u, v, n_years):
+    '''Splits u and v into n_years yearly files u.fesom.<year>.nc and v.fesom.<year>.nc.'''
+    n_time = u.sizes['time']
+    time = np.datetime64('1901-01-01') + np.arange(n_time).astype('timedelta64[D]')
+    for name, field in (('u', u), ('v', v)):
+        field = field.assign_coords(time=time).rename(name)
+        for year, part in enumerate(np.array_split(np.arange(n_time), n_years)):
+            field.isel(time=part).to_dataset().to_netcdf(Path(path) / f'{name}.fesom.{1901 + year}.nc')
+
+
+def measure(func):
+    tracemalloc.start()
+    t0 = perf_counter()
+    result = func()
+    elapsed = perf_counter() - t0
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak, result
+
+
+def run(u, v, elem_area, time_block):
+    input_mb = (u.nbytes + v.nbytes) / 1e6
+    print(f'inputs: u, v {u.shape} float32, {input_mb:.0f} MB together')
+
+    t_xr, peak_xr, eke_xr = measure(lambda: mean_EKE(u, v, elem_area).compute())
+    t_fused, peak_fused, eke_fused = measure(lambda: mean_EKE(u, v, elem_area, fused=True, 
+                                                              time_block=time_block))
+
+    print(f"{'version':>8} {'time [s]':>10} {'peak [MB]':>10}")
+    print(f"{'xarray':>8} {t_xr:>10.3f} {peak_xr / 1e6:>10.1f}")
+    print(f"{'fused':>8} {t_fused:>10.3f} {peak_fused / 1e6:>10.1f}")
+    print(f'max abs difference: {float(np.nanmax(np.abs(eke_xr - eke_fused))):.2e}')
+
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--time', type=int, default=120)
+    parser.add_argument('--nz1', type=int, default=40)
+    parser.add_argument('--elem', type=int, default=20_000)
+    parser.add_argument('--time-block', type=int, default=8)
+    parser.add_argument('--dask', action='store_true', help='Use Dask backed inputs chunked by time.')
+    parser.add_argument('--files', action='store_true', help='Read the inputs lazily from yearly files.')
+    parser.add_argument('--years', type=int, default=2, help='Number of yearly files with --files.')
+    parser.add_argument('--memory-budget', default=None, help='memory_budget of load_variable with --files.')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as path:
+        u, v, elem_area = synthetic_velocities(args.time, args.nz1, args.elem)
+        if args.dask:
+            u, v = u.chunk(time=args.time_block), v.chunk(time=args.time_block)
+        elif args.files:
+            write_yearly_files(path, u, v, args.years)
+            u, v = (load_variable(path, name, zerostonan=False, reduce_dims='elem', memory_budget=args.memory_budget)
+                    for name in ('u', 'v'))
+            print(f"time chunks of u: {u.chunksizes['time']}")
+        run(u, v, elem_area, args.time_block)
+
+
+if __name__ == '__main__':
+    main()
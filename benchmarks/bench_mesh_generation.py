@@ -0,0 +1,124 @@
+'''
+Benchmark of the mesh generators of mesh_generation/ against the notebook
+exports they replace, across resolutions. The scripts are run unchanged apart
+from the resolution, in a temporary folder, and their output files are
+compared byte by byte with the ones of the array based generators. The plots
+of the scripts are skipped and their prints silenced.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_mesh_generation
+    python -m benchmarks.bench_mesh_generation --soufflet-dx 20 10 5 2 --dbgyre-dx 0.2 0.1 --skip-script
+    python -m benchmarks.bench_mesh_generation --soufflet-dx --dbgyre-dx --basin-dx 0.01 0.005
+
+The generic basin generator has no script to compare with, it is timed on the
+double gyre basin.
+'''
+import argparse
+import contextlib
+import filecmp
+import os
+import re
+import runpy
+import tempfile
+from pathlib import Path
+from time import perf_counter
+
+import numpy as np
+
+from mesh_generation.basin import rotated_rectangle, write_basin_mesh
+from mesh_generation.dbgyre import write_dbgyre_mesh
+from mesh_generation.soufflet import write_soufflet_mesh
+
+
+SCRIPTS = Path(__file__).resolve().parent.parent / 'mesh_generation'
+
+# replaces the pyplot import of the scripts, every call is a no-op
+NO_PLOTS = '''class _NoPlots:
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: None
+plt = _NoPlots()'''
+
+# script, generator and output files of each mesh
+MESHES = {
+    'soufflet': ('mesh2d_soufflet.py', write_soufflet_mesh, ['nod2d.out', 'elem2d.out', 'depth.out']),
+    'dbgyre': ('mesh2d_dbgyre.py', write_dbgyre_mesh, ['nod2d.out', 'elem2d.out', 'aux3d.out']),
+}
+
+# numpy >= 2.4 does not convert one element arrays to scalars anymore
+COMPAT = {
+    '== i+1)[0]': '== i+1)[0][0]',
+    '== i+1)[1]': '== i+1)[1][0]',
+}
+
+
+def run_script(script, folder, **assignments):
+    '''
+    Runs a mesh generation script in folder with the top level assignments
+    replaced, e.g. dx=10. Returns the run time.
+    '''
+    source = (SCRIPTS / script).read_text()
+    for name, value in assignments.items():
+        source = re.sub(rf'^{name} = .*$', f'{name} = {value!r}', source, count=1, flags=re.M)
+
+    source = re.sub(r'^import matplotlib\.pyplot as plt$', NO_PLOTS, source, flags=re.M)
+    for old, new in COMPAT.items():
+        source = source.replace(old, new)
+
+    path = Path(folder) / script
+    path.write_text(source)
+    cwd = Path.cwd()
+    try:
+        os.chdir(folder)
+        t0 = perf_counter()
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            runpy.run_path(str(path), run_name='__main__')
+        return perf_counter() - t0
+    finally:
+        os.chdir(cwd)
+
+
+def time_generator(func, folder, **kwargs):
+    t0 = perf_counter()
+    func(folder, **kwargs)
+    return perf_counter() - t0
+
+
+def same_files(folder_1, folder_2, names):
+    return all(filecmp.cmp(Path(folder_1) / name, Path(folder_2) / name, shallow=False) for name in names)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--soufflet-dx', type=float, nargs='*', default=[20, 10, 5],
+                        help='Soufflet resolutions in km.')
+    parser.add_argument('--dbgyre-dx', type=float, nargs='*', default=[0.4, 0.2], help='Double gyre resolutions in degrees.')
+    parser.add_argument('--basin-dx', type=float, nargs='*', default=[0.05],
+                        help='Resolutions in degrees of the basin generator.')
+    parser.add_argument('--skip-script', action='store_true',
+                        help='Only time the generators, the scripts get very slow at fine resolutions.')
+    args = parser.parse_args()
+
+    print(f"{'mesh':>10} {'dx':>6} {'script [s]':>11} {'array [s]':>10} {'identical':>10}")
+    for mesh, resolutions in [('soufflet', args.soufflet_dx), ('dbgyre', args.dbgyre_dx)]:
+        script, generator, files = MESHES[mesh]
+        for dx in resolutions:
+            dx = int(dx) if dx == int(dx) else dx
+            with tempfile.TemporaryDirectory() as script_dir, tempfile.TemporaryDirectory() as new_dir:
+                t_new = time_generator(generator, new_dir, dx=dx)
+                if args.skip_script:
+                    print(f"{mesh:>10} {dx:>6} {'-':>11} {t_new:>10.3f} {'-':>10}", flush=True)
+                    continue
+                t_script = run_script(script, script_dir, dx=dx)
+                identical = same_files(script_dir, new_dir, files)
+                print(f'{mesh:>10} {dx:>6} {t_script:>11.3f} {t_new:>10.3f} {str(identical):>10}', flush=True)
+
+    polygon = rotated_rectangle((0, 30), 20 * np.sqrt(2), 15 * np.sqrt(2), angle=-45)
+    for dx in args.basin_dx:
+        with tempfile.TemporaryDirectory() as new_dir:
+            t_new = time_generator(write_basin_mesh, new_dir, polygon=polygon, dx=dx)
+        print(f"{'basin':>10} {dx:>6} {'-':>11} {t_new:>10.3f} {'-':>10}", flush=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,45 @@
+'''
+Benchmark of mean_EKE on dense DataArrays against the compressed
+WetPointField, for synthetic (time, nz1, elem) velocities with a growing dry
+fraction. Reports wall time, peak memory allocated during the call
+(tracemalloc) and the size of the inputs.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_wet_points
+    python -m benchmarks.bench_wet_points --time 365 --elem 50000
+'''
+import argparse
+
+import numpy as np
+
+from benchmarks.bench_mean_eke import synthetic_velocities, measure
+from vertical_diagnostics import mean_EKE
+from wet_points import WetPointField
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--time', type=int, default=120)
+    parser.add_argument('--nz1', type=int, default=40)
+    parser.add_argument('--elem', type=int, default=20_000)
+    args = parser.parse_args()
+
+    print(f"{'dry':>5} {'version':>10} {'input [MB]':>11} {'time [s]':>10} {'peak [MB]':>10}")
+    for dry_fraction in (0.1, 0.3, 0.6):
+        u, v, elem_area = synthetic_velocities(args.time, args.nz1, args.elem, dry_fraction=dry_fraction)
+        u_wet = WetPointField.from_dataarray(u)
+        v_wet = WetPointField.from_dataarray(v, mask=u_wet.mask)
+
+        t_dense, peak_dense, eke_dense = measure(lambda: mean_EKE(u, v, elem_area).compute())
+        t_wet, peak_wet, eke_wet = measure(lambda: mean_EKE(u_wet, v_wet, elem_area))
+
+        print(f"{1 - u_wet.wet_fraction:>5.2f} {'dense':>10} {(u.nbytes + v.nbytes) / 1e6:>11.0f} "
+              f"{t_dense:>10.3f} {peak_dense / 1e6:>10.1f}")
+        print(f"{'':>5} {'wet points':>10} {(u_wet.nbytes + v_wet.nbytes) / 1e6:>11.0f} "
+              f"{t_wet:>10.3f} {peak_wet / 1e6:>10.1f}")
+        print(f'max relative difference: {float(np.nanmax(np.abs(eke_dense - eke_wet) / eke_dense)):.2e}')
+
+
+if __name__ == '__main__':
+    main()
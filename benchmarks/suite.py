@@ -0,0 +1,179 @@
+'''
+Benchmark suite of the analysis pipeline on synthetic Soufflet and double gyre
+cases (see benchmarks/synthetic.py): mesh loading, centroids, connectivity, the
+regridders and the vertical diagnostics. Each benchmark records the best wall time of a few
+repeats and the peak memory allocated during one call (tracemalloc). The
+results are saved as JSON, and a previous JSON file can be given to compare
+against and flag regressions.
+
+Run from the repository root:
+
+    python -m benchmarks.suite --output bench.json
+    python -m benchmarks.suite --sizes small medium --compare bench.json --threshold 1.2
+'''
+import argparse
+import json
+import platform
+import subprocess
+import tempfile
+import tracemalloc
+from datetime import datetime, timezone
+from pathlib import Path
+from time import perf_counter
+
+import numpy as np
+
+from benchmarks.synthetic import SIZES, make_case
+from cache import configure_cache
+from connectivity import Connectivity
+from data_loader import load_variable
+from gridding import CubicRegridder, MeshRegridder
+from high_level_functions import vertical_diagnostics_all, vertical_diagnostics_streaming
+from mesh import Mesh, compute_centroids, read_mesh
+from vertical_diagnostics import RMS_vertical_velocity, mean_EKE, mean_buyoancy
+
+
+def measure(func, repeat=3):
+    '''
+    Best wall time of repeat calls and the peak memory allocated by the first one.
+    '''
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    times = []
+    for _ in range(repeat):
+        t0 = perf_counter()
+        func()
+        times.append(perf_counter() - t0)
+
+    return min(times), peak
+
+
+def case_benchmarks(mesh_path, results_path, soufflet):
+    '''
+    Benchmarks of one case as a dict of name: function.
+    '''
+    mesh = Mesh(mesh_path, results_path, soufflet=soufflet)
+    nodes, elems = read_mesh(mesh_path)
+    nodes, elems = np.asarray(nodes), np.asarray(elems)
+
+    temp = load_variable(results_path, 'temp').load()
+    u, v, w = (load_variable(results_path, var).load() for var in ['u', 'v', 'w'])
+
+    # target grid covering the mesh, and one year of the upper levels to regrid
+    x, y = mesh.lon_nodes, mesh.lat_nodes
+    XX1, YY1 = np.meshgrid(np.linspace(x.min(), x.max(), 200), np.linspace(y.min(), y.max(), 200))
+    field = np.nan_to_num(temp.values[:12, :5])
+
+    regridders = {
+        'linear': lambda: MeshRegridder.from_mesh(mesh, XX1, YY1, method='linear'),
+        'nearest': lambda: MeshRegridder.from_mesh(mesh, XX1, YY1, method='nearest'),
+        'cubic': lambda: CubicRegridder.from_mesh(mesh, XX1, YY1),
+    }
+
+    benchmarks = {
+        'mesh.read_ascii': lambda: read_mesh(mesh_path, cache=False),
+        'mesh.read_cached': lambda: read_mesh(mesh_path),
+        'mesh.centroids': lambda: compute_centroids(nodes, elems),
+        'mesh.connectivity': lambda: Connectivity(elems, nodes.shape[1]),
+        'load_variable': lambda: load_variable(results_path, 'temp').load(),
+    }
+    for method, build in regridders.items():
+        regridder = build()
+        benchmarks[f'regrid.{method}.build'] = build
+        benchmarks[f'regrid.{method}.apply'] = lambda regridder=regridder: regridder(field)
+
+    benchmarks.update({
+        'diagnostics.mean_EKE': lambda: mean_EKE(u, v, mesh).compute(),
+        'diagnostics.mean_EKE_fused': lambda: mean_EKE(u, v, mesh, fused=True),
+        'diagnostics.RMS_vertical_velocity': lambda: RMS_vertical_velocity(w, mesh).compute(),
+        'diagnostics.mean_buyoancy': lambda: mean_buyoancy(w, temp, mesh).compute(),
+        'diagnostics.vertical_diagnostics_all': lambda: vertical_diagnostics_all.uncached(results_path, mesh=mesh),
+        'diagnostics.vertical_diagnostics_streaming': lambda: vertical_diagnostics_streaming.uncached(results_path, mesh=mesh),
+    })
+
+    return benchmarks
+
+
+def metadata():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                cwd=Path(__file__).parent).stdout.strip()
+    except OSError:
+        commit = None
+
+    return {'date': datetime.now(timezone.utc).isoformat(timespec='seconds'), 'commit': commit,
+            'python': platform.python_version(), 'numpy': np.__version__, 'machine': platform.node()}
+
+
+def compare(results, baseline, threshold):
+    '''
+    Prints the time ratio against a baseline and returns the benchmarks that got
+    slower than threshold times the baseline.
+    '''
+    old = {(r['case'], r['name']): r for r in baseline['results']}
+    regressions = []
+    print(f"\n{'case':>16} {'benchmark':>44} {'ratio':>7}")
+    for r in results:
+        key = (r['case'], r['name'])
+        if key not in old:
+            continue
+        ratio = r['time'] / old[key]['time']
+        flag = ' *' if ratio > threshold else ''
+        print(f'{key[0]:>16} {key[1]:>44} {ratio:>7.2f}{flag}')
+        if ratio > threshold:
+            regressions.append(key)
+
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--meshes', nargs='+', choices=list(SIZES), default=list(SIZES))
+    parser.add_argument('--sizes', nargs='+', choices=['small', 'medium', 'large'], default=['small'])
+    parser.add_argument('--years', type=int, default=2)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--filter', help='Only run benchmarks whose name contains this text.')
+    parser.add_argument('--workdir', help='Folder for the synthetic cases, kept between runs. '
+                                          'A temporary folder by default.')
+    parser.add_argument('--output', help='JSON file for the results.')
+    parser.add_argument('--compare', help='JSON file of a previous run to compare against.')
+    parser.add_argument('--threshold', type=float, default=1.2, help='Time ratio flagged as a regression.')
+    args = parser.parse_args()
+
+    configure_cache(enabled=False)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        workdir = Path(args.workdir or tmp)
+        results = []
+        print(f"{'case':>16} {'benchmark':>44} {'time [s]':>10} {'peak [MB]':>10}")
+        for mesh_name in args.meshes:
+            for size in args.sizes:
+                case = f'{mesh_name}-{size}'
+                mesh_path, results_path = make_case(workdir / case, mesh_name, size, n_years=args.years)
+                for name, func in case_benchmarks(mesh_path, results_path, mesh_name == 'soufflet').items():
+                    if args.filter and args.filter not in name:
+                        continue
+                    elapsed, peak = measure(func, args.repeat)
+                    results.append({'case': case, 'name': name, 'time': elapsed, 'peak_memory': peak})
+                    print(f'{case:>16} {name:>44} {elapsed:>10.4f} {peak / 1e6:>10.1f}', flush=True)
+
+    report = {'metadata': metadata(), 'results': results}
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=1)
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        if regressions:
+            print(f'\n{len(regressions)} benchmarks slower than {args.threshold} times the baseline.')
+            return 1
+
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
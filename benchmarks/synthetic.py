@@ -0,0 +1,148 @@
+'''
+Synthetic FESOM2-like meshes and model output for the benchmarks: a Soufflet
+channel and a double gyre basin built like the meshes of mesh_generation/, and
+yearly u, v, w and temp files with a mesh diagnostics file, written in the
+layout of a FESOM2 results folder.
+
+    python -m benchmarks.synthetic soufflet small /tmp/souff_small
+'''
+import argparse
+from pathlib import Path
+
+import numpy as np
+import xarray as xr
+
+from mesh import read_mesh
+from mesh_generation import dbgyre, soufflet
+
+
+# nominal resolutions of the sizes, km for the Soufflet channel and degrees for the double gyre
+SIZES = {
+    'soufflet': {'small': 20, 'medium': 10, 'large': 5},
+    'dbgyre': {'small': 0.4, 'medium': 0.2, 'large': 0.1},
+}
+
+
+def soufflet_mesh(dx=20):
+    '''
+    Nodes and elements of the Soufflet channel, see mesh_generation.soufflet.
+    '''
+    nodes, elems, _ = soufflet.soufflet_mesh(dx)
+    return nodes, elems
+
+
+def dbgyre_mesh(dx=0.2):
+    '''
+    Nodes and elements of the double gyre basin, see mesh_generation.dbgyre.
+    '''
+    nodes, elems, _ = dbgyre.dbgyre_mesh(dx)
+    return nodes, elems
+
+
+def write_mesh(path, nodes, elems):
+    '''
+    Writes nod2d.out and elem2d.out in the FESOM2 ascii format.
+    '''
+    path = Path(path)
+    path.mkdir(parents=True, exist_ok=True)
+    n_nodes = nodes.shape[1]
+    node_table = np.column_stack([np.arange(1, n_nodes + 1), nodes.T, np.zeros(n_nodes)])
+    np.savetxt(path / 'nod2d.out', node_table, fmt=['%8d', '%8.4f', '%8.4f', '%8d'], header=f'{n_nodes:8d}',
+               comments='')
+    np.savetxt(path / 'elem2d.out', elems + 1, fmt='%8d', header=f'{len(elems):8d}', comments='')
+
+
+def _smooth_field(rng, x, y, n_time, n_levels, dtype=np.float32):
+    # a few travelling waves, cheap to generate and smooth enough for the interpolators
+    t = np.arange(n_time)[:, None, None]
+    z = np.arange(n_levels)[None, :, None]
+    field = np.zeros((n_time, n_levels, len(x)), dtype=dtype)
+    for _ in range(3):
+        kx, ky, omega, phase = rng.uniform(0.5, 3, 4)
+        field += np.sin(kx * x + ky * y + omega * t + phase + 0.3 * z).astype(dtype)
+    field += rng.normal(scale=0.1, size=field.shape).astype(dtype)
+    return field
+
+
+def write_results(path, nodes, elems, n_years=2, n_time=12, nz=11, dry_fraction=0.0, seed=0):
+    '''
+    Writes a FESOM2-like results folder for the mesh: fesom.mesh.diag.nc with
+    the element and node areas and yearly u, v (time, nz1, elem), temp
+    (time, nz1, nod2) and w (time, nz, nod2) files. Land is stored as zeros, with
+    the bottom level of each column decreasing towards the west for dry_fraction
+    > 0, and w is zero at the surface and the bottom.
+    '''
+    path = Path(path)
+    path.mkdir(parents=True, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    n_nodes, nz1 = nodes.shape[1], nz - 1
+
+    x, y = nodes
+    elem_area = 0.5 * np.abs((x[elems[:, 1]] - x[elems[:, 0]]) * (y[elems[:, 2]] - y[elems[:, 0]])
+                             - (x[elems[:, 2]] - x[elems[:, 0]]) * (y[elems[:, 1]] - y[elems[:, 0]]))
+    nod_area = np.bincount(elems.ravel(), np.repeat(elem_area / 3, 3), minlength=n_nodes)
+    xr.Dataset({'elem_area': ('elem', elem_area),
+                'nod_area': (('nz', 'nod2'), np.tile(nod_area, (nz, 1)))}).to_netcdf(path / 'fesom.mesh.diag.nc')
+
+    # number of wet layers of each node, the elements take the shallowest of their nodes
+    west = (x - x.min()) / np.ptp(x)
+    bottom_nod = np.clip(np.ceil(nz1 * (1 - dry_fraction * 2 * (1 - west))), 1, nz1).astype(int)
+    bottom_elem = bottom_nod[elems].min(axis=1)
+    wet_nod = np.arange(nz1)[:, None] < bottom_nod
+    wet_elem = np.arange(nz1)[:, None] < bottom_elem
+    wet_w = (np.arange(nz)[:, None] > 0) & (np.arange(nz)[:, None] < bottom_nod)
+
+    nz_levels = np.linspace(0, 4000, nz)
+    nz1_levels = (nz_levels[1:] + nz_levels[:-1]) / 2
+    x_elem, y_elem = nodes[:, elems].mean(axis=-1)
+
+    for year in range(1901, 1901 + n_years):
+        time = np.datetime64(f'{year}-01-01') + (np.arange(n_time) * 365 // n_time).astype('timedelta64[D]')
+        fields = {
+            'u': (('time', 'nz1', 'elem'), _smooth_field(rng, x_elem, y_elem, n_time, nz1) * wet_elem),
+            'v': (('time', 'nz1', 'elem'), _smooth_field(rng, x_elem, y_elem, n_time, nz1) * wet_elem),
+            'temp': (('time', 'nz1', 'nod2'), (10 + _smooth_field(rng, x, y, n_time, nz1)) * wet_nod),
+            'w': (('time', 'nz', 'nod2'), 1e-4 * _smooth_field(rng, x, y, n_time, nz) * wet_w),
+        }
+        for variable, (dims, data) in fields.items():
+            coords = {'time': time, dims[1]: nz_levels if dims[1] == 'nz' else nz1_levels}
+            xr.Dataset({variable: (dims, data)}, coords=coords).to_netcdf(path / f'{variable}.fesom.{year}.nc')
+
+
+def make_case(path, mesh='soufflet', size='small', n_years=2, n_time=12, nz=11):
+    '''
+    Writes the mesh and the results of a benchmark case to path/mesh and
+    path/results, unless they are already there.
+
+    Returns
+    -------
+    mesh_path, results_path : Path
+    '''
+    path = Path(path)
+    mesh_path, results_path = path / 'mesh', path / 'results'
+    if not (mesh_path / 'elem2d.out').exists():
+        build = soufflet_mesh if mesh == 'soufflet' else dbgyre_mesh
+        write_mesh(mesh_path, *build(SIZES[mesh][size]))
+    if not (results_path / f'w.fesom.{1900 + n_years}.nc').exists():
+        nodes, elems = read_mesh(mesh_path, cache=False)
+        write_results(results_path, nodes, elems, n_years, n_time, nz, dry_fraction=0.0 if mesh == 'soufflet' else 0.3)
+
+    return mesh_path, results_path
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('mesh', choices=list(SIZES))
+    parser.add_argument('size', choices=['small', 'medium', 'large'])
+    parser.add_argument('path')
+    parser.add_argument('--years', type=int, default=2)
+    parser.add_argument('--time', type=int, default=12)
+    parser.add_argument('--nz', type=int, default=11)
+    args = parser.parse_args()
+
+    mesh_path, results_path = make_case(args.path, args.mesh, args.size, args.years, args.time, args.nz)
+    print(f'mesh: {mesh_path}\nresults: {results_path}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,238 @@
+import functools
+import hashlib
+import inspect
+import os
+import pickle
+import time
+from pathlib import Path
+
+from dask.base import tokenize
+from dask.utils import parse_bytes
+
+from mesh import USER_CACHE_DIR
+
+
+CACHE_DIR_ENV = 'FESOM2TOY_CACHE_DIR'
+CACHE_SIZE_ENV = 'FESOM2TOY_CACHE_SIZE'
+CACHE_ENABLED_ENV = 'FESOM2TOY_CACHE'
+
+_config = {
+    'directory': Path(os.environ.get(CACHE_DIR_ENV, USER_CACHE_DIR / 'results')),
+    'max_size': parse_bytes(os.environ.get(CACHE_SIZE_ENV, '2GB')),
+    'enabled': os.environ.get(CACHE_ENABLED_ENV, '0').lower() in ('1', 'true', 'yes', 'on'),
+}
+
+# temporary files older than this are left over from failed writes
+STALE_TMP_AGE = 3600
+
+
+def configure_cache(directory=None, max_size=None, enabled=None):
+    '''
+    Changes the settings of the result cache. The defaults come from the
+    environment variables FESOM2TOY_CACHE_DIR, FESOM2TOY_CACHE_SIZE and
+    FESOM2TOY_CACHE. The cache is disabled by default, set FESOM2TOY_CACHE=1 or
+    call configure_cache(enabled=True) to use it.
+
+    Parameters
+    ----------
+    directory : str or Path, optional
+        Folder of the cache.
+    max_size : int or str, optional
+        Maximum size of the cache, e.g. '10GB'. The least recently used results
+        are removed when it is exceeded, and larger results are not stored.
+    enabled : bool, optional
+        Whether memoized functions use the cache.
+
+    Returns
+    -------
+    dict
+        The current settings.
+    '''
+    if directory is not None:
+        _config['directory'] = Path(directory)
+    if max_size is not None:
+        _config['max_size'] = parse_bytes(max_size) if isinstance(max_size, str) else int(max_size)
+    if enabled is not None:
+        _config['enabled'] = bool(enabled)
+
+    return dict(_config)
+
+
+@functools.lru_cache()
+def source_version():
+    '''
+    Hash of the source code of the package, so results computed by a different
+    version of the code are never reused.
+    '''
+    digest = hashlib.sha1()
+    for path in sorted(Path(__file__).parent.glob('*.py')):
+        digest.update(path.read_bytes())
+    return digest.hexdigest()
+
+
+def path_fingerprint(path):
+    '''
+    Fingerprint (name, size and modification time) of a file, or of all the
+    files in a folder, skipping hidden files like the cache folders.
+    '''
+    path = Path(path)
+    if path.is_dir():
+        with os.scandir(path) as listing:
+            items = sorted((item.name, item.stat().st_size, item.stat().st_mtime_ns)
+                           for item in listing if not item.name.startswith('.') and item.is_file())
+        return (str(path.resolve()), items)
+
+    stat = path.stat()
+    return (str(path.resolve()), stat.st_size, stat.st_mtime_ns)
+
+
+def _normalize_path(value):
+    # a path argument is replaced by the fingerprint of what it points to
+    if isinstance(value, (str, Path)) and value and os.path.exists(value):
+        return path_fingerprint(value)
+    if isinstance(value, (list, tuple)):
+        return type(value)(_normalize_path(item) for item in value)
+    return value
+
+
+def cache_key(func, args, kwargs, ignore=(), paths=()):
+    '''
+    Key of a call: function name, package source version and the arguments,
+    with default values filled in and the arguments named in paths replaced by
+    the fingerprints of the files they point to.
+    '''
+    bound = inspect.signature(func).bind(*args, **kwargs)
+    bound.apply_defaults()
+    arguments = {name: _normalize_path(value) if name in paths else value
+                 for name, value in bound.arguments.items() if name not in ignore}
+    return tokenize(f'{func.__module__}.{func.__qualname__}', source_version(), arguments)
+
+
+def _entry_path(key):
+    return _config['directory'] / f'{key}.pkl'
+
+
+def _remove_stale_tmp():
+    for path in _config['directory'].glob('.*.tmp'):
+        try:
+            if time.time() - path.stat().st_mtime > STALE_TMP_AGE:
+                path.unlink(missing_ok=True)
+        except FileNotFoundError:
+            continue
+
+
+def _evict(max_size):
+    _remove_stale_tmp()
+    entries = []
+    for path in _config['directory'].glob('*.pkl'):
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            continue
+        entries.append((stat.st_mtime_ns, stat.st_size, path))
+
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_size:
+            break
+        path.unlink(missing_ok=True)
+        total -= size
+
+
+def _store(key, result):
+    directory = _config['directory']
+    directory.mkdir(parents=True, exist_ok=True)
+    path = _entry_path(key)
+    tmp_path = path.with_name(f'.{path.name}.{os.getpid()}.tmp')
+    try:
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(result, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+    except BaseException:
+        # e.g. out of quota, do not leave the partial file behind
+        tmp_path.unlink(missing_ok=True)
+        raise
+    _evict(_config['max_size'])
+
+
+def _load(key):
+    path = _entry_path(key)
+    with open(path, 'rb') as f:
+        result = pickle.load(f)
+    # the modification time marks the last use for the LRU eviction
+    os.utime(path)
+    return result
+
+
+def _in_memory(result):
+    # lazy results would pickle their task graph, not the values
+    if hasattr(result, 'load'):
+        return result.load()
+    if isinstance(result, tuple):
+        return tuple(_in_memory(item) for item in result)
+    return result
+
+
+def _estimated_size(result):
+    # bytes of the arrays in the result, what dominates its pickle
+    if isinstance(result, (tuple, list)):
+        return sum(_estimated_size(item) for item in result)
+    if isinstance(result, dict):
+        return sum(_estimated_size(item) for item in result.values())
+    return getattr(result, 'nbytes', 0)
+
+
+def memoize(func=None, ignore=(), paths=()):
+    '''
+    Decorator that stores the results of func in the disk cache, keyed by
+    cache_key, when the cache is enabled (see configure_cache). An identical
+    second call, with the input files unchanged, returns the stored result.
+    Results larger than the maximum size of the cache are not stored. The
+    original function is available as func.uncached.
+
+    Parameters
+    ----------
+    func : callable
+        Function to memoize.
+    ignore : tuple of str
+        Arguments that do not change the result, e.g. 'verbose'.
+    paths : tuple of str
+        Arguments that are paths to input files or folders, keyed by the
+        fingerprint of their content instead of the path itself.
+    '''
+    if func is None:
+        return functools.partial(memoize, ignore=ignore, paths=paths)
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not _config['enabled']:
+            return func(*args, **kwargs)
+
+        key = cache_key(func, args, kwargs, ignore, paths)
+        try:
+            return _load(key)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            pass
+
+        result = _in_memory(func(*args, **kwargs))
+        if _estimated_size(result) > _config['max_size']:
+            return result
+        try:
+            _store(key, result)
+        except Exception:
+            # not being able to cache is not a reason to fail the computation
+            pass
+
+        return result
+
+    wrapper.uncached = func
+    return wrapper
+
+
+def clear_cache():
+    '''
+    Removes all the stored results, and the temporary files of failed writes.
+    '''
+    for pattern in ('*.pkl', '.*.tmp'):
+        for path in _config['directory'].glob(pattern):
+            path.unlink(missing_ok=True)
@@ -1,32 +1,238 @@
+'''
+Computes the vertical profile diagnostics (see high_level_functions) of one or
+many runs and saves each of them to a profile_diags.nc file. Runs are given as
+results folders or glob patterns and are processed in parallel, either in a
+process pool or in a local Dask cluster. Runs whose output is current (same
+years and unchanged input files) are skipped, so the command can be rerun on a
+whole parameter sweep after some runs are extended.
+
+Examples
+--------
+    python compute_profile_diagnostics.py '/gxfs_work/geomar/smomw649/results/souff_*' \\
+        --output-root /gxfs_work/geomar/smomw649/processed_data --workers 8 --memory-limit 16GB
+
+    python compute_profile_diagnostics.py results/souff_10_001_06_20_0 --year-1 1901 --scheduler dask
+'''
+import argparse
+import glob
+import os
 import sys
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from pathlib import Path
+
+import dask
+import numpy as np
 import xarray as xr
-from high_level_functions import vertical_diagnostics_all
-
-# modify values in this block
-data_path = '/gxfs_work/geomar/smomw649/results/souff_10_001_06_20_0/'
-output_path = '/gxfs_work/geomar/smomw649/processed_data/souff_10_001_06_20_0/profile_diags.nc'
-year_1 = 1901
-year_f = None
-
-output_path = Path(output_path)
-output_path.parent.mkdir(parents=True, exist_ok=True)
-
-if output_path.exists():
-    while True:
-        answer = input('File exists. Do you want to overwrite [Y/n]? ').strip().lower()
-        if answer=='y' or answer=='':
-            break
-
-        elif answer=='n':
-            print('Exiting...')
-            sys.exit()
-        
+from dask.base import tokenize
+
+from file_index import FileIndex
+from high_level_functions import (vertical_diagnostics_all, vertical_diagnostics_streaming,
+                                  vertical_diagnostics_incremental, write_atomic)
+
+
+OUTPUT_NAME = 'profile_diags.nc'
+INPUT_VARIABLES = ('u', 'v', 'temp', 'w')
+MESH_DIAG = 'fesom.mesh.diag.nc'
+
+
+def expand_runs(patterns):
+    '''
+    Results folders matching the given paths or glob patterns, without duplicates
+    and in the order given.
+    '''
+    runs = []
+    for pattern in patterns:
+        matches = sorted(glob.glob(pattern)) if glob.has_magic(pattern) else [pattern]
+        for match in matches:
+            path = Path(match)
+            if path.is_dir() and path not in runs:
+                runs.append(path)
+
+    return runs
+
+
+def get_output_path(run, output_root=None, output_name=OUTPUT_NAME, base=None):
+    '''
+    output_root/<run folder>/output_name, or the file inside the run folder if
+    output_root is not given. The run folder is taken relative to base, so runs
+    with the same folder name in different experiments (expA/results and
+    expB/results with base='.') get different outputs. Without base it is the
+    run folder name.
+    '''
+    if output_root is None:
+        return Path(run) / output_name
+    if base is None:
+        return Path(output_root) / Path(run).name / output_name
+    return Path(output_root) / Path(run).resolve().relative_to(Path(base).resolve()) / output_name
+
+
+def common_base(runs):
+    '''
+    Deepest folder containing all the runs (but none of them), see
+    get_output_path.
+    '''
+    return Path(os.path.commonpath([Path(run).resolve().parent for run in runs]))
+
+
+def input_state(run, year_1=None, year_f=None):
+    '''
+    Years that would be processed for run and a fingerprint of all the input
+    files, a hash of the name, size and modification time of each of them,
+    from the FileIndex of the run. A file replaced by one with an older 
+    modification time (e.g. by cp -p or rsync -t) changes it as well.
+    '''
+    index = FileIndex(run).refresh()
+    files = {var: index.files(var, year_1, year_f) for var in INPUT_VARIABLES}
+    years = sorted(files['u'])
+
+    stats = [(entry['file'], entry['size'], entry['mtime_ns']) for entries in files.values() 
+             for entry in entries.values()]
+    mesh_diag = Path(run) / MESH_DIAG
+    if mesh_diag.exists():
+        stat = mesh_diag.stat()
+        stats.append((MESH_DIAG, stat.st_size, stat.st_mtime_ns))
+
+    return years, tokenize(sorted(stats))
+
+
+def is_current(output_path, years, fingerprint):
+    '''
+    Whether output_path exists and was computed from the same years and inputs.
+    '''
+    try:
+        with xr.open_dataset(output_path) as ds:
+            attrs = ds.attrs
+    except (OSError, ValueError):
+        return False
+
+    # netCDF stores a one element attribute as a scalar
+    try:
+        return (np.atleast_1d(attrs.get('years', [])).tolist() == list(years)
+                and attrs.get('input_fingerprint') == fingerprint)
+    except (TypeError, ValueError):
+        return False
+
+
+def process_run(run, output_path, year_1=None, year_f=None, method='all', time_chunk=None,
+                force=False, verbose=False):
+    '''
+    Computes and saves the diagnostics of one run, unless its output is current.
+
+    Returns
+    -------
+    str
+        'done' or 'skipped'.
+    '''
+    years, fingerprint = input_state(run, year_1, year_f)
+    if not years:
+        raise FileNotFoundError(f'No yearly files found in {run}')
+
+    if not force and is_current(output_path, years, fingerprint):
+        return 'skipped'
+
+    # every run is computed within its own worker, so Dask must not spawn more threads. 
+    # The output file is the result, so the memoized versions would only duplicate it.
+    with dask.config.set(scheduler='synchronous'):
+        if method == 'incremental':
+            vertical_diagnostics_incremental(run, output_path, year_1, year_f, time_chunk=time_chunk, 
+                                             verbose=verbose, attrs={'input_fingerprint': fingerprint})
+            return 'done'
+        elif method == 'streaming':
+            ds_diags = vertical_diagnostics_streaming.uncached(run, year_1, year_f, time_chunk=time_chunk, verbose=verbose)
         else:
-            print('Invalid option, please enter "y" for yes or "n" for no.')
-    
+            ds_diags = vertical_diagnostics_all.uncached(run, year_1, year_f, verbose=verbose)
+
+    ds_diags.attrs['years'] = years
+    ds_diags.attrs['input_fingerprint'] = fingerprint
+    write_atomic(ds_diags, output_path)
+
+    return 'done'
+
+
+def _limit_memory(memory_limit):
+    # enforced by the kernel on the heap and anonymous mappings of the worker
+    import resource
+    resource.setrlimit(resource.RLIMIT_DATA, (memory_limit, memory_limit))
+
+
+def _run_in_pool(jobs, workers, memory_limit):
+    initializer, initargs = (_limit_memory, (memory_limit,)) if memory_limit else (None, ())
+    with ProcessPoolExecutor(max_workers=workers, initializer=initializer, initargs=initargs) as pool:
+        futures = {pool.submit(process_run, **job): job['run'] for job in jobs}
+        for future in as_completed(futures):
+            yield futures[future], future
+
+
+def _run_in_dask(jobs, workers, memory_limit):
+    try:
+        from dask.distributed import Client, LocalCluster, as_completed as dask_as_completed
+    except ImportError:
+        raise ImportError('--scheduler dask needs the distributed package (pip install "dask[distributed]").')
+
+    cluster = LocalCluster(n_workers=workers, threads_per_worker=1, processes=True,
+                           memory_limit=memory_limit or 'auto')
+    with cluster, Client(cluster) as client:
+        futures = {client.submit(process_run, **job, pure=False): job['run'] for job in jobs}
+        for future in dask_as_completed(futures):
+            yield futures[future], future
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('runs', nargs='+', help='Results folders or glob patterns (quote them).')
+    parser.add_argument('--output-root', help='Folder where the output of each run goes, in a subfolder '
+                                              'named as the run folder relative to the common parent of '
+                                              'all the runs. By default inside the run folder.')
+    parser.add_argument('--output-name', default=OUTPUT_NAME)
+    parser.add_argument('--year-1', type=int, help='First year to include.')
+    parser.add_argument('--year-f', type=int, help='Last year to include.')
+    parser.add_argument('--method', choices=['all', 'streaming', 'incremental'], default='all',
+                        help='vertical_diagnostics_all, the single pass vertical_diagnostics_streaming or '
+                             'vertical_diagnostics_incremental, which keeps its state in the output and '
+                             'only reads the years that are not in it yet.')
+    parser.add_argument('--time-chunk', type=int, help='Time steps read at once by --method streaming '
+                                                       'and incremental.')
+    parser.add_argument('--workers', type=int, default=1, help='Number of runs processed at the same time.')
+    parser.add_argument('--scheduler', choices=['processes', 'dask'], default='processes')
+    parser.add_argument('--memory-limit', help='Memory limit per worker, e.g. 8GB.')
+    parser.add_argument('--force', action='store_true', help='Recompute runs whose output is current.')
+    parser.add_argument('--verbose', action='store_true')
+    args = parser.parse_args(argv)
+
+    runs = expand_runs(args.runs)
+    if not runs:
+        print('No run folders match', ' '.join(args.runs))
+        return 1
+
+    memory_limit = dask.utils.parse_bytes(args.memory_limit) if args.memory_limit else None
+    base = common_base(runs)
+    jobs = [dict(run=run, output_path=get_output_path(run, args.output_root, args.output_name, base),
+                 year_1=args.year_1, year_f=args.year_f, method=args.method, time_chunk=args.time_chunk,
+                 force=args.force, verbose=args.verbose) for run in runs]
+
+    # two runs writing the same file would overwrite each other (and mix their incremental state)
+    outputs = {}
+    for job in jobs:
+        output_path = job['output_path'].resolve()
+        if output_path in outputs:
+            print(f"{outputs[output_path]} and {job['run']} would both write to {output_path}", file=sys.stderr)
+            return 1
+        outputs[output_path] = job['run']
+
+    run_jobs = _run_in_dask if args.scheduler == 'dask' else _run_in_pool
+    failed = []
+    for run, future in run_jobs(jobs, args.workers, memory_limit):
+        try:
+            print(f'{run}: {future.result()}', flush=True)
+        except Exception:
+            failed.append(run)
+            print(f'{run}: failed', file=sys.stderr, flush=True)
+            traceback.print_exc()
+
+    print(f'{len(runs) - len(failed)} of {len(runs)} runs current.')
+    return 1 if failed else 0
 
-ds_diags = vertical_diagnostics_all(data_path, year_1, year_f, verbose=True)
 
-print('Saving results to file.')
-ds_diags.to_netcdf(output_path)
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,273 @@
+'''
+Adjacency tables of a FESOM2 mesh, built from elem2d.out with sorts and
+bincounts over all the elements at once: the edge list, node to element and
+element to element tables in CSR format, and the elements on both sides of each
+edge. They are computed once and cached as .npy files next to the binary cache
+of the mesh (see mesh.get_cache_dir).
+
+All the elements of elem2d.out are used, including the wrap-around elements of
+the Soufflet channel that Mesh.trim drops: they use the indices of the nodes on
+the other side of the channel, so with them the tables describe the periodic
+mesh, where every interior node is surrounded by elements. Their vertex
+coordinates have to be unwrapped for geometry, see elem_vertex_coordinates and
+soufflet_cyclic_length.
+
+    connectivity = load_connectivity(mesh_path)
+    connectivity.elem_elems(e)    # neighbours of element e
+    connectivity.node_elems(n)    # elements around node n
+'''
+import json
+import os
+from pathlib import Path
+
+import numpy as np
+from scipy.sparse import csr_matrix
+
+from mesh import MESH_FILES, Mesh, _fingerprint, _save_array, get_cache_dir, read_mesh
+
+
+CONNECTIVITY_ARRAYS = ('edges', 'elem_edges', 'edge_elems', 'node_elems_indptr', 'node_elems_indices',
+                       'elem_elems_indptr', 'elem_elems_indices')
+
+
+def _index_dtype(n):
+    # int32 is enough for any FESOM mesh and halves the cache size, like read_mesh
+    return np.int32 if n < np.iinfo(np.int32).max else np.int64
+
+
+class Connectivity:
+    '''
+    Connectivity of a triangular mesh.
+
+    Parameters
+    ----------
+    elems : ndarray
+        Zero based node indices of each triangle with shape (n_elems, 3).
+    n_nodes : int, optional
+        Number of nodes, by default the largest node index + 1.
+
+    Attributes
+    ----------
+    edges : ndarray
+        Node indices of each edge, smallest first, with shape (n_edges, 2),
+        sorted.
+    elem_edges : ndarray
+        Edges of each element with shape (n_elems, 3), edge k joins the vertices
+        k and k + 1.
+    edge_elems : ndarray
+        Elements on both sides of each edge with shape (n_edges, 2), the second
+        one is -1 for the boundary edges.
+    node_elems_indptr, node_elems_indices : ndarray
+        Node to element table in CSR format: the elements around node n are
+        node_elems_indices[node_elems_indptr[n]:node_elems_indptr[n + 1]].
+    elem_elems_indptr, elem_elems_indices : ndarray
+        Element to element table in CSR format, the neighbours across the edges
+        of each element in the order of elem_edges.
+    '''
+
+    def __init__(self, elems, n_nodes=None):
+        elems = np.asarray(elems)
+        n_nodes = int(elems.max()) + 1 if n_nodes is None else n_nodes
+        n_elems = len(elems)
+        index_dtype = _index_dtype(max(n_nodes, 3 * n_elems))
+
+        # the three edges of each element, as a single integer key per edge
+        pairs = elems[:, [0, 1, 1, 2, 2, 0]].reshape(-1, 2)
+        lo, hi = pairs.min(axis=1).astype(np.int64), pairs.max(axis=1).astype(np.int64)
+        keys, elem_edges = np.unique(lo * n_nodes + hi, return_inverse=True)
+        self.edges = np.column_stack([keys // n_nodes, keys % n_nodes]).astype(index_dtype)
+        self.elem_edges = elem_edges.reshape(n_elems, 3).astype(index_dtype)
+
+        # elements of each edge, the occurrences of an edge are consecutive after a stable sort
+        count = np.bincount(elem_edges, minlength=len(keys))
+        if count.max(initial=0) > 2:
+            raise ValueError(f'{np.sum(count > 2)} edges are shared by more than two elements.')
+        owner = (np.argsort(elem_edges, kind='stable') // 3).astype(index_dtype)
+        start = np.cumsum(count) - count
+        self.edge_elems = np.full((len(keys), 2), -1, dtype=index_dtype)
+        self.edge_elems[:, 0] = owner[start]
+        self.edge_elems[count == 2, 1] = owner[start[count == 2] + 1]
+
+        # node to element
+        nodes_flat = elems.ravel()
+        self.node_elems_indptr = np.concatenate(([0], np.cumsum(np.bincount(nodes_flat, minlength=n_nodes))))
+        self.node_elems_indptr = self.node_elems_indptr.astype(index_dtype)
+        self.node_elems_indices = (np.argsort(nodes_flat, kind='stable') // 3).astype(index_dtype)
+
+        # element to element, through the other element of each edge
+        neighbours = self.neighbours
+        has_neighbour = neighbours >= 0
+        self.elem_elems_indptr = np.concatenate(([0], np.cumsum(has_neighbour.sum(axis=1)))).astype(index_dtype)
+        self.elem_elems_indices = neighbours[has_neighbour]
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        '''Builds a Connectivity from a dict with the arrays of CONNECTIVITY_ARRAYS.'''
+        connectivity = cls.__new__(cls)
+        for name in CONNECTIVITY_ARRAYS:
+            setattr(connectivity, name, arrays[name])
+        return connectivity
+
+    def __repr__(self):
+        return f'Connectivity({self.n_nodes} nodes, {self.n_elems} elements, {self.n_edges} edges)'
+
+    @property
+    def n_nodes(self):
+        return len(self.node_elems_indptr) - 1
+
+    @property
+    def n_elems(self):
+        return len(self.elem_edges)
+
+    @property
+    def n_edges(self):
+        return len(self.edges)
+
+    @property
+    def neighbours(self):
+        '''
+        Neighbour of each element across each of its edges with shape (n_elems, 3),
+        -1 at the boundary.
+        '''
+        sides = self.edge_elems[self.elem_edges]
+        own = np.arange(self.n_elems)[:, None]
+        return np.where(sides[..., 0] == own, sides[..., 1], sides[..., 0])
+
+    @property
+    def boundary_edges(self):
+        '''Boolean mask of the edges with a single element.'''
+        return self.edge_elems[:, 1] < 0
+
+    @property
+    def boundary_nodes(self):
+        '''Boolean mask of the nodes on a boundary edge.'''
+        mask = np.zeros(self.n_nodes, dtype=bool)
+        mask[self.edges[self.boundary_edges].ravel()] = True
+        return mask
+
+    def node_elems(self, node):
+        '''Elements around a node.'''
+        return self.node_elems_indices[self.node_elems_indptr[node]:self.node_elems_indptr[node + 1]]
+
+    def elem_elems(self, elem):
+        '''Neighbours of an element.'''
+        return self.elem_elems_indices[self.elem_elems_indptr[elem]:self.elem_elems_indptr[elem + 1]]
+
+    def elems_to_nodes(self, values, weights=None):
+        '''
+        Averages values over elements (last axis) to the nodes, over the elements
+        around each node, weighted by weights (e.g. the element areas) if given.
+        Nodes of no element get nan.
+        '''
+        values = np.asarray(values)
+        weights = np.ones(self.n_elems) if weights is None else np.asarray(weights)
+        matrix = csr_matrix((weights[self.node_elems_indices], self.node_elems_indices, self.node_elems_indptr),
+                            shape=(self.n_nodes, self.n_elems))
+
+        total = (matrix @ values.reshape(-1, self.n_elems).T).T
+        norm = matrix @ np.ones(self.n_elems)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return (total / norm).reshape(values.shape[:-1] + (self.n_nodes,))
+
+    def save(self, path):
+        '''Writes the arrays as connectivity_<name>.npy files in the folder path.'''
+        path = Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+        for name in CONNECTIVITY_ARRAYS:
+            _save_array(path / f'connectivity_{name}.npy', getattr(self, name))
+
+    @classmethod
+    def load(cls, path, mmap_mode='r'):
+        '''Reads the arrays written by save, memory-mapped by default.'''
+        path = Path(path)
+        return cls.from_arrays({name: np.load(path / f'connectivity_{name}.npy', mmap_mode=mmap_mode)
+                                for name in CONNECTIVITY_ARRAYS})
+
+
+def load_connectivity(mesh_path, cache=True, cache_dir=None, validate='stat'):
+    '''
+    Connectivity of the mesh in mesh_path, with all the elements of elem2d.out.
+    The tables are computed once and stored in the cache folder of the mesh (see
+    mesh.get_cache_dir), and rebuilt when nod2d.out or elem2d.out change, like
+    the cache of read_mesh.
+
+    Parameters
+    ----------
+    mesh_path : str, Path or Mesh
+        Path to folder where nod2d.out and elem2d.out files for the mesh are
+        located. If a Mesh is passed, its mesh_path and cache settings are used.
+    cache : bool, default=True
+        Whether to use (and write) the cache.
+    cache_dir : str or Path, optional
+        Cache folder. See mesh.get_cache_dir for the default.
+    validate : {'stat', 'hash'}, default='stat'
+        How to check that the cache is still current, see mesh.read_mesh.
+
+    Returns
+    -------
+    Connectivity
+    '''
+    if isinstance(mesh_path, Mesh):
+        mesh_path, cache, cache_dir = mesh_path.mesh_path, mesh_path.cache, mesh_path.cache_dir
+    mesh_path = Path(mesh_path)
+
+    if cache:
+        cache_path = get_cache_dir(mesh_path, cache_dir)
+        meta_path = cache_path / 'connectivity.json'
+        fingerprints = {name: _fingerprint(mesh_path / name, validate) for name in MESH_FILES}
+        try:
+            with open(meta_path) as f:
+                if json.load(f) == fingerprints:
+                    return Connectivity.load(cache_path)
+        except (OSError, ValueError):
+            pass
+
+    nodes, elems = read_mesh(mesh_path, cache=cache, cache_dir=cache_dir, validate=validate)
+    connectivity = Connectivity(elems, nodes.shape[1])
+
+    if cache:
+        try:
+            connectivity.save(cache_path)
+            tmp_meta_path = meta_path.with_suffix('.tmp')
+            with open(tmp_meta_path, 'w') as f:
+                json.dump(fingerprints, f)
+            os.replace(tmp_meta_path, meta_path)
+        except OSError:
+            # a read only cache location is not a reason to fail
+            pass
+
+    return connectivity
+
+
+def soufflet_cyclic_length(nodes):
+    '''
+    Zonal period of a Soufflet channel mesh, from the spacing of the nodes of
+    its southern wall: the wall has one node less than the columns of the mesh,
+    as the last column is the first one.
+    '''
+    lon_wall = np.sort(nodes[0][nodes[1] == nodes[1].min()])
+    return lon_wall[-1] - lon_wall[0] + np.median(np.diff(lon_wall))
+
+
+def elem_vertex_coordinates(nodes, elems, cyclic_length=None):
+    '''
+    x and y coordinates of the vertices of each element, with shape (n_elems, 3).
+    With a cyclic_length, the x of the vertices of the wrap-around elements are
+    shifted by one period to lie next to their first vertex.
+    '''
+    x, y = nodes[0][elems], nodes[1][elems]
+    if cyclic_length is not None:
+        x = x - cyclic_length * np.round((x - x[:, :1]) / cyclic_length)
+    return x, y
+
+
+def triangle_quality(nodes, elems, cyclic_length=None):
+    '''
+    Quality of each element, 4 sqrt(3) area / sum of the squared sides: 1 for an
+    equilateral triangle, 0.87 for a right isosceles one, towards 0 for slivers.
+    Negative for clockwise elements.
+    '''
+    x, y = elem_vertex_coordinates(nodes, elems, cyclic_length)
+    dx, dy = np.roll(x, -1, axis=1) - x, np.roll(y, -1, axis=1) - y
+    area = 0.5 * (dx[:, 0] * dy[:, 1] - dy[:, 0] * dx[:, 1])
+    return 4 * np.sqrt(3) * area / (dx**2 + dy**2).sum(axis=1)
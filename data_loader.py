@@ -1,28 +1,32 @@
+import json
+import os
+
 import numpy as np
 import xarray as xr
 from matplotlib.tri import Triangulation
 from pathlib import Path
 
+from mesh import Mesh, read_mesh, compute_centroids, soufflet_n_elems, get_cache_dir, _fingerprint, _save_array
+from wet_points import WetPointField
+from file_index import FileIndex, normalize_chunks, open_indexed
+from instrumentation import instrument_module, timer
 
-def get_triangulation(mesh_path, soufflet=False):  
-    nodes = np.loadtxt(mesh_path + 'nod2d.out', skiprows=1, usecols=[1, 2]).T #2d array of node coords
-    lon_nodes, lat_nodes = nodes 
-    
-    elems = np.loadtxt(mesh_path + 'elem2d.out', skiprows=1) - 1
 
+def get_triangulation(mesh_path, soufflet=False, cache=True):  
+    if isinstance(mesh_path, Mesh):
+        return mesh_path.triangulation
+
+    nodes, elems = read_mesh(mesh_path, cache=cache)
+    lon_nodes, lat_nodes = nodes 
 
     if soufflet:
-        # works for me, may have to be addapted depending on mesh generation strategy? 
-        ny = len(lat_nodes[:np.where(lat_nodes == lat_nodes.max())[0][0]+1])
-        nx = len(lon_nodes[::ny]) + 1 # in case we need it later
-        last_elems_idx = len(elems) - (ny * 2 - 2)
-        elems = elems[:last_elems_idx]
+        elems = elems[:soufflet_n_elems(lat_nodes, len(elems))]
 
     tri = Triangulation(lon_nodes, lat_nodes, elems)
     return tri
 
 
-def get_mesh_coordinates(mesh_path, soufflet=False):
+def get_mesh_coordinates(mesh_path, soufflet=False, cache=True):
     '''
     Returns arrays for the coordinates of the nodes and the elements of a Soufflet configuration FESOM2 mesh.
     The coordinates for the elements are taking directly from the nod2d.out file, and for the elements are 
@@ -33,10 +37,13 @@ def get_mesh_coordinates(mesh_path, soufflet=False):
 
     Parameters
     ----------
-    mesh_path : str
+    mesh_path : str or Mesh
         Path to folder where nod2d.out and elem2d.out files for the mesh are located. 
+        If a Mesh is passed, its cached coordinates are returned and soufflet is ignored.
     soufflet : bool
         Wheter the mesh file is for the Soufflet configuration. Needed to take into acount periodicty.
+    cache : bool, default=True
+        Read the mesh through the binary cache of mesh.read_mesh.
 
     Returns
     -------
@@ -46,20 +53,13 @@ def get_mesh_coordinates(mesh_path, soufflet=False):
         x and y coordinates for the mesh elements as a 1d array. Computed as the centroid of the triangles.
 
     '''
+
+    if isinstance(mesh_path, Mesh):
+        return mesh_path.lon_nodes, mesh_path.lat_nodes, mesh_path.lon_elems, mesh_path.lat_elems
     
-    nodes = np.loadtxt(mesh_path + 'nod2d.out', skiprows=1, usecols=[1, 2]).T #2d array of node coords
-    elems = np.loadtxt(mesh_path + 'elem2d.out', skiprows=1, dtype=int) 
-
-    # compute coordinates of elements as centroid of triangle
-    coords_elems = []
-    for elem in elems:
-        lon_nodes = nodes[0, elem - 1] 
-        lat_nodes = nodes[1, elem - 1]
-        lon_elem = lon_nodes.sum()/3
-        lat_elem = lat_nodes.sum()/3
-        coords_elems.append([lon_elem, lat_elem])
-        
-    lon_elems, lat_elems = np.asarray(coords_elems).T
+    nodes, elems = read_mesh(mesh_path, cache=cache)
+
+    lon_elems, lat_elems = compute_centroids(nodes, elems)
     lon_nodes, lat_nodes = nodes 
      
     # The following adjustment is necessary for soufflet. In the elem2d.out file
@@ -75,64 +75,310 @@ def get_mesh_coordinates(mesh_path, soufflet=False):
     # writing this 11 line comment :) 
     
     if soufflet:
-        # works for me, may have to be addapted depending on mesh generation strategy? 
-        ny = len(lat_nodes[:np.where(lat_nodes == lat_nodes.max())[0][0]+1])
-        nx = len(lon_nodes[::ny]) + 1 # in case we need it later
-        last_elems_idx = len(lat_elems) - (ny * 2 - 2)
+        last_elems_idx = soufflet_n_elems(lat_nodes, len(lat_elems))
         lon_elems, lat_elems = lon_elems[:last_elems_idx], lat_elems[:last_elems_idx]
 
     return lon_nodes, lat_nodes, lon_elems, lat_elems
 
 
-def load_variable(data_path, variable, year_1=None, year_f=None, zerostonan=True):
+def get_yearly_files(data_path, variable, year_1=None, year_f=None):
     '''
-    Loads a given variable from a results folder. Output is a xr.DataArray containing
-    the years of simulation starting from year_1 up to year_f. If year_1 and year_f are
-    not set, all the years present in data_path are returned.
+    Finds the yearly output files of a variable in a results folder. The year is
+    parsed from the last dot separated part of the file stem (e.g. u.fesom.1901.nc).
 
     Parameters
     ----------
     data_path : str
         Path to results folder.
     variable : str
-        Variable to load.
-    year_1 : int, optional
-        Initial year to load into the DataArray. Prior years won't be loaded.
-    year_f : int, optional
-        Initial year to load into the DataArray. Later years won't be loaded.
-    zerostonan : bool, optional
-        If True, zero value in the DataArray are set to np.nan. Useful to mask topography.
+        Variable to look for.
+    year_1, year_f : int, optional
+        First and last year to include.
 
     Returns
     -------
-    DataArray
-        Contains selected years of variable.
+    dict
+        Paths of the files keyed by year, sorted by year.
     '''
 
     path = Path(data_path)
-    file_list = list(path.glob(f'{variable}.*'))
+    files = {int(f.stem.split('.')[-1]): f for f in path.glob(f'{variable}.*')}
 
     if year_1 is not None:
-        file_list = [f for f in file_list if int(f.stem.split('.')[-1]) >= year_1]
+        files = {year: f for year, f in files.items() if year >= year_1}
 
     if year_f is not None:
-        file_list = [f for f in file_list if int(f.stem.split('.')[-1]) <= year_f]
-    
-    ds = xr.open_mfdataset(file_list)
+        files = {year: f for year, f in files.items() if year <= year_f}
+
+    return dict(sorted(files.items()))
+
+
+HORIZONTAL_DIMS = ('nod2', 'elem', 'edg_n')
+LEVEL_DIMS = ('nz', 'nz1')
 
+
+def _parse_bytes(size):
+    if isinstance(size, str):
+        from dask.utils import parse_bytes
+        return parse_bytes(size)
+    return int(size)
+
+
+def choose_chunks(sizes, itemsize, time_per_file=None, reduce_dims=None, memory_budget=None):
+    '''
+    Chooses Dask chunks for a FESOM output variable. Chunks never span several
+    yearly files and stay below memory_budget; a split dimension takes the
+    largest chunk that fits, so the last chunk of each file can be shorter
+    (e.g. 73 five-daily steps in chunks of 20 end with a chunk of 13). Which
+    dimension is split first depends on the reduction that follows:
+
+    - reductions over the horizontal (nod2/elem), like the area weighted means in
+      vertical_diagnostics, keep the horizontal dimension whole and split time, 
+      then levels, so every chunk reduces independently.
+    - reductions over time keep whole files along time and whole horizontal
+      slabs, and only split levels. A single level of a file can then be larger
+      than memory_budget.
+    - without a hint (or both) the horizontal is kept whole, as above.
+
+    Parameters
+    ----------
+    sizes : dict
+        Dimension sizes of the variable, e.g. DataArray.sizes of one file.
+    itemsize : int
+        Bytes per value.
+    time_per_file : int, optional
+        Number of time steps in each file. Defaults to sizes['time'].
+    reduce_dims : str or list of str, optional
+        Dimensions that will be reduced.
+    memory_budget : int or str, optional
+        Maximum bytes per chunk. Defaults to Dask's array.chunk-size.
+
+    Returns
+    -------
+    dict
+        Chunk size per dimension.
+    '''
+
+    if memory_budget is None:
+        import dask
+        memory_budget = dask.config.get('array.chunk-size')
+    memory_budget = _parse_bytes(memory_budget)
+
+    if isinstance(reduce_dims, str):
+        reduce_dims = [reduce_dims]
+    reduce_dims = set(reduce_dims or [])
+
+    chunks = dict(sizes)
+    if 'time' in chunks and time_per_file is not None:
+        chunks['time'] = min(chunks['time'], time_per_file)
+
+    time_dims = [d for d in chunks if d == 'time']
+    level_dims = [d for d in chunks if d in LEVEL_DIMS]
+    horizontal_dims = [d for d in chunks if d in HORIZONTAL_DIMS]
+    other_dims = [d for d in chunks if d not in time_dims + level_dims + horizontal_dims]
+
+    if 'time' in reduce_dims and not reduce_dims & set(HORIZONTAL_DIMS):
+        # whole horizontal slabs of whole files read fastest, only levels are split
+        split_order = level_dims + other_dims
+    else:
+        split_order = time_dims + level_dims + other_dims + horizontal_dims
+
+    for dim in split_order:
+        n_bytes = itemsize * int(np.prod(list(chunks.values())))
+        if n_bytes <= memory_budget:
+            break
+        # the largest chunk that fits, the last chunk of each file may be shorter
+        chunks[dim] = max(1, chunks[dim] * memory_budget // n_bytes)
+
+    return chunks
+
+
+def _select_variable(ds, variable):
     if variable in ds.data_vars:
-        dataarray = ds[variable]
+        return ds[variable]
 
     # had to do the following to make it easy working with diferent file names comming
     # from applying cdo but without changing the variable names.
+    if len(ds.data_vars) == 1:
+        return ds[list(ds.data_vars)[0]]
+
+    raise KeyError("The selected files have more than one data variable and I don't know how to handle this.")
+
+
+def _nonzero_any_time(template, block_bytes=64 * 2**20):
+    # reduced over blocks of time steps, so only one block of the file is in memory
+    if 'time' not in template.dims:
+        return (template != 0).values
+
+    step_bytes = template.dtype.itemsize * template.size // max(template.sizes['time'], 1)
+    step = max(1, block_bytes // max(step_bytes, 1))
+    mask = None
+    for start in range(0, template.sizes['time'], step):
+        block = (template.isel(time=slice(start, start + step)) != 0).any('time').values
+        mask = block if mask is None else mask | block
+    return mask
+
+
+def get_wet_mask(data_path, variable, cache=True, cache_dir=None):
+    '''
+    Returns the static wet mask (True where the ocean is) for the grid of variable, 
+    e.g. (nz1, elem) for u. The topography does not change in time, so the mask is 
+    derived once from the points that are nonzero at any time step of the first 
+    yearly file (found through the FileIndex of data_path) and stored in the cache folder of data_path (see mesh.get_cache_dir).
+    Variables on the same grid share the mask. It is recomputed if the file it was 
+    derived from changes. The file is reduced by blocks of time steps, so it is
+    never loaded whole (the first time step alone is not enough, e.g. a run
+    started from rest has zero velocities everywhere).
+
+    Parameters
+    ----------
+    data_path : str or Path
+        Path to results folder.
+    variable : str
+        Variable whose grid the mask is for.
+    cache : bool, default=True
+        Whether to use (and write) the cached mask.
+    cache_dir : str or Path, optional
+        Folder for the cache. See mesh.get_cache_dir for the default.
+
+    Returns
+    -------
+    DataArray
+        Boolean mask with the non time dimensions of variable.
+    '''
+
+    entries = FileIndex(data_path, cache_dir).refresh().files(variable)
+    if not entries:
+        raise FileNotFoundError(f'No yearly files of {variable} found in {data_path}')
+    source_file = Path(data_path) / next(iter(entries.values()))['file']
+
+    with xr.open_dataset(source_file) as ds:
+        template = _select_variable(ds, variable)
+        dims = tuple(dim for dim in template.dims if dim != 'time')
+        coords = {dim: template[dim] for dim in dims if dim in template.coords}
+
+        name = 'wet_' + '_'.join(dims)
+        fingerprint = {'file': source_file.name, **_fingerprint(source_file)}
+        if cache:
+            cache_path = get_cache_dir(data_path, cache_dir)
+            meta_path = cache_path / f'{name}.json'
+            try:
+                with open(meta_path) as f:
+                    cached = json.load(f)
+                # the mask may come from another variable on the same grid
+                cached_source = source_file.parent / cached.pop('file')
+                mask = np.load(cache_path / f'{name}.npy')
+                shape = tuple(template.sizes[dim] for dim in dims)
+                if cached == _fingerprint(cached_source) and mask.shape == shape:
+                    return xr.DataArray(mask, dims=dims, coords=coords)
+            except (OSError, ValueError, KeyError):
+                pass
+
+        mask = _nonzero_any_time(template)
+
+    if cache:
+        try:
+            cache_path.mkdir(parents=True, exist_ok=True)
+            _save_array(cache_path / f'{name}.npy', mask)
+            tmp_meta_path = meta_path.with_suffix('.tmp')
+            with open(tmp_meta_path, 'w') as f:
+                json.dump(fingerprint, f)
+            os.replace(tmp_meta_path, meta_path)
+        except OSError:
+            pass
+
+    return xr.DataArray(mask, dims=dims, coords=coords)
+
+
+def load_variable(data_path, variable, year_1=None, year_f=None, zerostonan=True, chunks='auto',
+                  reduce_dims=None, memory_budget=None, parallel=False, wet_points=False, use_index=True):
+    '''
+    Loads a given variable from a results folder. Output is a xr.DataArray containing
+    the years of simulation starting from year_1 up to year_f. If year_1 and year_f are
+    not set, all the years present in data_path are returned.
+
+    Parameters
+    ----------
+    data_path : str
+        Path to results folder.
+    variable : str
+        Variable to load.
+    year_1 : int, optional
+        Initial year to load into the DataArray. Prior years won't be loaded.
+    year_f : int, optional
+        Initial year to load into the DataArray. Later years won't be loaded.
+    zerostonan : bool or 'dynamic', optional
+        If True, the topography is set to np.nan using the cached static mask from 
+        get_wet_mask. If 'dynamic', every zero value in the DataArray is set to np.nan,
+        which compares all the values on every load.
+    chunks : 'auto', dict or None, default='auto'
+        Dask chunks. 'auto' chooses them with choose_chunks from the file layout, 
+        reduce_dims and memory_budget. None keeps one chunk per file. Anything else
+        is passed to xr.open_mfdataset, except ints and dicts of ints, which the 
+        index path (use_index) applies itself.
+    reduce_dims : str or list of str, optional
+        Dimensions the data will be reduced over, used by chunks='auto'. E.g. 
+        'nod2' for horizontal means, 'time' for time means.
+    memory_budget : int or str, optional
+        Maximum size of a chunk for chunks='auto', e.g. '256MB'. Defaults to 
+        Dask's array.chunk-size.
+    parallel : bool, default=False
+        Open the files in parallel with Dask, passed to xr.open_mfdataset. 
+        Ignored on the index path, which opens no file up front.
+    wet_points : bool, default=False
+        If True, the values at the wet points (see get_wet_mask) are read into 
+        a compressed WetPointField instead of returning a lazy DataArray.
+    use_index : bool, default=True
+        Find the files and build the dataset from the cached metadata of a 
+        FileIndex of data_path (refreshed for new or changed files), without 
+        opening the files until the data is computed. Files without a 
+        datetime time axis fall back to xr.open_mfdataset.
+
+    Returns
+    -------
+    DataArray or WetPointField
+        Contains selected years of variable.
+    '''
+
+    entries = None
+    if use_index:
+        with timer('load_variable.index', variable=variable):
+            entries = FileIndex(data_path).refresh().files(variable, year_1, year_f)
+        if not entries or not all(entry.get('time') for entry in entries.values()):
+            entries = None
+
+    if entries is not None:
+        first = next(iter(entries.values()))
+        sizes = dict(zip(first['dims'], first['shape']))
+        itemsize = np.dtype(first['dtype']).itemsize
     else:
-        if len(ds.data_vars) == 1:
-            dataarray = ds[list(ds.data_vars)[0]]
+        file_list = list(get_yearly_files(data_path, variable, year_1, year_f).values())
+        with xr.open_dataset(file_list[0]) as ds:
+            template = _select_variable(ds, variable)
+            sizes, itemsize = dict(template.sizes), template.dtype.itemsize
+
+    if isinstance(chunks, str) and chunks == 'auto':
+        chunks = choose_chunks(sizes, itemsize, sizes.get('time'), reduce_dims, memory_budget)
+
+    if entries is not None and normalize_chunks(chunks, first['dims']) is None:
+        # chunks that only Dask can resolve, e.g. '16MB' or {'time': 'auto'}
+        file_list = [Path(data_path) / entry['file'] for entry in entries.values()]
+        entries = None
+
+    with timer('load_variable.open', variable=variable):
+        if entries is not None:
+            dataarray = open_indexed(data_path, entries, chunks)
         else:
-            raise KeyError("The selected files have more than one data variable and I don't know how to handle this.")
+            ds = xr.open_mfdataset(file_list, chunks=chunks, parallel=parallel)
+            dataarray = _select_variable(ds, variable)
+
+    if wet_points:
+        return WetPointField.from_dataarray(dataarray, mask=get_wet_mask(data_path, variable))
 
-    if zerostonan:
+    if isinstance(zerostonan, str) and zerostonan == 'dynamic':
         dataarray = dataarray.where(dataarray!=0)
+    elif zerostonan:
+        dataarray = dataarray.where(get_wet_mask(data_path, variable))
 
     return dataarray
 
@@ -146,8 +392,9 @@ def get_mesh_diagnostics(data_path, variables=None):
 
     Parameters
     ----------
-    data_path : str
-        Path to results folder.
+    data_path : str or Mesh
+        Path to results folder. If a Mesh is passed, its (already opened) mesh 
+        diagnostics are used.
     
     variables : list, optional
         List of variables from the mesh_diag file to be returned.
@@ -158,8 +405,11 @@ def get_mesh_diagnostics(data_path, variables=None):
 
     '''
 
-    file_path = data_path + 'fesom.mesh.diag.nc' 
-    mesh_diag = xr.open_dataset(file_path)
+    if isinstance(data_path, Mesh):
+        mesh_diag = data_path.mesh_diag
+    else:
+        file_path = data_path + 'fesom.mesh.diag.nc' 
+        mesh_diag = xr.open_dataset(file_path)
 
     if variables is not None:
         if isinstance(variables, str):
@@ -177,3 +427,6 @@ def get_mesh_diagnostics(data_path, variables=None):
         output = mesh_diag
         
     return output
+
+
+instrument_module(globals())
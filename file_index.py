@@ -0,0 +1,265 @@
+import functools
+import itertools
+import json
+import os
+from pathlib import Path
+
+import dask
+import dask.array as da
+import numpy as np
+import xarray as xr
+
+from instrumentation import count, timer
+from mesh import get_cache_dir
+
+
+INDEX_FILE = 'file_index.json'
+INDEX_VERSION = 1
+# files kept open by each process for the Dask blocks
+OPEN_FILES = 32
+
+
+def _parse_name(name):
+    # <variable>.<anything>.<year>.<suffix>, e.g. u.fesom.1901.nc
+    parts = Path(name).stem.split('.')
+    if len(parts) < 2:
+        return None
+    try:
+        return parts[0], int(parts[-1])
+    except ValueError:
+        return None
+
+
+def _to_json(value):
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, (str, int, float, bool, list)):
+        return value
+    return None
+
+
+def _describe(file_path, variable, year, stat):
+    entry = {'variable': variable, 'year': year, 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns,
+             'data_var': None}
+
+    with xr.open_dataset(file_path) as ds:
+        if variable in ds.data_vars:
+            data_var = variable
+        elif len(ds.data_vars) == 1:
+            data_var = list(ds.data_vars)[0]
+        else:
+            return entry
+
+        field = ds[data_var]
+        time = None
+        if 'time' in field.dims and np.issubdtype(field['time'].dtype, np.datetime64):
+            time = np.datetime_as_string(field['time'].values, unit='ns').tolist()
+
+        attrs = {key: _to_json(value) for key, value in field.attrs.items()}
+        entry.update({
+            'data_var': data_var,
+            'dims': list(field.dims),
+            'shape': list(field.shape),
+            'dtype': field.dtype.str,
+            'chunks': _to_json(field.encoding.get('chunksizes')),
+            'time': time,
+            'time_range': [time[0], time[-1]] if time else None,
+            'coords': {dim: field[dim].values.tolist() for dim in field.dims
+                       if dim != 'time' and dim in field.coords},
+            'attrs': {key: value for key, value in attrs.items() if value is not None},
+        })
+
+    return entry
+
+
+class FileIndex:
+    '''
+    Persistent index of the yearly output files of a results folder: variable,
+    year, data variable name, dimensions, shape, dtype, on-disk chunking and time
+    coordinate of every file. It lives in the cache folder of the results folder
+    (see mesh.get_cache_dir) and refresh only opens the files that are new or
+    whose size or modification time changed, so after the first call a results
+    folder with hundreds of years is indexed from a single directory listing.
+
+    Parameters
+    ----------
+    data_path : str or Path
+        Path to results folder.
+    cache_dir : str or Path, optional
+        Folder for the index. See mesh.get_cache_dir for the default.
+    '''
+
+    def __init__(self, data_path, cache_dir=None):
+        self.data_path = Path(data_path)
+        self.index_path = get_cache_dir(data_path, cache_dir) / INDEX_FILE
+        self.entries = self._read()
+
+    def __repr__(self):
+        return f'FileIndex({str(self.data_path)!r}, {len(self.entries)} files)'
+
+    def _read(self):
+        try:
+            with open(self.index_path) as f:
+                index = json.load(f)
+            if index.get('version') == INDEX_VERSION:
+                return index['files']
+        except (OSError, ValueError, KeyError):
+            pass
+        return {}
+
+    def save(self):
+        try:
+            self.index_path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = self.index_path.with_suffix('.tmp')
+            with open(tmp_path, 'w') as f:
+                json.dump({'version': INDEX_VERSION, 'files': self.entries}, f)
+            os.replace(tmp_path, self.index_path)
+        except OSError:
+            # a read only cache location only costs re-reading the metadata next time
+            pass
+
+    def refresh(self):
+        '''
+        Brings the index up to date with the results folder and saves it if
+        anything changed. Returns self.
+        '''
+        changed = False
+        seen = set()
+        with os.scandir(self.data_path) as listing:
+            for item in listing:
+                parsed = _parse_name(item.name)
+                if parsed is None or not item.is_file():
+                    continue
+                seen.add(item.name)
+                stat = item.stat()
+                entry = self.entries.get(item.name)
+                if entry and entry['size'] == stat.st_size and entry['mtime_ns'] == stat.st_mtime_ns:
+                    continue
+                self.entries[item.name] = _describe(self.data_path / item.name, *parsed, stat)
+                changed = True
+
+        for name in set(self.entries) - seen:
+            del self.entries[name]
+            changed = True
+
+        if changed:
+            self.save()
+        return self
+
+    def files(self, variable, year_1=None, year_f=None):
+        '''
+        Index entries of the yearly files of variable, keyed by year and sorted by
+        year. The file name is in entry['file'].
+        '''
+        files = {}
+        for name, entry in self.entries.items():
+            year = entry['year']
+            if entry['variable'] != variable:
+                continue
+            if (year_1 is not None and year < year_1) or (year_f is not None and year > year_f):
+                continue
+            files[year] = dict(entry, file=name)
+
+        return dict(sorted(files.items()))
+
+
+@functools.lru_cache(maxsize=OPEN_FILES)
+def _open_file(file_path, mtime_ns, pid):
+    # one open Dataset per file, modification time and process (handles do not survive a fork).
+    # cache=False, so reading a block does not keep the values in the Dataset
+    return xr.open_dataset(file_path, cache=False)
+
+
+def _read_block(file_path, data_var, index, mtime_ns=None):
+    # mtime_ns also makes the Dask key change when the file does
+    with timer('file_index.read_block', file=Path(file_path).name):
+        ds = _open_file(str(file_path), mtime_ns, os.getpid())
+        values = ds[data_var][index].values
+    count('bytes_read.netcdf', values.nbytes)
+    return values
+
+
+def _file_blocks(file_path, entry, chunks):
+    dims, shape = entry['dims'], entry['shape']
+    dtype = np.dtype(entry['dtype'])
+
+    # slices of each dimension, chunks along time stay inside the file
+    slices = []
+    for dim, size in zip(dims, shape):
+        step = chunks.get(dim)
+        step = size if step is None or step == -1 else min(int(step), size)
+        step = max(step, 1)
+        slices.append([slice(start, min(start + step, size)) for start in range(0, size, step)])
+
+    blocks = np.empty([len(s) for s in slices], dtype=object)
+    for position in itertools.product(*[range(len(s)) for s in slices]):
+        index = tuple(s[i] for s, i in zip(slices, position))
+        block_shape = tuple(sl.stop - sl.start for sl in index)
+        block = dask.delayed(_read_block, pure=True)(file_path, entry['data_var'], index, entry['mtime_ns'])
+        blocks[position] = da.from_delayed(block, block_shape, dtype=dtype)
+
+    return da.block(blocks.tolist())
+
+
+def normalize_chunks(chunks, dims):
+    '''
+    Chunk size per dimension for open_indexed from chunks given as None, an int
+    (the same size along every dimension) or a dict of ints (-1 or None for a
+    whole file). Returns None for anything else, e.g. the strings Dask resolves
+    itself ('auto', '16MB'), which need xr.open_mfdataset.
+    '''
+    if chunks is None:
+        return {}
+    if isinstance(chunks, (int, np.integer)) and not isinstance(chunks, bool):
+        return {dim: int(chunks) for dim in dims}
+    if isinstance(chunks, dict) and all(value is None or (isinstance(value, (int, np.integer))
+                                                          and not isinstance(value, bool))
+                                        for value in chunks.values()):
+        return dict(chunks)
+    return None
+
+
+def open_indexed(data_path, entries, chunks=None):
+    '''
+    Builds the lazy DataArray of a variable from FileIndex entries without opening
+    any file. Each Dask block reads its part of one file when computed.
+
+    Parameters
+    ----------
+    data_path : str or Path
+        Path to results folder.
+    entries : dict
+        Entries keyed by year, as returned by FileIndex.files.
+    chunks : int or dict, optional
+        Chunk size per dimension, or the same for every dimension. Missing 
+        dimensions, -1, or chunks=None take a whole file per chunk. See 
+        normalize_chunks.
+
+    Returns
+    -------
+    DataArray
+    '''
+    entries = list(entries.values())
+    first = entries[0]
+    dims = first['dims']
+    index_chunks = normalize_chunks(chunks, dims)
+    if index_chunks is None:
+        raise TypeError(f'open_indexed takes chunks as None, an int or a dict of ints, got {chunks!r}')
+    chunks = index_chunks
+
+    for entry in entries:
+        if entry['data_var'] is None:
+            raise KeyError(f"{entry['file']} has more than one data variable and I don't know how to handle this.")
+        if entry['dims'] != dims or [s for d, s in zip(dims, entry['shape']) if d != 'time'] != \
+                [s for d, s in zip(dims, first['shape']) if d != 'time']:
+            raise ValueError(f"{entry['file']} does not have the layout of {first['file']}")
+
+    time_axis = dims.index('time')
+    data = da.concatenate([_file_blocks(Path(data_path) / entry['file'], entry, chunks) for entry in entries],
+                          axis=time_axis)
+
+    coords = {dim: values for dim, values in first['coords'].items()}
+    coords['time'] = np.concatenate([np.array(entry['time'], dtype='datetime64[ns]') for entry in entries])
+    return xr.DataArray(data, dims=dims, coords=coords, name=first['data_var'], attrs=first['attrs'])
@@ -1,13 +1,29 @@
+import json
+import os
+from pathlib import Path
+
 import numpy as np
 import xarray as xr
 from scipy.interpolate import griddata
-from multiprocessing import Pool
+from multiprocessing import Pool, shared_memory
 from tqdm.auto import tqdm
+from matplotlib.tri import Triangulation
 
-from scipy.spatial import Delaunay
+from scipy import sparse
+from scipy.spatial import Delaunay, cKDTree
 from scipy.interpolate import LinearNDInterpolator, NearestNDInterpolator, CloughTocher2DInterpolator
 
+try:
+    from scipy.interpolate._interpnd import estimate_gradients_2d_global
+except ImportError:  # scipy < 1.14
+    from scipy.interpolate.interpnd import estimate_gradients_2d_global
+
+from mesh import Mesh
+from cache import memoize
+from instrumentation import instrument_module
+
 
+@memoize
 def interpolate_to_grid(field, xx0, yy0, XX1, YY1, days, lvls, method):
     """
     Description: 
@@ -15,7 +31,8 @@ def interpolate_to_grid(field, xx0, yy0, XX1, YY1, days, lvls, method):
         using a specified method (nearest, linear, cubic).
     Parameters: 
         field (np.array): quantity to interpolate, shape:(days, lvl, elem)
-        xx0, yy0 (np.array): Coordinates of the original grid, shape: (elem,)
+        xx0, yy0 (np.array): Coordinates of the original grid, shape: (elem,). xx0 can also be
+            a Mesh (yy0=None), then the node or element coordinates are picked to match field
         XX1, YY1 (np.array): Coordinates of the target grid, shape: (ny, nx) or (ny, nx), 
         days (int): Last day to interpolate to starting from day=0
         lvls (int): Number of Levels in z-direction to analyze. Starting from lvl=0.
@@ -24,6 +41,10 @@ def interpolate_to_grid(field, xx0, yy0, XX1, YY1, days, lvls, method):
         u_interp (np.array): Interpolated quantity at target grid, shape:(day, ny, nx) """
 
 
+    if isinstance(xx0, Mesh):
+        field = xx0.trim(field)
+        xx0, yy0 = xx0.coordinates(field)
+
     if isinstance(field, xr.DataArray) and 'elem' in field.dims:
         field = field.isel(elem=slice(None, len(yy0)))
 
@@ -31,23 +52,15 @@ def interpolate_to_grid(field, xx0, yy0, XX1, YY1, days, lvls, method):
     elif not isinstance(field, xr.DataArray) and field.size > xx0.size:
         field = field[:, :, :len(yy0)]
 
-    #- Parameters
-    ny = XX1.shape[0]
-    nx = XX1.shape[1]
-    field_interp = np.zeros(shape=(days, ny, nx, lvls))
-    
-    #- Interpolation
-    for day in tqdm(range(days), desc='Interpolating days', leave=False):
-        for lvl in range(lvls):
-            field_interp[day,:,:, lvl] = griddata(points=(xx0, yy0), 
-                                                  values=field[day, lvl, :], 
-                                                  xi=(XX1, YY1),
-                                                  method=method)
+    # locate the target points once and regrid all days and levels together
+    regridder = make_regridder(xx0, yy0, XX1, YY1, method)
+    field_interp = regridder.regrid(field[:days, :lvls])
         
-    return field_interp
+    return np.moveaxis(field_interp, 1, -1)
 
 
 
+@memoize
 def interpolate_to_grid_fast(field, xx0, yy0, xx1, yy1, days, lvls, method):
     """
     Description: 
@@ -55,7 +68,8 @@ def interpolate_to_grid_fast(field, xx0, yy0, xx1, yy1, days, lvls, method):
         using a specified method (nearest, linear, cubic).
     Parameters: 
         field (np.array): quantity to interpolate, shape:(days, lvl, elem)
-        xx0, yy0 (np.array): Coordinates of the original grid, shape: (elem,)
+        xx0, yy0 (np.array): Coordinates of the original grid, shape: (elem,). xx0 can also be
+            a Mesh (yy0=None), then the node or element coordinates are picked to match field
         XX1, YY1 (np.array): Coordinates of the target grid, shape: (ny, nx) or (ny, nx), 
         days (int): Last day to interpolate to starting from day=0
         lvls (int): Number of Levels in z-direction to analyze. Starting from lvl=0.
@@ -65,6 +79,10 @@ def interpolate_to_grid_fast(field, xx0, yy0, xx1, yy1, days, lvls, method):
     """
 
 
+    if isinstance(xx0, Mesh):
+        field = xx0.trim(field)
+        xx0, yy0 = xx0.coordinates(field)
+
     if isinstance(field, xr.DataArray) and 'elem' in field.dims:
         field = field.isel(elem=slice(None, len(yy0)))
 
@@ -72,80 +90,677 @@ def interpolate_to_grid_fast(field, xx0, yy0, xx1, yy1, days, lvls, method):
     elif not isinstance(field, xr.DataArray) and field.shape[2] > xx0.size:
         field = field[:, :, :len(yy0)]
 
-    #- Parameters
-    ny = yy1.shape[0]
-    nx = xx1.shape[1]
-    field_interp = np.zeros(shape=(days, ny, nx, lvls))
-    mesh1 = np.vstack((xx0, yy0)).T
-    mesh2 = np.vstack((xx1.ravel(), yy1.ravel())).T
-    print(mesh1)
-    print(mesh2)
-    tri = Delaunay(mesh1)
-    
-    #- Interpolation
-    for day in tqdm(range(days), desc='Interpolating days', leave=False):
-        for lvl in range(lvls):
-            interpolator = CloughTocher2DInterpolator(tri, field[day, lvl, :])
-            field_interp[day, :, :, lvl] = interpolator(mesh2).reshape((ny, nx))
+    # the triangulation, simplex search and barycentric coordinates are computed once, 
+    # then the whole (days, lvls) stack is evaluated in one vectorized pass
+    regridder = make_regridder(xx0, yy0, xx1, yy1, method)
+    field_interp = regridder.regrid(field[:days, :lvls])
         
-    return field_interp
+    return np.moveaxis(field_interp, 1, -1)
+
+
+@memoize
+def make_regridder(xx0, yy0, XX1, YY1, method):
+    """
+    Description: 
+        Builds the precomputed interpolation operator for the given method.
+    Parameters: 
+        xx0, yy0 (np.array): Coordinates of the original grid, shape: (n_source,)
+        XX1, YY1 (np.array): Coordinates of the target grid, shape: (ny, nx)
+        method (str): Interpolation method (nearest, linear, cubic)
+    Returns:
+        regridder (MeshRegridder or CubicRegridder)
+    """
+
+    if method == CubicRegridder.method:
+        return CubicRegridder.from_points(xx0, yy0, XX1, YY1)
+    return MeshRegridder.from_points(xx0, yy0, XX1, YY1, method)
+
+
+class MeshRegridder:
+    """
+    Description: 
+        Precomputed mesh to grid interpolation operator. The target points are located in the 
+        source triangles once and the interpolation weights are stored as a sparse matrix of
+        shape (n_target, n_source), so regridding any stack of fields is a single sparse matrix
+        product. Use from_mesh or from_points to build it and save/load to reuse the weights.
+    Parameters: 
+        weights (scipy.sparse.csr_matrix): interpolation weights, shape: (ny*nx, n_source)
+        valid (np.array): False for target points outside the source triangles, shape: (ny*nx,)
+        target_shape (tuple): (ny, nx) shape of the target grid
+        method (str): Interpolation method the weights were built for (linear, nearest)
+    """
+
+    methods = ('linear', 'nearest')
+
+    def __init__(self, weights, valid, target_shape, method):
+        self.weights = sparse.csr_matrix(weights)
+        self.valid = np.asarray(valid, dtype=bool)
+        self.target_shape = tuple(int(n) for n in target_shape)
+        self.method = method
+
+    def __repr__(self):
+        return (f'MeshRegridder(method={self.method!r}, n_source={self.n_source}, '
+                f'target_shape={self.target_shape})')
+
+    @property
+    def n_source(self):
+        return self.weights.shape[1]
+
+    @classmethod
+    def from_points(cls, xx0, yy0, XX1, YY1, method='linear', triangles=None):
+        """
+        Description: 
+            Builds the operator from scattered source points. Without triangles, the source
+            points are triangulated once with Delaunay, as griddata does, so the result matches
+            griddata for the same method.
+        Parameters: 
+            xx0, yy0 (np.array): Coordinates of the original grid, shape: (n_source,)
+            XX1, YY1 (np.array): Coordinates of the target grid, shape: (ny, nx)
+            method (str): Interpolation method (nearest, linear)
+            triangles (np.array): Zero based vertex indices of the source triangles, shape: (n_tri, 3)
+        Returns:
+            regridder (MeshRegridder)
+        """
+
+        if method not in cls.methods:
+            raise ValueError(f"method must be one of {cls.methods}, got '{method}'")
+
+        xx0, yy0 = np.asarray(xx0, dtype=float), np.asarray(yy0, dtype=float)
+        XX1, YY1 = np.asarray(XX1, dtype=float), np.asarray(YY1, dtype=float)
+        target = np.column_stack((XX1.ravel(), YY1.ravel()))
+        n_target, n_source = len(target), len(xx0)
+
+        if method == 'nearest':
+            _, cols = cKDTree(np.column_stack((xx0, yy0))).query(target)
+            weights = sparse.csr_matrix((np.ones(n_target), (np.arange(n_target), cols)),
+                                        shape=(n_target, n_source))
+            return cls(weights, np.ones(n_target, dtype=bool), XX1.shape, method)
+
+        if triangles is None:
+            delaunay = Delaunay(np.column_stack((xx0, yy0)))
+            triangles = delaunay.simplices
+            simplex = delaunay.find_simplex(target)
+        else:
+            triangles = np.asarray(triangles)
+            trifinder = Triangulation(xx0, yy0, triangles).get_trifinder()
+            simplex = trifinder(target[:, 0], target[:, 1])
+
+        valid = simplex >= 0
+        rows = np.flatnonzero(valid)
+        verts = triangles[simplex[valid]]
+        lambdas = barycentric_coordinates(xx0[verts], yy0[verts], target[valid, 0], target[valid, 1])
+
+        weights = sparse.csr_matrix((lambdas.ravel(), (np.repeat(rows, 3), verts.ravel())), 
+                                    shape=(n_target, n_source))
+        return cls(weights, valid, XX1.shape, method)
+
+    @classmethod
+    def from_mesh(cls, mesh, XX1, YY1, location='nod2', method='linear'):
+        """
+        Description: 
+            Builds the operator for fields defined over the nodes or the elements of a Mesh.
+            Node fields are interpolated inside the native FESOM triangles (elem2d.out), element
+            fields on a Delaunay triangulation of the element centroids.
+        Parameters: 
+            mesh (Mesh): source mesh
+            XX1, YY1 (np.array): Coordinates of the target grid, shape: (ny, nx)
+            location (str): Where the fields are defined (nod2, elem)
+            method (str): Interpolation method (nearest, linear)
+        Returns:
+            regridder (MeshRegridder)
+        """
+
+        if location == 'nod2':
+            return cls.from_points(mesh.lon_nodes, mesh.lat_nodes, XX1, YY1, method, 
+                                   triangles=mesh.elems[:mesh.n_elems])
+        elif location == 'elem':
+            return cls.from_points(mesh.lon_elems, mesh.lat_elems, XX1, YY1, method)
+        else:
+            raise ValueError(f"location must be 'nod2' or 'elem', got '{location}'")
+
+    def regrid(self, field):
+        """
+        Description: 
+            Interpolates a stack of fields with one sparse matrix product.
+        Parameters: 
+            field (np.array or xr.DataArray): quantity to interpolate, shape: (..., n_source)
+        Returns:
+            field_interp (np.array): Interpolated quantity at target grid, shape: (..., ny, nx)
+        """
+
+        field = np.asarray(field)
+        if field.shape[-1] > self.n_source:
+            # e.g. element fields of a trimmed Soufflet mesh
+            field = field[..., :self.n_source]
+
+        stack_shape = field.shape[:-1]
+        field = field.reshape(-1, self.n_source)
+        field_interp = (self.weights @ field.T).T
+        field_interp[:, ~self.valid] = np.nan
+
+        return field_interp.reshape(stack_shape + self.target_shape)
+
+    __call__ = regrid
+
+    def save(self, path):
+        """
+        Description: 
+            Saves the interpolation weights to a .npz file.
+        Parameters: 
+            path (str): Output file
+        """
+
+        np.savez(path, data=self.weights.data, indices=self.weights.indices, 
+                 indptr=self.weights.indptr, shape=self.weights.shape, valid=self.valid, 
+                 target_shape=self.target_shape, method=self.method)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Description: 
+            Loads interpolation weights saved with MeshRegridder.save.
+        Parameters: 
+            path (str): .npz file
+        Returns:
+            regridder (MeshRegridder)
+        """
+
+        with np.load(path) as f:
+            weights = sparse.csr_matrix((f['data'], f['indices'], f['indptr']), shape=tuple(f['shape']))
+            return cls(weights, f['valid'], tuple(f['target_shape']), str(f['method']))
+
+
+def barycentric_coordinates(x_verts, y_verts, x, y):
+    """
+    Description: 
+        Barycentric coordinates of points inside triangles.
+    Parameters: 
+        x_verts, y_verts (np.array): Coordinates of the triangle vertices, shape: (n, 3)
+        x, y (np.array): Coordinates of the points, shape: (n,)
+    Returns:
+        lambdas (np.array): Barycentric coordinates, shape: (n, 3)
+    """
+
+    x0, x1, x2 = x_verts.T
+    y0, y1, y2 = y_verts.T
+    det = (y1 - y2) * (x0 - x2) + (x2 - x1) * (y0 - y2)
+    l0 = ((y1 - y2) * (x - x2) + (x2 - x1) * (y - y2)) / det
+    l1 = ((y2 - y0) * (x - x2) + (x0 - x2) * (y - y2)) / det
+
+    return np.column_stack((l0, l1, 1 - l0 - l1))
+
+
+class CubicRegridder:
+    """
+    Description: 
+        Precomputed Clough-Tocher (cubic) mesh to grid interpolation, equivalent to griddata with
+        method='cubic'. The Delaunay triangulation, the simplex search and the barycentric 
+        coordinates of the target points are computed once. Since the cubic patches are linear
+        in the node values and gradients, they are stored as three sparse (n_target, n_source)
+        matrices. Regridding a stack of fields then only estimates the gradients (one call for 
+        the whole stack) and applies three sparse matrix products.
+    Parameters: 
+        tri (scipy.spatial.Delaunay): triangulation of the source points
+        weights (tuple): sparse weights for the values and the x and y gradients
+        valid (np.array): False for target points outside the triangulation, shape: (ny*nx,)
+        target_shape (tuple): (ny, nx) shape of the target grid
+        maxiter, tol: passed to the gradient estimation, defaults as in CloughTocher2DInterpolator
+    """
+
+    method = 'cubic'
+
+    def __init__(self, tri, weights, valid, target_shape, maxiter=400, tol=1e-6):
+        self.tri = tri
+        self.weights = tuple(sparse.csr_matrix(w) for w in weights)
+        self.valid = np.asarray(valid, dtype=bool)
+        self.target_shape = tuple(int(n) for n in target_shape)
+        self.maxiter = maxiter
+        self.tol = tol
+
+    def __repr__(self):
+        return f'CubicRegridder(n_source={self.n_source}, target_shape={self.target_shape})'
+
+    @property
+    def n_source(self):
+        return self.tri.npoints
+
+    @classmethod
+    def from_points(cls, xx0, yy0, XX1, YY1, **kwargs):
+        """
+        Description: 
+            Builds the operator from scattered source points, triangulated once with Delaunay.
+        Parameters: 
+            xx0, yy0 (np.array): Coordinates of the original grid, shape: (n_source,)
+            XX1, YY1 (np.array): Coordinates of the target grid, shape: (ny, nx)
+        Returns:
+            regridder (CubicRegridder)
+        """
+
+        XX1, YY1 = np.asarray(XX1, dtype=float), np.asarray(YY1, dtype=float)
+        target = np.column_stack((XX1.ravel(), YY1.ravel()))
+        tri = Delaunay(np.column_stack((xx0, yy0)))
+
+        simplex = tri.find_simplex(target)
+        valid = simplex >= 0
+        rows = np.flatnonzero(valid)
+        simplex = simplex[valid]
+        verts = tri.simplices[simplex]
+
+        # barycentric coordinates, extended with the centroid for the Clough-Tocher split
+        transform = tri.transform[simplex]
+        bary = np.einsum('nij,nj->ni', transform[:, :2], target[valid] - transform[:, 2])
+        bary = np.column_stack((bary, 1 - bary.sum(axis=1)))
+        minval = bary.min(axis=1, keepdims=True)
+        bary = np.column_stack((bary - minval, 3 * minval))
+
+        xy = tri.points[verts]
+        edges = (xy[:, [1, 2, 0]] - xy).transpose(1, 2, 0)  # e12, e23, e31, shape: (3, 2, n)
+        g = _clough_tocher_directions(tri)[simplex]
+
+        # unit inputs give the weight of each vertex value (f) and gradient component (dx, dy)
+        n = len(rows)
+        basis = np.zeros((n, 3, 3))
+        basis[:, [0, 1, 2], [0, 1, 2]] = 1
+        w_f = _clough_tocher_eval(basis, np.zeros((n, 3, 2, 3)), edges, g, bary)
+        w_dx = _clough_tocher_eval(np.zeros((n, 3, 3)), basis[:, :, None, :] * [[1], [0]], edges, g, bary)
+        w_dy = _clough_tocher_eval(np.zeros((n, 3, 3)), basis[:, :, None, :] * [[0], [1]], edges, g, bary)
+
+        shape = (len(target), tri.npoints)
+        rows, cols = np.repeat(rows, 3), verts.ravel()
+        weights = [sparse.csr_matrix((w.ravel(), (rows, cols)), shape=shape) for w in (w_f, w_dx, w_dy)]
+
+        return cls(tri, weights, valid, XX1.shape, **kwargs)
+
+    @classmethod
+    def from_mesh(cls, mesh, XX1, YY1, location='nod2', **kwargs):
+        """
+        Description: 
+            Builds the operator for fields defined over the nodes or the elements of a Mesh.
+        Parameters: 
+            mesh (Mesh): source mesh
+            XX1, YY1 (np.array): Coordinates of the target grid, shape: (ny, nx)
+            location (str): Where the fields are defined (nod2, elem)
+        Returns:
+            regridder (CubicRegridder)
+        """
+
+        if location not in ('nod2', 'elem'):
+            raise ValueError(f"location must be 'nod2' or 'elem', got '{location}'")
+        x, y = (mesh.lon_nodes, mesh.lat_nodes) if location == 'nod2' else (mesh.lon_elems, mesh.lat_elems)
+        return cls.from_points(x, y, XX1, YY1, **kwargs)
+
+    def regrid(self, field):
+        """
+        Description: 
+            Interpolates a stack of fields in one vectorized pass.
+        Parameters: 
+            field (np.array or xr.DataArray): quantity to interpolate, shape: (..., n_source)
+        Returns:
+            field_interp (np.array): Interpolated quantity at target grid, shape: (..., ny, nx)
+        """
+
+        field = np.asarray(field, dtype=np.float64)
+        if field.shape[-1] > self.n_source:
+            field = field[..., :self.n_source]
+
+        stack_shape = field.shape[:-1]
+        values = np.ascontiguousarray(field.reshape(-1, self.n_source).T)
+        grad = estimate_gradients_2d_global(self.tri, values, maxiter=self.maxiter, tol=self.tol)
+
+        w_f, w_dx, w_dy = self.weights
+        field_interp = (w_f @ values + w_dx @ grad[:, :, 0] + w_dy @ grad[:, :, 1]).T
+        field_interp[:, ~self.valid] = np.nan
+
+        return field_interp.reshape(stack_shape + self.target_shape)
+
+    __call__ = regrid
+
+
+def _clough_tocher_directions(tri):
+    """
+    Affine invariant directions (g in scipy's implementation) along which the gradient of
+    the Clough-Tocher patch is linear on each edge, shape: (n_simplex, 3). They point to the 
+    centroid of the neighbouring simplex, or to the own centroid on the boundary.
+    """
+
+    centroids = tri.points[tri.simplices].mean(axis=1)
+    g = np.full(tri.simplices.shape, -0.5)
+    for k in range(3):
+        neighbors = tri.neighbors[:, k]
+        c = np.einsum('nij,nj->ni', tri.transform[:, :2], centroids[neighbors] - tri.transform[:, 2])
+        c = np.column_stack((c, 1 - c.sum(axis=1)))
+        i, j = (k + 2) % 3, (k + 1) % 3
+        g_k = (2 * c[:, i] + c[:, j] - 1) / (2 - 3 * c[:, i] - 3 * c[:, j])
+        g[:, k] = np.where(neighbors == -1, -0.5, g_k)
+
+    return g
+
+
+def _clough_tocher_eval(f, df, edges, g, b):
+    """
+    Evaluates Clough-Tocher patches, vectorized port of scipy's _clough_tocher_2d_single.
+    f: vertex values (n, 3, k), df: vertex gradients (n, 3, 2, k), edges: (3, 2, n), 
+    g: (n, 3), b: extended barycentric coordinates (n, 4). Returns shape (n, k).
+    """
+
+    e12x, e12y, e23x, e23y, e31x, e31y = edges.reshape(6, -1, 1)
+    g0, g1, g2 = g.T[..., None]
+    b1, b2, b3, b4 = b.T[..., None]
+    f1, f2, f3 = f[:, 0], f[:, 1], f[:, 2]
+
+    df12 = +(df[:, 0, 0] * e12x + df[:, 0, 1] * e12y)
+    df21 = -(df[:, 1, 0] * e12x + df[:, 1, 1] * e12y)
+    df23 = +(df[:, 1, 0] * e23x + df[:, 1, 1] * e23y)
+    df32 = -(df[:, 2, 0] * e23x + df[:, 2, 1] * e23y)
+    df31 = +(df[:, 2, 0] * e31x + df[:, 2, 1] * e31y)
+    df13 = -(df[:, 0, 0] * e31x + df[:, 0, 1] * e31y)
+
+    c3000 = f1
+    c2100 = (df12 + 3*c3000) / 3
+    c2010 = (df13 + 3*c3000) / 3
+    c0300 = f2
+    c1200 = (df21 + 3*c0300) / 3
+    c0210 = (df23 + 3*c0300) / 3
+    c0030 = f3
+    c1020 = (df31 + 3*c0030) / 3
+    c0120 = (df32 + 3*c0030) / 3
+
+    c2001 = (c2100 + c2010 + c3000) / 3
+    c0201 = (c1200 + c0300 + c0210) / 3
+    c0021 = (c1020 + c0120 + c0030) / 3
+
+    c0111 = (g0*(-c0300 + 3*c0210 - 3*c0120 + c0030) + (-c0300 + 2*c0210 - c0120 + c0021 + c0201)) / 2
+    c1011 = (g1*(-c0030 + 3*c1020 - 3*c2010 + c3000) + (-c0030 + 2*c1020 - c2010 + c2001 + c0021)) / 2
+    c1101 = (g2*(-c3000 + 3*c2100 - 3*c1200 + c0300) + (-c3000 + 2*c2100 - c1200 + c2001 + c0201)) / 2
+
+    c1002 = (c1101 + c1011 + c2001) / 3
+    c0102 = (c1101 + c0111 + c0201) / 3
+    c0012 = (c1011 + c0111 + c0021) / 3
+
+    c0003 = (c1002 + c0102 + c0012) / 3
+
+    # one of the four extended coordinates is zero, i.e. the point is in one of the three sub-triangles
+    return (b1**3*c3000 + 3*b1**2*b2*c2100 + 3*b1**2*b3*c2010 + 3*b1**2*b4*c2001
+            + 3*b1*b2**2*c1200 + 6*b1*b2*b4*c1101 + 3*b1*b3**2*c1020 + 6*b1*b3*b4*c1011
+            + 3*b1*b4**2*c1002 + b2**3*c0300 + 3*b2**2*b3*c0210 + 3*b2**2*b4*c0201
+            + 3*b2*b3**2*c0120 + 6*b2*b3*b4*c0111 + 3*b2*b4**2*c0102 + b3**3*c0030
+            + 3*b3**2*b4*c0021 + 3*b3*b4**2*c0012 + b4**3*c0003)
+
+
+def _target_coords(XX1, YY1):
+    XX1, YY1 = np.asarray(XX1), np.asarray(YY1)
+    # regular lon-lat target grids get 1d coordinates, anything else 2d ones
+    if np.all(XX1 == XX1[:1]) and np.all(YY1 == YY1[:, :1]):
+        return {'x': ('x', XX1[0]), 'y': ('y', YY1[:, 0])}
+    return {'lon': (('y', 'x'), XX1), 'lat': (('y', 'x'), YY1)}
+
+
+def _write_netcdf_chunk(ds, path):
+    tmp_path = path.with_suffix('.nc.tmp')
+    ds.to_netcdf(tmp_path)
+    os.replace(tmp_path, path)
+
+
+# progress of regrid_to_store in a NetCDF folder: n_time_done, the layout and the time axis
+NETCDF_PROGRESS = 'progress.json'
+
+
+def _read_progress(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_progress(path, progress):
+    tmp_path = path.with_suffix('.json.tmp')
+    with open(tmp_path, 'w') as f:
+        json.dump(progress, f)
+    os.replace(tmp_path, path)
+
+
+def _check_layout(store_path, stored, layout):
+    for key, value in layout.items():
+        if stored.get(key) != value:
+            raise ValueError(f'{store_path} was written with {key}={stored.get(key)!r}, not {value!r}. '
+                             f'Use the same settings to resume or overwrite=True.')
+
+
+def regrid_to_store(field, regridder, XX1, YY1, store_path, time_chunk=30, lvls=None, 
+                    dtype='float32', overwrite=False):
+    """
+    Description: 
+        Streams a (lazy) field from load_variable through a regridder into an on-disk store, 
+        one chunk of time steps at a time, so only one chunk is ever in memory. A path ending
+        in .zarr is written as a Zarr store, any other path as a folder of NetCDF files, one per
+        chunk (open it with xr.open_mfdataset). Every finished chunk is recorded in the store
+        with the layout of the store (time_chunk, lvls, dtype and grid shape) and the time axis,
+        in the Zarr attributes or in progress.json for NetCDF. Calling the function again after
+        a crash resumes from the last finished chunk. A store written with another layout or
+        time axis raises a ValueError, unless overwrite=True.
+    Parameters: 
+        field (xr.DataArray): quantity to interpolate, dims: (time, nz1 or nz, elem or nod2)
+        regridder (MeshRegridder or CubicRegridder): operator built for field's locations
+        XX1, YY1 (np.array): Coordinates of the target grid, shape: (ny, nx)
+        store_path (str): Output .zarr store or NetCDF folder
+        time_chunk (int): Number of time steps regridded and written at once
+        lvls (int): Number of Levels in z-direction to regrid. Starting from lvl=0. Default all.
+        dtype (str): Output dtype
+        overwrite (bool): Start from scratch even if store_path already has finished chunks
+    Returns:
+        store_path (Path): Path to the store
+    """
+
+    store_path = Path(store_path)
+    name = field.name if field.name is not None else 'field'
+    time_dim, lvl_dim = field.dims[:2]
+    if lvls is not None:
+        field = field.isel({lvl_dim: slice(None, lvls)})
+
+    n_time = field.sizes[time_dim]
+    coords = {lvl_dim: field[lvl_dim].values, **_target_coords(XX1, YY1)}
+    dims = (time_dim, lvl_dim, 'y', 'x')
+    shape = (n_time, field.sizes[lvl_dim]) + regridder.target_shape
+    # layout of the store, a resumed store must have been started with the same
+    layout = {'time_chunk': int(time_chunk), 'lvls': int(field.sizes[lvl_dim]), 'dtype': np.dtype(dtype).name,
+              'grid_shape': [int(n) for n in regridder.target_shape]}
+
+    if store_path.suffix == '.zarr':
+        import zarr
+        import dask.array as dsa
+
+        if overwrite or not store_path.exists():
+            data = dsa.zeros(shape, chunks=(time_chunk,) + shape[1:], dtype=dtype)
+            template = xr.Dataset({name: (dims, data)}, coords={time_dim: field[time_dim].values, **coords},
+                                  attrs={'n_time_done': 0, **layout})
+            template.to_zarr(store_path, mode='w', compute=False)
+            n_done = 0
+        else:
+            attrs = dict(zarr.open_group(store_path, mode='r').attrs)
+            _check_layout(store_path, attrs, layout)
+            n_done = attrs['n_time_done']
+            existing = xr.open_zarr(store_path)
+            if not np.array_equal(existing[time_dim].values, field[time_dim].values):
+                raise ValueError(f'{store_path} was written for a different time axis, use overwrite=True.')
+
+    else:
+        store_path.mkdir(parents=True, exist_ok=True)
+        progress_path = store_path / NETCDF_PROGRESS
+        times = [str(t) for t in field[time_dim].values]
+        progress = None if overwrite else _read_progress(progress_path)
+        if progress is None:
+            # chunks without a record of the run that wrote them can't be trusted
+            for f in store_path.glob('chunk_*.nc'):
+                f.unlink()
+            progress = {'n_time_done': 0, **layout, time_dim: times}
+            _write_progress(progress_path, progress)
+        else:
+            _check_layout(store_path, progress, layout)
+            if progress.get(time_dim) != times:
+                raise ValueError(f'{store_path} was written for a different time axis, use overwrite=True.')
+        n_done = progress['n_time_done']
+
+    for start in tqdm(range(n_done, n_time, time_chunk), desc='Regridding chunks', leave=False):
+        chunk = field.isel({time_dim: slice(start, start + time_chunk)})
+        data = regridder.regrid(chunk.values).astype(dtype)
+        ds = xr.Dataset({name: (dims, data)}, coords={time_dim: chunk[time_dim].values})
+
+        if store_path.suffix == '.zarr':
+            ds.to_zarr(store_path, region={time_dim: slice(start, start + len(data))})
+            # only mark the chunk as finished once its data are in the store
+            zarr.open_group(store_path, mode='a').attrs['n_time_done'] = start + len(data)
+        else:
+            ds = ds.assign_coords(coords)
+            _write_netcdf_chunk(ds, store_path / f'chunk_{start // time_chunk:06d}.nc')
+            progress['n_time_done'] = start + len(data)
+            _write_progress(progress_path, progress)
+
+    return store_path
+
+
+def regrid_dataarray(field, regridder, XX1, YY1, dtype=None):
+    """
+    Description: 
+        Lazy regridding of a (Dask backed) DataArray, e.g. the output of load_variable. The
+        regridder is applied blockwise with xr.apply_ufunc, so nothing is computed until the
+        result is, and the regridding runs in parallel on the Dask scheduler together with any
+        downstream reduction (e.g. regrid_dataarray(u, ...).mean('time')).
+    Parameters: 
+        field (xr.DataArray): quantity to interpolate, last dim: elem or nod2
+        regridder (MeshRegridder or CubicRegridder): operator built for field's locations
+        XX1, YY1 (np.array): Coordinates of the target grid, shape: (ny, nx)
+        dtype (str): Output dtype, defaults to float64
+    Returns:
+        field_interp (xr.DataArray): Lazy interpolated quantity, dims: (..., y, x)
+    """
+
+    space_dim = field.dims[-1]
+    if field.sizes[space_dim] > regridder.n_source:
+        field = field.isel({space_dim: slice(None, regridder.n_source)})
+
+    # every block needs the complete horizontal field
+    if field.chunks is not None:
+        field = field.chunk({space_dim: -1})
+
+    ny, nx = regridder.target_shape
+    dtype = np.dtype(dtype if dtype is not None else np.float64)
+
+    field_interp = xr.apply_ufunc(lambda values: regridder.regrid(values).astype(dtype, copy=False), 
+                                  field, 
+                                  input_core_dims=[[space_dim]], 
+                                  output_core_dims=[['y', 'x']],
+                                  dask='parallelized', 
+                                  output_dtypes=[dtype],
+                                  dask_gufunc_kwargs={'output_sizes': {'y': ny, 'x': nx}})
+
+    return field_interp.assign_coords(_target_coords(XX1, YY1))
 
 
 ### BELLOW THIS I'M TESTING ###
 
 
 
-def interp2d_np(field, mesh_triangulation, xx1, yy1):
-    interpolator = CloughTocher2DInterpolator(mesh_triangulation, field)
-    mesh2 = np.vstack((zz1.ravel(), yy1.ravel())).T.shape
-    field_interp = interpolator(mesh_2)
-    
+_worker_state = {}
 
-def interpolate_to_grid_day(u, xx0, yy0, XX1, YY1, lvls, method):
-    u_interp = np.zeros(shape=(ny, nx, lvls))
-    for lvl in range(lvls):
-        u_interp[:,:, lvl] = griddata(points=(xx0, yy0), 
-                               values=u[lvl, :], 
-                               xi=(XX1, YY1),
-                               method=method
-                                )
-    return u_interp
 
+def _attach_shared(name, shape, dtype):
+    shm = shared_memory.SharedMemory(name=name)
+    return shm, np.ndarray(shape, dtype=dtype, buffer=shm.buf)
 
-def interpolate_to_grid_mp(u, xx0, yy0, XX1, YY1, days, lvls, method, n_process=2):
+
+def _init_worker(src_spec, out_spec, regridder):
+    # the fields are never pickled, workers map the parent's shared memory blocks
+    _worker_state['src_shm'], _worker_state['src'] = _attach_shared(*src_spec)
+    _worker_state['out_shm'], _worker_state['out'] = _attach_shared(*out_spec)
+    _worker_state['regridder'] = regridder
+
+
+def _interpolate_slab(day, lvl):
+    state = _worker_state
+    state['out'][day, :, :, lvl] = state['regridder'](state['src'][day, lvl])
+
+
+def _interpolate_slab_star(args):
+    return _interpolate_slab(*args)
+
+
+def interpolate_to_grid_mp(u, xx0, yy0, XX1, YY1, days, lvls, method, n_process=2, chunksize=None):
     """
     Description: 
         Interpolates u from a grid of xx0, yy0 coordinates to a target grid of XX1, YY1 coordinates
-        using a specified method (nearest, linear, cubic).
+        using a specified method (nearest, linear, cubic). The (day, lvl) slabs are spread over a
+        pool of n_process workers. The source field and the output live in shared memory, so the
+        workers read their slab and write the result in place without pickling any field.
     Parameters: 
         u (np.array): quantity to interpolate, shape:(days, lvl, elem)
-        xx0, yy0 (np.array): Coordinates of the original grid, shape: (elem,)
+        xx0, yy0 (np.array): Coordinates of the original grid, shape: (elem,). xx0 can also be
+            a Mesh (yy0=None), then the node or element coordinates are picked to match field
         XX1, YY1 (np.array): Coordinates of the target grid, shape: (ny, nx) or (ny, nx), 
         days (int): Last day to interpolate to starting from day=0
         lvls (int): Number of Levels in z-direction to analyze. Starting from lvl=0.
         method (str): Interpolation method (nearest, linear, cubic)
+        n_process (int): Number of worker processes
+        chunksize (int): Number of slabs sent to a worker at once. Defaults to an even split
+            in about 4 chunks per worker.
     Returns:
-        field_interp (np.array): Interpolated quantity at target grid, shape:(day, ny, nx)
+        field_interp (np.array): Interpolated quantity at target grid, shape:(day, ny, nx, lvls),
+            empty if days or lvls select no time step or level
     """
 
+    if isinstance(xx0, Mesh):
+        u = xx0.trim(u)
+        xx0, yy0 = xx0.coordinates(u)
+
+    if isinstance(u, xr.DataArray) and 'elem' in u.dims:
+        u = u.isel(elem=slice(None, len(yy0)))
+
+    # this asumes shape is days, lvl, elem
+    elif not isinstance(u, xr.DataArray) and u.shape[2] > xx0.size:
+        u = u[:, :, :len(yy0)]
+
     #- Parameters
     ny = XX1.shape[0]
     nx = XX1.shape[1]
-    u_interp = np.zeros(shape=(days, ny, nx, lvls))
-
-    def interpolate_day(day):
-        u_day = u[day]
-        u_day_interp = np.zeros(shape=(ny, nx, lvls))
-        for lvl in range(lvls):
-            u_day_interp[:,:, lvl] = griddata(points=(xx0, yy0), 
-                                   values=u_day[lvl, :], 
-                                   xi=(XX1, YY1),
-                                   method=method
-                                    )
-        return u_day_interp
-    
-    #- Interpolation
-    with Pool(n_process) as p:
-        result = p.starmap(interpolate_day, tqdm(range(days), total=days), chunksize=1)
+    n_source = len(xx0)
+    # same selection as u[:days, :lvls] in interpolate_to_grid
+    days = len(range(u.shape[0])[:days])
+    lvls = len(range(u.shape[1])[:lvls])
+    if days == 0 or lvls == 0:
+        # shared memory blocks can't be empty
+        return np.empty((days, ny, nx, lvls), dtype=np.float64)
+    tasks = [(day, lvl) for day in range(days) for lvl in range(lvls)]
+    if chunksize is None:
+        chunksize = max(1, len(tasks) // (4 * n_process))
+
+    # the interpolation operator is built once here and shipped once to each worker
+    regridder = make_regridder(xx0, yy0, XX1, YY1, method)
+
+    src_shm = shared_memory.SharedMemory(create=True, size=days * lvls * n_source * 8)
+    out_shm = shared_memory.SharedMemory(create=True, size=days * ny * nx * lvls * 8)
+    try:
+        src = np.ndarray((days, lvls, n_source), dtype=np.float64, buffer=src_shm.buf)
+        src[:] = u[:days, :lvls]
+        src_spec = (src_shm.name, src.shape, src.dtype)
+        out_spec = (out_shm.name, (days, ny, nx, lvls), np.float64)
+
+        #- Interpolation
+        initargs = (src_spec, out_spec, regridder)
+        with Pool(n_process, initializer=_init_worker, initargs=initargs) as p:
+            for _ in tqdm(p.imap_unordered(_interpolate_slab_star, tasks, chunksize=chunksize), 
+                          total=len(tasks), desc='Interpolating slabs', leave=False):
+                pass
+
+        field_interp = np.ndarray(out_spec[1], dtype=np.float64, buffer=out_shm.buf).copy()
+        del src
+
+    finally:
+        src_shm.close()
+        src_shm.unlink()
+        out_shm.close()
+        out_shm.unlink()
         
-    return result
+    return field_interp
+
+
+instrument_module(globals())
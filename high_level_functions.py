@@ -1,41 +1,315 @@
+import json
+import os
+from pathlib import Path
+
 from data_loader import *
 from vertical_diagnostics import *
 import xarray as xr
 
+from dask.base import tokenize
+
+from cache import memoize
+from instrumentation import instrument_module, timer
 
-def vertical_diagnostics_all(results_path, year_1=None, year_f=None, verbose=False):
+
+@memoize(ignore=('verbose',), paths=('results_path',))
+def vertical_diagnostics_all(results_path, year_1=None, year_f=None, verbose=False, mesh=None):
     '''
     Compute all vertical diagnostics for a run and return them in a xr.Dataset.
+    If a Mesh is passed, its areas are used instead of reading them again
+    from the mesh diagnostics in results_path.
     
     '''
 
-    u = load_variable(results_path, 'u', year_1=year_1, year_f=year_f)
-    v = load_variable(results_path, 'v', year_1=year_1, year_f=year_f)
+    u = load_variable(results_path, 'u', year_1=year_1, year_f=year_f, reduce_dims='elem')
+    v = load_variable(results_path, 'v', year_1=year_1, year_f=year_f, reduce_dims='elem')
 
-    diag_variables = ['elem_area', 'nod_area']
-    elem_area, nod_area = get_mesh_diagnostics(results_path, diag_variables)
-    nod_area = nod_area.isel(nz=0)
+    if mesh is None:
+        mesh = Mesh(data_path=results_path)
+    elem_area, nod_area = mesh.elem_area, mesh.nod_area
 
 
     if verbose:
         print('Computing eke...')
-    eke = mean_EKE(u, v, elem_area).compute()
+    with timer('vertical_diagnostics_all.eke'):
+        eke = mean_EKE(u, v, elem_area).compute()
 
     del u, v
 
-    temp = load_variable(results_path, 'temp', year_1=year_1, year_f=year_f)
-    w = load_variable(results_path, 'w', year_1=year_1, year_f=year_f)
+    temp = load_variable(results_path, 'temp', year_1=year_1, year_f=year_f, reduce_dims='nod2')
+    w = load_variable(results_path, 'w', year_1=year_1, year_f=year_f, reduce_dims='nod2')
     
     if verbose:
         print('Computing buoy_flux...')
-    buoy_flux = mean_buyoancy(w, temp, nod_area).compute()
+    with timer('vertical_diagnostics_all.buoy_flux'):
+        buoy_flux = mean_buyoancy(w, temp, nod_area).compute()
 
     del temp
 
     if verbose:
         print('Computing w_rms...')
-    w_rms = RMS_vertical_velocity(w, nod_area).compute()
+    with timer('vertical_diagnostics_all.w_rms'):
+        w_rms = RMS_vertical_velocity(w, nod_area).compute()
 
     ds_diags = xr.merge([{'w_rms': w_rms}, {'eke': eke}, {'buoy_flux': buoy_flux}]) 
 
-    return ds_diags
\ No newline at end of file
+    return ds_diags
+
+def accumulate_year(results_path, year, time_chunk=None, alpha=0.00025, accumulators=None, memory_budget=None):
+    '''
+    Folds one year of output into the accumulators of the vertical diagnostics
+    (see DiagnosticAccumulator). u, v, temp and w are read once, one Dask time
+    chunk at a time (see time_segments): chunks of time_chunk time steps, or 
+    by default the chunks load_variable chooses within memory_budget. The 
+    returned accumulators can be saved and merged with the ones from other 
+    years, e.g. computed by other jobs.
+
+    Parameters
+    ----------
+    results_path : str
+        Path to results folder.
+    year : int
+        Year to process.
+    time_chunk : int, optional
+        Number of time steps read at once. By default chosen by load_variable
+        (chunks='auto'), see memory_budget.
+    alpha : float, default=0.00025
+        Thermal coefficient used in the calculation of buoyancy from temperature.
+    accumulators : dict, optional
+        Accumulators to update in place instead of starting new ones.
+    memory_budget : int or str, optional
+        Maximum size of a chunk of each variable when time_chunk is not given,
+        see load_variable. Defaults to Dask's array.chunk-size.
+
+    Returns
+    -------
+    dict
+        EKEAccumulator, WRMSAccumulator and BuoyancyFluxAccumulator keyed by 
+        diagnostic name.
+    '''
+
+    if accumulators is None:
+        accumulators = {'w_rms': WRMSAccumulator(), 'eke': EKEAccumulator(), 
+                        'buoy_flux': BuoyancyFluxAccumulator(alpha=alpha)}
+
+    # the accumulators reduce over time per location, keep the horizontal whole
+    reduce_dims = {'u': 'elem', 'v': 'elem', 'temp': 'nod2', 'w': 'nod2'}
+    chunks = 'auto' if time_chunk is None else {'time': time_chunk}
+    fields = {var: load_variable(results_path, var, year_1=year, year_f=year, chunks=chunks, 
+                                 reduce_dims=dims, memory_budget=memory_budget)
+              for var, dims in reduce_dims.items()}
+
+    for start, stop in time_segments(*fields.values()):
+        chunk = {var: field.isel(time=slice(start, stop)).load() for var, field in fields.items()}
+        accumulators['eke'].update(chunk['u'], chunk['v'])
+        accumulators['w_rms'].update(chunk['w'])
+        accumulators['buoy_flux'].update(chunk['w'], chunk['temp'])
+
+    for acc in accumulators.values():
+        acc.years = sorted(set(acc.years) | {year})
+
+    return accumulators
+
+
+def diagnostics_from_accumulators(accumulators, mesh):
+    '''
+    Builds the vertical diagnostics Dataset (as returned by vertical_diagnostics_all)
+    from merged accumulators.
+
+    Parameters
+    ----------
+    accumulators : dict
+        Accumulators keyed by diagnostic name, e.g. from merge_accumulators.
+    mesh : Mesh
+        Mesh with data_path, to take the areas from.
+
+    Returns
+    -------
+    xr.Dataset
+    '''
+
+    profiles = [accumulators[name].result(mesh) for name in ['w_rms', 'eke', 'buoy_flux']]
+    ds_diags = xr.merge(profiles)
+    ds_diags.attrs['years'] = accumulators['eke'].years
+
+    return ds_diags
+
+
+@memoize(ignore=('verbose',), paths=('results_path',))
+def vertical_diagnostics_streaming(results_path, year_1=None, year_f=None, time_chunk=None, verbose=False, mesh=None, alpha=0.00025):
+    '''
+    Same diagnostics as vertical_diagnostics_all, computed in a single pass over
+    the data. The yearly files are walked year by year and, within a year, in 
+    time chunks (time_chunk time steps, or by default the Dask chunks 
+    load_variable chooses). For each chunk, u, v, temp and w are read once and
+    folded into running moments per level and location (see accumulate_year).
+    The profiles are built from the moments at the end, so memory is bounded
+    by one time chunk of the four variables.
+
+    The result is the same as vertical_diagnostics_all as long as the land mask 
+    (the NaN values) does not change in time.
+
+    Parameters
+    ----------
+    results_path : str
+        Path to results folder.
+    year_1, year_f : int, optional
+        First and last year to include.
+    time_chunk : int, optional
+        Number of time steps read at once. By default the time chunks chosen
+        by load_variable within Dask's array.chunk-size.
+    verbose : bool
+        Print progress.
+    mesh : Mesh, optional
+        Mesh to take the areas from. Read from results_path if not given.
+    alpha : float, default=0.00025
+        Thermal coefficient used in the calculation of buoyancy from temperature.
+
+    Returns
+    -------
+    xr.Dataset
+    '''
+
+    if mesh is None:
+        mesh = Mesh(data_path=results_path)
+
+    accumulators = None
+    for year in get_yearly_files(results_path, 'u', year_1, year_f):
+        if verbose:
+            print(f'Reading {year}...')
+        accumulators = accumulate_year(results_path, year, time_chunk, alpha, accumulators)
+
+    return diagnostics_from_accumulators(accumulators, mesh)
+
+
+def write_atomic(ds, output_path):
+    '''
+    Writes ds to a temporary file next to output_path and moves it in place, so
+    an interrupted job never leaves a truncated file behind.
+    '''
+    output_path = Path(output_path)
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = output_path.with_name(f'.{output_path.name}.{os.getpid()}.tmp')
+    try:
+        ds.to_netcdf(tmp_path)
+        os.replace(tmp_path, output_path)
+    finally:
+        if tmp_path.exists():
+            tmp_path.unlink()
+
+
+def _year_fingerprints(results_path, year_1=None, year_f=None):
+    # size and modification time of the u, v, temp and w files of each year
+    fingerprints = {}
+    for var in ['u', 'v', 'temp', 'w']:
+        for year, file_path in get_yearly_files(results_path, var, year_1, year_f).items():
+            stat = os.stat(file_path)
+            fingerprints.setdefault(str(year), []).append(f'{var}:{stat.st_size}:{stat.st_mtime_ns}')
+    return {year: ' '.join(values) for year, values in fingerprints.items()}
+
+
+def vertical_diagnostics_incremental(results_path, output_path, year_1=None, year_f=None, time_chunk=None,
+                                     verbose=False, mesh=None, alpha=0.00025, attrs=None):
+    '''
+    Updates the vertical diagnostics stored in output_path with the years of
+    results_path that are not in it yet. Besides the profiles, the file keeps the
+    state of the accumulators (see accumulators_to_dataset), the years they
+    cover with the size and modification time of their files, and the run and
+    mesh they come from, so only the new yearly files are read and folded in (see
+    accumulate_year). The accumulators cannot take a year out again, so the
+    diagnostics are computed from scratch if output_path does not exist, covers
+    years outside year_1 to year_f, comes from another run or mesh, or if a
+    stored year's files changed since (e.g. they were still being written). The
+    file is rewritten atomically.
+
+    Parameters
+    ----------
+    results_path : str
+        Path to results folder.
+    output_path : str or Path
+        Diagnostics file, e.g. profile_diags.nc.
+    year_1, year_f : int, optional
+        First and last year to include.
+    time_chunk : int, optional
+        Number of time steps read at once. By default the time chunks chosen
+        by load_variable within Dask's array.chunk-size.
+    verbose : bool
+        Print progress.
+    mesh : Mesh, optional
+        Mesh to take the areas from. Read from results_path if not given.
+    alpha : float, default=0.00025
+        Thermal coefficient used in the calculation of buoyancy from temperature.
+    attrs : dict, optional
+        Extra global attributes for the file.
+
+    Returns
+    -------
+    xr.Dataset
+        Profiles and accumulator state, as stored in output_path.
+    '''
+
+    if mesh is None:
+        mesh = Mesh(data_path=results_path)
+    attrs = attrs or {}
+
+    accumulators, old_attrs = {}, {}
+    if Path(output_path).exists():
+        with xr.open_dataset(output_path) as ds_old:
+            accumulators = accumulators_from_dataset(ds_old.load())
+            old_attrs = ds_old.attrs
+
+    source = str(Path(results_path).resolve())
+    mesh_token = tokenize(mesh)
+    fingerprints = _year_fingerprints(results_path, year_1, year_f)
+    try:
+        stored_fingerprints = json.loads(old_attrs.get('state_fingerprints', '{}'))
+    except (TypeError, ValueError):
+        stored_fingerprints = {}
+
+    done = set(accumulators['eke'].years) if len(accumulators) == len(ACCUMULATORS) else None
+    in_range = lambda year: (year_1 is None or year >= year_1) and (year_f is None or year <= year_f)
+    if done is not None:
+        changed = [year for year in done if stored_fingerprints.get(str(year)) != fingerprints.get(str(year))]
+        reason = None
+        if not all(map(in_range, done)):
+            reason = 'the requested years'
+        elif accumulators['buoy_flux'].alpha != alpha:
+            reason = 'alpha'
+        elif old_attrs.get('state_source') != source or old_attrs.get('state_mesh') != mesh_token:
+            reason = 'this run or mesh'
+        elif changed:
+            reason = f'the files of {sorted(changed)}, which changed'
+        if reason is not None:
+            if verbose:
+                print(f'Stored diagnostics do not match {reason}, recomputing...')
+            done = None
+    if done is None:
+        accumulators, done = None, set()
+
+    new_years = [year for year in get_yearly_files(results_path, 'u', year_1, year_f) if year not in done]
+    for year in new_years:
+        if verbose:
+            print(f'Reading {year}...')
+        accumulators = accumulate_year(results_path, year, time_chunk, alpha, accumulators)
+
+    if accumulators is None:
+        raise FileNotFoundError(f'No yearly files found in {results_path}')
+
+    ds_diags = xr.merge([diagnostics_from_accumulators(accumulators, mesh), accumulators_to_dataset(accumulators)],
+                        combine_attrs='drop_conflicts')
+    ds_diags.attrs.update(attrs)
+    ds_diags.attrs.update({
+        'state_source': source,
+        'state_mesh': mesh_token,
+        'state_fingerprints': json.dumps({str(year): fingerprints.get(str(year))
+                                          for year in accumulators['eke'].years}),
+    })
+
+    unchanged = not new_years and all(np.array_equal(old_attrs.get(key), value) for key, value in attrs.items())
+    if not unchanged:
+        write_atomic(ds_diags, output_path)
+
+    return ds_diags
+
+
+instrument_module(globals())
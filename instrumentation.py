@@ -0,0 +1,247 @@
+'''
+Lightweight instrumentation of the analysis pipeline. When enabled, every call of
+an instrumented function (the public functions of data_loader, gridding,
+vertical_diagnostics and high_level_functions) and every timer block is recorded
+with its wall time, the bytes read from disk, the peak RSS of the process and the
+number of Dask tasks executed, and counters can be incremented from anywhere.
+The records can be exported as JSON or in the Chrome trace format (open it in
+chrome://tracing or https://ui.perfetto.dev).
+
+It is disabled by default, or enabled with the environment variable
+FESOM2TOY_PROFILE=1. When disabled, instrumented functions only check a flag
+and timers are a shared no-op context manager.
+
+    import instrumentation
+    with instrumentation.profiling():
+        ds = vertical_diagnostics_all(results_path)
+    instrumentation.export_chrome_trace('trace.json')
+'''
+import functools
+import inspect
+import json
+import os
+import threading
+from collections import defaultdict
+from contextlib import contextmanager, nullcontext
+from time import perf_counter
+
+try:
+    import resource
+except ImportError:
+    # not available on Windows, the peak RSS is just not recorded
+    resource = None
+
+
+class _State:
+    def __init__(self):
+        self.enabled = os.environ.get('FESOM2TOY_PROFILE', '0').lower() in ('1', 'true', 'yes', 'on')
+        self.events = []
+        self.counters = defaultdict(float)
+        self.origin = perf_counter()
+        self.dask_callback = None
+
+
+_state = _State()
+_local = threading.local()
+_NULL = nullcontext()
+
+
+def _bytes_read():
+    # rchar counts all the bytes read by the process, also from the page cache
+    try:
+        with open('/proc/self/io') as f:
+            for line in f:
+                if line.startswith('rchar:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def _peak_rss():
+    if resource is None:
+        return None
+    # kB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def _start_dask_callback():
+    try:
+        from dask.callbacks import Callback
+    except ImportError:
+        return None
+
+    class TaskCounter(Callback):
+        def _posttask(self, key, result, dsk, state, worker_id):
+            _state.counters['dask.tasks'] += 1
+
+    callback = TaskCounter()
+    callback.register()
+    return callback
+
+
+def enable():
+    '''Starts recording.'''
+    _state.enabled = True
+    if _state.dask_callback is None:
+        _state.dask_callback = _start_dask_callback()
+
+
+def disable():
+    '''Stops recording. The records are kept until reset.'''
+    _state.enabled = False
+    if _state.dask_callback is not None:
+        _state.dask_callback.unregister()
+        _state.dask_callback = None
+
+
+if _state.enabled:
+    enable()
+
+
+def is_enabled():
+    return _state.enabled
+
+
+def reset():
+    '''Removes all the records.'''
+    _state.events.clear()
+    _state.counters.clear()
+    _state.origin = perf_counter()
+
+
+@contextmanager
+def profiling(reset_records=True):
+    '''
+    Enables the instrumentation inside the block, starting from empty records.
+    '''
+    was_enabled = _state.enabled
+    if reset_records:
+        reset()
+    enable()
+    try:
+        yield
+    finally:
+        if not was_enabled:
+            disable()
+
+
+def count(name, value=1):
+    '''Increments a counter, if the instrumentation is enabled.'''
+    if _state.enabled:
+        _state.counters[name] += value
+
+
+@contextmanager
+def _record(name, category, args):
+    depth = getattr(_local, 'depth', 0)
+    _local.depth = depth + 1
+    tasks = _state.counters['dask.tasks']
+    bytes_start = _bytes_read()
+    start = perf_counter()
+    try:
+        yield
+    finally:
+        end = perf_counter()
+        _local.depth = depth
+        bytes_end = _bytes_read()
+        _state.events.append({
+            'name': name,
+            'category': category,
+            'start': start - _state.origin,
+            'duration': end - start,
+            'depth': depth,
+            'pid': os.getpid(),
+            'tid': threading.get_ident(),
+            'bytes_read': None if bytes_start is None else bytes_end - bytes_start,
+            'peak_rss': _peak_rss(),
+            'dask_tasks': int(_state.counters['dask.tasks'] - tasks),
+            'args': args,
+        })
+
+
+def timer(name, category='block', **args):
+    '''
+    Context manager recording the block as an event named name. Extra keyword
+    arguments are stored with the event. A no-op when disabled.
+    '''
+    if not _state.enabled:
+        return _NULL
+    return _record(name, category, args)
+
+
+def instrument(func):
+    '''
+    Decorator recording every call of func as an event, see timer.
+    '''
+    name = f'{func.__module__}.{func.__qualname__}'
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not _state.enabled:
+            return func(*args, **kwargs)
+        with _record(name, 'function', {}):
+            return func(*args, **kwargs)
+
+    wrapper.__wrapped_instrumented__ = True
+    return wrapper
+
+
+def instrument_module(namespace):
+    '''
+    Instruments all the public functions defined in the module with the given
+    globals(), to be called at the end of the module.
+    '''
+    module = namespace['__name__']
+    for name, value in list(namespace.items()):
+        if name.startswith('_') or not inspect.isfunction(value) or value.__module__ != module:
+            continue
+        if getattr(value, '__wrapped_instrumented__', False):
+            continue
+        namespace[name] = instrument(value)
+
+
+def summary():
+    '''
+    Number of calls, total time, bytes read and Dask tasks of each event name,
+    sorted by total time.
+    '''
+    totals = {}
+    for event in _state.events:
+        total = totals.setdefault(event['name'], {'calls': 0, 'time': 0.0, 'bytes_read': 0, 'dask_tasks': 0})
+        total['calls'] += 1
+        total['time'] += event['duration']
+        total['bytes_read'] += event['bytes_read'] or 0
+        total['dask_tasks'] += event['dask_tasks']
+
+    return dict(sorted(totals.items(), key=lambda item: -item[1]['time']))
+
+
+def export_json(path):
+    '''
+    Writes the events, counters and summary to a JSON file.
+    '''
+    with open(path, 'w') as f:
+        json.dump({'events': _state.events, 'counters': dict(_state.counters), 'summary': summary(),
+                   'peak_rss': _peak_rss()}, f, indent=1)
+
+
+def export_chrome_trace(path):
+    '''
+    Writes the events in the Chrome trace event format, with the counters as
+    metadata.
+    '''
+    trace_events = [{
+        'name': event['name'],
+        'cat': event['category'],
+        'ph': 'X',
+        'ts': event['start'] * 1e6,
+        'dur': event['duration'] * 1e6,
+        'pid': event['pid'],
+        'tid': event['tid'],
+        'args': {key: event[key] for key in ('bytes_read', 'peak_rss', 'dask_tasks')} | event['args'],
+    } for event in _state.events]
+
+    with open(path, 'w') as f:
+        json.dump({'traceEvents': trace_events, 'displayTimeUnit': 'ms',
+                   'otherData': {'counters': dict(_state.counters)}}, f)
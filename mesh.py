@@ -0,0 +1,345 @@
+import json
+import os
+import hashlib
+from functools import cached_property
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+from matplotlib.tri import Triangulation
+
+
+MESH_FILES = ('nod2d.out', 'elem2d.out')
+CACHE_FOLDER = '.mesh_cache'
+USER_CACHE_DIR = Path(os.environ.get('XDG_CACHE_HOME', Path.home() / '.cache')) / 'fesom2toyanalysis'
+
+
+def _parse_ascii(file_path, usecols, dtype):
+    # pandas' C parser is much faster than np.loadtxt for the large FESOM ascii files
+    table = pd.read_csv(file_path, sep=r'\s+', header=None, skiprows=1,
+                        usecols=usecols, dtype=dtype, engine='c')
+    return table.to_numpy()
+
+
+def _fingerprint(file_path, validate='stat'):
+    stat = os.stat(file_path)
+    fingerprint = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+    if validate == 'hash':
+        digest = hashlib.sha1()
+        with open(file_path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 24), b''):
+                digest.update(block)
+        fingerprint['sha1'] = digest.hexdigest()
+
+    return fingerprint
+
+
+def get_cache_dir(mesh_path, cache_dir=None):
+    '''
+    Returns the folder where the binary cache for the mesh in mesh_path lives. By
+    default this is a hidden folder next to the mesh files. If the mesh folder is
+    not writable, a folder inside the user cache directory is used instead.
+
+    Parameters
+    ----------
+    mesh_path : str or Path
+        Path to folder where nod2d.out and elem2d.out files for the mesh are located.
+    cache_dir : str or Path, optional
+        Explicit cache folder. Overrides the default location.
+
+    Returns
+    -------
+    Path
+    '''
+
+    if cache_dir is not None:
+        return Path(cache_dir)
+
+    mesh_path = Path(mesh_path).resolve()
+    if os.access(mesh_path, os.W_OK):
+        return mesh_path / CACHE_FOLDER
+
+    key = hashlib.sha1(str(mesh_path).encode()).hexdigest()[:16]
+    return USER_CACHE_DIR / 'mesh' / key
+
+
+def _save_array(path, array):
+    tmp_path = path.with_suffix('.tmp.npy')
+    np.save(tmp_path, array)
+    os.replace(tmp_path, path)
+
+
+def read_mesh(mesh_path, cache=True, cache_dir=None, validate='stat'):
+    '''
+    Reads the node coordinates and the elements of a FESOM2 mesh. The ascii files are
+    parsed once and stored as .npy files in a cache folder (see get_cache_dir). Later
+    calls memory-map the cached arrays. The cache is rebuilt when the size or the
+    modification time of nod2d.out or elem2d.out changes, or their content hash if
+    validate='hash'.
+
+    Parameters
+    ----------
+    mesh_path : str or Path
+        Path to folder where nod2d.out and elem2d.out files for the mesh are located.
+    cache : bool, default=True
+        Whether to use (and write) the binary cache.
+    cache_dir : str or Path, optional
+        Folder for the binary cache. See get_cache_dir for the default.
+    validate : {'stat', 'hash'}, default='stat'
+        How to check that the cache is still current. 'hash' reads the ascii files
+        completely, so it is only worth it if mtimes are unreliable.
+
+    Returns
+    -------
+    nodes : ndarray
+        Node coordinates with shape (2, n_nodes).
+    elems : ndarray
+        Zero based node indices of each triangle with shape (n_elems, 3).
+    '''
+
+    mesh_path = Path(mesh_path)
+    source_files = [mesh_path / name for name in MESH_FILES]
+
+    if cache:
+        cache_path = get_cache_dir(mesh_path, cache_dir)
+        meta_path = cache_path / 'meta.json'
+        fingerprints = {f.name: _fingerprint(f, validate) for f in source_files}
+
+        try:
+            with open(meta_path) as f:
+                cached = json.load(f)
+            if cached == fingerprints:
+                nodes = np.load(cache_path / 'nodes.npy', mmap_mode='r')
+                elems = np.load(cache_path / 'elems.npy', mmap_mode='r')
+                return nodes, elems
+        except (OSError, ValueError):
+            pass
+
+    nodes = np.ascontiguousarray(_parse_ascii(source_files[0], [1, 2], np.float64).T)
+    elems = _parse_ascii(source_files[1], [0, 1, 2], np.int64) - 1
+
+    # int32 is enough for any FESOM mesh and halves the cache size
+    if elems.size == 0 or elems.max() < np.iinfo(np.int32).max:
+        elems = elems.astype(np.int32)
+
+    if cache:
+        try:
+            cache_path.mkdir(parents=True, exist_ok=True)
+            _save_array(cache_path / 'nodes.npy', nodes)
+            _save_array(cache_path / 'elems.npy', elems)
+            tmp_meta_path = meta_path.with_suffix('.tmp')
+            with open(tmp_meta_path, 'w') as f:
+                json.dump(fingerprints, f)
+            os.replace(tmp_meta_path, meta_path)
+        except OSError:
+            # a read only cache location is not a reason to fail loading the mesh
+            pass
+
+    return nodes, elems
+
+
+def compute_centroids(nodes, elems):
+    '''
+    Computes the centroids of the mesh triangles with a single gather of the
+    vertex coordinates and a reduction over the three vertices.
+
+    Parameters
+    ----------
+    nodes : ndarray
+        Node coordinates with shape (2, n_nodes), as loaded from nod2d.out.
+    elems : ndarray
+        Zero based node indices of each triangle with shape (n_elems, 3).
+
+    Returns
+    -------
+    lon_elems, lat_elems : ndarray
+        x and y coordinates of the centroid of each element.
+    '''
+
+    # (2, n_elems, 3) gather, then mean over the vertices
+    lon_elems, lat_elems = nodes[:, elems].sum(axis=-1) / 3
+    return lon_elems, lat_elems
+
+
+def soufflet_n_elems(lat_nodes, n_elems):
+    '''
+    Number of elements left after dropping the two westernmost columns of elements
+    of a Soufflet channel mesh, which close the zonal periodicity using the indices
+    of the eastern nodes (see the comment in data_loader.get_mesh_coordinates).
+
+    Parameters
+    ----------
+    lat_nodes : ndarray
+        y coordinates of the mesh nodes.
+    n_elems : int
+        Total number of elements in elem2d.out.
+
+    Returns
+    -------
+    int
+    '''
+
+    # works for me, may have to be addapted depending on mesh generation strategy? 
+    ny = np.where(lat_nodes == lat_nodes.max())[0][0] + 1
+    return n_elems - (ny * 2 - 2)
+
+
+class Mesh:
+    '''
+    FESOM2 mesh with everything the analysis functions need from it. Each part is
+    loaded the first time it is accessed and kept afterwards, so a single Mesh can
+    be built once and passed to the functions in data_loader, gridding, 
+    vertical_diagnostics, high_level_functions and plotting.
+
+    Parameters
+    ----------
+    mesh_path : str or Path, optional
+        Path to folder where nod2d.out and elem2d.out files for the mesh are located.
+        Only needed for the geometry (nodes, elements, centroids, triangulation).
+    data_path : str or Path, optional
+        Path to results folder with the fesom.mesh.diag.nc file. Only needed for the
+        areas.
+    soufflet : bool
+        Wheter the mesh is for the Soufflet configuration. If True, the wrap-around
+        elements closing the zonal periodicity are dropped (see soufflet_n_elems).
+    cache : bool, default=True
+        Read the mesh through the binary cache of read_mesh.
+    cache_dir : str or Path, optional
+        Folder for the binary cache. See get_cache_dir for the default.
+
+    Attributes
+    ----------
+    nodes : ndarray
+        Node coordinates, shape (2, n_nodes).
+    elems : ndarray
+        Zero based node indices of all the elements, shape (n_elems, 3).
+    elem_mask : ndarray
+        Boolean mask of the elements kept after the periodic trimming.
+    centroids : ndarray
+        Centroid coordinates of the kept elements, shape (2, n_kept).
+    triangulation : Triangulation
+        Triangulation of the kept elements.
+    elem_area, nod_area : DataArray
+        Areas from the mesh diagnostics. nod_area is taken at the surface level.
+    '''
+
+    def __init__(self, mesh_path=None, data_path=None, soufflet=False, cache=True, cache_dir=None):
+        self.mesh_path = mesh_path
+        self.data_path = data_path
+        self.soufflet = soufflet
+        self.cache = cache
+        self.cache_dir = cache_dir
+
+    def __repr__(self):
+        return f'Mesh(mesh_path={self.mesh_path!r}, data_path={self.data_path!r}, soufflet={self.soufflet})'
+
+    def __dask_tokenize__(self):
+        # identifies the mesh by its files, e.g. for the keys of cache.memoize
+        files = []
+        if self.mesh_path is not None:
+            files += [Path(self.mesh_path) / name for name in MESH_FILES]
+        if self.data_path is not None:
+            files.append(Path(self.data_path) / 'fesom.mesh.diag.nc')
+        return ('Mesh', self.soufflet, [(str(f), _fingerprint(f)) for f in files if f.exists()])
+
+    @cached_property
+    def _arrays(self):
+        if self.mesh_path is None:
+            raise ValueError('Mesh was created without mesh_path, the mesh geometry is not available.')
+        return read_mesh(self.mesh_path, cache=self.cache, cache_dir=self.cache_dir)
+
+    @property
+    def nodes(self):
+        return self._arrays[0]
+
+    @property
+    def elems(self):
+        return self._arrays[1]
+
+    @property
+    def lon_nodes(self):
+        return self.nodes[0]
+
+    @property
+    def lat_nodes(self):
+        return self.nodes[1]
+
+    @property
+    def n_nodes(self):
+        return self.nodes.shape[1]
+
+    @cached_property
+    def n_elems(self):
+        '''Number of elements kept after the periodic trimming.'''
+        if self.soufflet:
+            return soufflet_n_elems(self.lat_nodes, len(self.elems))
+        return len(self.elems)
+
+    @cached_property
+    def elem_mask(self):
+        mask = np.zeros(len(self.elems), dtype=bool)
+        mask[:self.n_elems] = True
+        return mask
+
+    @cached_property
+    def centroids(self):
+        return np.vstack(compute_centroids(self.nodes, self.elems[:self.n_elems]))
+
+    @property
+    def lon_elems(self):
+        return self.centroids[0]
+
+    @property
+    def lat_elems(self):
+        return self.centroids[1]
+
+    @cached_property
+    def triangulation(self):
+        return Triangulation(self.lon_nodes, self.lat_nodes, self.elems[:self.n_elems])
+
+    @cached_property
+    def mesh_diag(self):
+        if self.data_path is None:
+            raise ValueError('Mesh was created without data_path, the mesh diagnostics are not available.')
+        return xr.open_dataset(Path(self.data_path) / 'fesom.mesh.diag.nc')
+
+    @cached_property
+    def elem_area(self):
+        return self.mesh_diag['elem_area'].load()
+
+    @cached_property
+    def nod_area(self):
+        # for the toy configurations all depth layers have the same node areas
+        nod_area = self.mesh_diag['nod_area']
+        if 'nz' in nod_area.dims:
+            nod_area = nod_area.isel(nz=0)
+        return nod_area.load()
+
+    def coordinates(self, field):
+        '''
+        Returns the x and y coordinates matching the location (nodes or elements)
+        of field, decided from its 'nod2'/'elem' dimension or, for plain arrays, 
+        from the size of its last axis.
+        '''
+        if self.location(field) == 'elem':
+            return self.lon_elems, self.lat_elems
+        return self.lon_nodes, self.lat_nodes
+
+    def location(self, field):
+        if isinstance(field, xr.DataArray):
+            return 'elem' if 'elem' in field.dims else 'nod2'
+        return 'nod2' if np.shape(field)[-1] == self.n_nodes else 'elem'
+
+    def trim(self, field):
+        '''
+        Drops the wrap-around elements from a field defined over elements. Fields
+        over nodes, or already trimmed, are returned unchanged.
+        '''
+        if isinstance(field, xr.DataArray):
+            if 'elem' in field.dims and field.sizes['elem'] > self.n_elems:
+                field = field.isel(elem=slice(None, self.n_elems))
+        elif self.location(field) == 'elem' and np.shape(field)[-1] > self.n_elems:
+            field = field[..., :self.n_elems]
+
+        return field
@@ -0,0 +1,39 @@
+'''
+Fast writer of the ascii mesh files of the generators in mesh_generation/.
+'''
+import numpy as np
+
+
+def write_table(f, fmt, columns, header=None, block_size=100_000):
+    '''
+    Writes one line per row of the columns, formatted with fmt, which is the
+    printf style format of one line without the newline, e.g. '%8d %8.4f'. The
+    rows are formatted by blocks with a single string formatting, which is much
+    faster than np.savetxt formatting them one by one. Integer columns are kept
+    as integers, which format faster than floats.
+
+    Parameters
+    ----------
+    f : file
+        File opened for writing in text mode.
+    fmt : str
+        Format of one row.
+    columns : list of ndarray
+        Columns of the same length.
+    header : str
+        Line written before the rows.
+    block_size : int
+        Number of rows formatted at once.
+    '''
+    columns = [np.asarray(column) for column in columns]
+    if header is not None:
+        f.write(f'{header}\n')
+
+    line = fmt + '\n'
+    n_columns = len(columns)
+    for start in range(0, len(columns[0]), block_size):
+        n_rows = len(columns[0][start:start + block_size])
+        values = [None] * (n_rows * n_columns)
+        for c, column in enumerate(columns):
+            values[c::n_columns] = column[start:start + block_size].tolist()
+        f.write((line * n_rows) % tuple(values))
@@ -0,0 +1,307 @@
+'''
+Generator of regular triangular meshes of convex polygon basins, the generic
+version of mesh2d_dbgyre.py. The nodes lie on a lattice aligned with the first
+side of the polygon, with right triangles (like the double gyre) or
+equilateral ones (like the Soufflet channel). Every row of the lattice crosses
+the basin along an interval that is computed from the sides, so only the nodes
+inside the basin are ever created and the cost is linear in the number of nodes.
+The vertical levels are written like the scripts write them, to aux3d.out or to
+depth.out.
+
+Coordinates, dx and the polygon are in degrees and are treated as Cartesian,
+like in mesh2d_dbgyre.py.
+
+    from mesh_generation.basin import rotated_rectangle, write_basin_mesh
+    polygon = rotated_rectangle((0, 30), 20 * np.sqrt(2), 15 * np.sqrt(2), angle=-45)
+    write_basin_mesh('meshes/box', polygon, dx=0.01, nl=41, H=4000, alpha=1.1)
+
+or from the repository root:
+
+    python -m mesh_generation.basin meshes/hexagon --polygon 0,0 2,-1 4,0 4,2 2,3 0,2 --dx 0.05
+'''
+import argparse
+from pathlib import Path
+
+import numpy as np
+
+from mesh_generation.ascii import write_table
+from mesh_generation.soufflet import soufflet_levels
+
+
+def _cross(a, b):
+    return a[0] * b[1] - a[1] * b[0]
+
+
+def rotated_rectangle(origin, length, width, angle=0):
+    '''
+    Corners of a rectangle with a corner at origin, its side of the given length
+    at angle degrees from the x axis and its other side to the left of it.
+    '''
+    angle = np.deg2rad(angle)
+    along = np.array([np.cos(angle), np.sin(angle)])
+    across = np.array([-np.sin(angle), np.cos(angle)])
+    origin = np.asarray(origin, dtype=float)
+    return np.array([origin, origin + length * along, origin + length * along + width * across,
+                     origin + width * across])
+
+
+def as_polygon(polygon):
+    '''
+    Vertices of a convex polygon as an array with shape (n, 2), counterclockwise.
+    Raises ValueError if the polygon is not convex.
+    '''
+    polygon = np.asarray(polygon, dtype=float)
+    if polygon.ndim != 2 or polygon.shape[1] != 2 or len(polygon) < 3:
+        raise ValueError('The polygon must be given as at least 3 (x, y) vertices.')
+
+    sides = np.roll(polygon, -1, axis=0) - polygon
+    turns = _cross(sides.T, np.roll(sides, -1, axis=0).T)
+    if turns.sum() < 0:
+        polygon = polygon[::-1]
+        turns = -turns[::-1]
+    if np.any(turns < -1e-12 * np.abs(turns).max()):
+        raise ValueError('The polygon is not convex.')
+
+    return polygon
+
+
+def lattice_vectors(polygon, dx, triangles='right'):
+    '''
+    Steps a along the rows and b between the rows of the lattice, both of length
+    dx, with a along the first side of the polygon. b is at 90 degrees from a for
+    right triangles and at 60 degrees for equilateral ones.
+    '''
+    side = polygon[1] - polygon[0]
+    a = dx * side / np.hypot(*side)
+    angle = {'right': 90, 'equilateral': 60}[triangles]
+    cos, sin = np.cos(np.deg2rad(angle)), np.sin(np.deg2rad(angle))
+    b = np.array([cos * a[0] - sin * a[1], sin * a[0] + cos * a[1]])
+    return a, b
+
+
+def lattice_rows(polygon, a, b, origin, eps=1e-9):
+    '''
+    The rows of the lattice origin + i * a + r * b crossing the polygon, and the
+    first and last i of each row inside the polygon (nodes on the sides included).
+
+    Returns
+    -------
+    rows, first, last : ndarray
+        Rows with at least one node, their first and last index along a.
+    '''
+    # row coordinate of the vertices
+    r_vertices = _cross(a, (polygon - origin).T) / _cross(a, b)
+    rows = np.arange(np.ceil(r_vertices.min() - eps), np.floor(r_vertices.max() + eps) + 1)
+
+    # each side bounds i from below or above: cross(e, origin + i a + r b - p) >= 0
+    lower = np.full(len(rows), -np.inf)
+    upper = np.full(len(rows), np.inf)
+    for p, e in zip(polygon, np.roll(polygon, -1, axis=0) - polygon):
+        A = _cross(e, a)
+        C = _cross(e, origin - p) + rows * _cross(e, b)
+        if abs(A) < 1e-12 * np.hypot(*e) * np.hypot(*a):
+            # side parallel to the rows
+            upper[C < -eps * np.hypot(*e) * np.hypot(*a)] = -np.inf
+        elif A > 0:
+            lower = np.maximum(lower, -C / A)
+        else:
+            upper = np.minimum(upper, -C / A)
+
+    first, last = np.ceil(lower - eps), np.floor(upper + eps)
+    keep = first <= last
+    return rows[keep].astype(int), first[keep].astype(int), last[keep].astype(int)
+
+
+def _blocks(counts, block_size):
+    # slices of consecutive rows with about block_size values in total
+    ends = np.searchsorted(np.cumsum(counts), np.arange(block_size, counts.sum() + block_size, block_size))
+    starts = np.concatenate(([0], ends[:-1] + 1))
+    ends = np.minimum(ends + 1, len(counts))
+    return [slice(start, end) for start, end in zip(starts, ends) if start < end]
+
+
+def _ragged_arange(start, stop):
+    # concatenation of arange(start[k], stop[k]) for all k, and the k of each value
+    counts = np.maximum(stop - start, 0)
+    k = np.repeat(np.arange(len(counts)), counts)
+    offsets = np.cumsum(counts) - counts
+    return start[k] + np.arange(counts.sum()) - offsets[k], k
+
+
+def distance_to_sides(x, y, polygon):
+    '''
+    Distance of the points to the closest side of the convex polygon, in the
+    units of the coordinates.
+    '''
+    distance = np.full(np.shape(x), np.inf)
+    for p, e in zip(polygon, np.roll(polygon, -1, axis=0) - polygon):
+        distance = np.minimum(distance, np.abs(e[0] * (y - p[1]) - e[1] * (x - p[0])) / np.hypot(*e))
+    return distance
+
+
+def basin_mesh(polygon, dx, triangles='right', boundary_distance=None, block_size=2_000_000):
+    '''
+    Nodes, elements and boundary flags of a regular triangular mesh of a convex
+    polygon basin.
+
+    Parameters
+    ----------
+    polygon : array_like
+        Vertices (x, y) of the basin in degrees, with shape (n, 2).
+    dx : float
+        Side of the triangles along the rows in degrees.
+    triangles : str
+        'right' for two right triangles per square cell, 'equilateral' for two
+        equilateral triangles per rhombus.
+    boundary_distance : float
+        If given, the nodes closer than this to a side of the polygon are flagged
+        as boundary nodes, e.g. dx - 0.001 like mesh2d_dbgyre.py. By default the
+        nodes on the edges of the mesh are flagged, i.e. the nodes with fewer than
+        the 6 triangles of the interior nodes.
+    block_size : int
+        Approximate number of triangles built at once, to bound the memory used
+        by the temporary arrays.
+
+    Returns
+    -------
+    nodes : ndarray
+        Node coordinates with shape (2, n_nodes), row by row.
+    elems : ndarray
+        Zero based node indices with shape (n_elems, 3), counterclockwise.
+    boundary : ndarray
+        1 for the boundary nodes, 0 otherwise.
+    '''
+    polygon = as_polygon(polygon)
+    a, b = lattice_vectors(polygon, dx, triangles)
+    origin = polygon[0]
+    rows, first, last = lattice_rows(polygon, a, b, origin)
+
+    # nodes, numbered row by row; rows are contiguous for a convex polygon
+    i, row = _ragged_arange(first, last + 1)
+    r = rows[row]
+    x = origin[0] + i * a[0] + r * b[0]
+    y = origin[1] + i * a[1] + r * b[1]
+    offset = np.cumsum(last - first + 1) - (last - first + 1)
+
+    # triangles between each row and the next one: (i, r), (i+1, r), (i, r+1) and
+    # (i+1, r), (i+1, r+1), (i, r+1), kept when their nodes are in the basin
+    adjacent = np.diff(rows) == 1    # a row can miss every node of a thin corner
+    start_1 = np.maximum(first[:-1], first[1:])
+    count_1 = np.where(adjacent, np.maximum(np.minimum(last[:-1] - 1, last[1:]) + 1 - start_1, 0), 0)
+    start_2 = np.maximum(first[:-1] - 1, first[1:])
+    count_2 = np.where(adjacent, np.maximum(np.minimum(last[:-1], last[1:]) - start_2, 0), 0)
+    base = np.cumsum(count_1 + count_2) - count_1 - count_2
+
+    n_elems = (count_1 + count_2).sum()
+    if n_elems == 0:
+        raise ValueError(f'dx = {dx} is too coarse to mesh the polygon.')
+    elems = np.empty((n_elems, 3), dtype=int)
+    for block in _blocks(count_1 + count_2, block_size):
+        for start, count, corners in [(start_1, count_1, [(0, 0), (0, 1), (1, 0)]),
+                                      (start_2, count_2, [(0, 1), (1, 1), (1, 0)])]:
+            j, k = _ragged_arange(start[block], start[block] + count[block])
+            k += block.start
+            number = [[offset[k] + j - first[k], offset[k] + j + 1 - first[k]],
+                      [offset[k + 1] + j - first[k + 1], offset[k + 1] + j + 1 - first[k + 1]]]
+            # along the rows, each triangle after the ones of the nodes before it
+            if start is start_1:
+                position = base[k] + j - start_1[k] + np.clip(j - start_2[k], 0, count_2[k])
+            else:
+                position = base[k] + np.clip(j - start_1[k] + 1, 0, count_1[k]) + j - start_2[k]
+            for column, (dr, di) in enumerate(corners):
+                elems[position, column] = number[dr][di]
+
+    # drop the nodes of no triangle, e.g. at sharp corners
+    n_triangles = np.bincount(elems.ravel(), minlength=len(x))
+    used = n_triangles > 0
+    if not used.all():
+        elems = (np.cumsum(used) - 1)[elems]
+        x, y, n_triangles = x[used], y[used], n_triangles[used]
+
+    if boundary_distance is None:
+        boundary = (n_triangles < 6).astype(int)
+    else:
+        boundary = (distance_to_sides(x, y, polygon) < boundary_distance).astype(int)
+
+    return np.vstack([x, y]), elems, boundary
+
+
+def write_basin_mesh(path, polygon, dx, triangles='right', boundary_distance=None, zbar=None, nl=41, H=4000,
+                     alpha=1.1, depth=None, levels_file='aux3d.out'):
+    '''
+    Writes nod2d.out, elem2d.out and the vertical levels of a basin mesh to path.
+
+    Parameters
+    ----------
+    path : str or Path
+        Output folder, created if needed.
+    polygon, dx, triangles, boundary_distance
+        See basin_mesh.
+    zbar : array_like
+        Depths of the level interfaces in m. By default nl levels from 0 to H,
+        each layer alpha times thicker than the one above (see soufflet_levels).
+    depth : float, array_like or callable
+        Depth of the nodes in m, or a function of the node coordinates (x, y)
+        returning it. The last level by default.
+    levels_file : str
+        'aux3d.out' in the format of mesh2d_dbgyre.py, or 'depth.out' in the
+        format of mesh2d_soufflet.py.
+
+    Returns
+    -------
+    nodes, elems, boundary
+        As returned by basin_mesh.
+    '''
+    path = Path(path)
+    path.mkdir(parents=True, exist_ok=True)
+
+    nodes, elems, boundary = basin_mesh(polygon, dx, triangles, boundary_distance)
+    n2d = nodes.shape[1]
+
+    zbar = soufflet_levels(nl, H, alpha) if zbar is None else np.asarray(zbar, dtype=float)
+    if depth is None:
+        depth = zbar[-1]
+    elif callable(depth):
+        depth = depth(*nodes)
+    depth = np.broadcast_to(np.asarray(depth, dtype=float), (n2d,))
+
+    with open(path / 'nod2d.out', 'w') as f:
+        write_table(f, '%d   %.5f  %.5f  %d', [np.arange(1, n2d + 1), *nodes, boundary], header=n2d)
+    with open(path / 'elem2d.out', 'w') as f:
+        write_table(f, '%d    %d    %d', (elems + 1).T, header=len(elems))
+
+    with open(path / levels_file, 'w') as f:
+        if levels_file == 'aux3d.out':
+            write_table(f, '-%.5f', [zbar], header=len(zbar))
+            write_table(f, '-%.1f', [depth])
+        elif levels_file == 'depth.out':
+            write_table(f, '%g', [zbar], header=len(zbar))
+            write_table(f, '%7.1f', [-depth])
+        else:
+            raise ValueError(f"levels_file must be 'aux3d.out' or 'depth.out', not {levels_file!r}.")
+
+    return nodes, elems, boundary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('path', help='Output folder.')
+    parser.add_argument('--polygon', nargs='+', required=True, help='Vertices of the basin as x,y in degrees.')
+    parser.add_argument('--dx', type=float, required=True, help='Resolution in degrees.')
+    parser.add_argument('--triangles', choices=['right', 'equilateral'], default='right')
+    parser.add_argument('--boundary-distance', type=float,
+                        help='Flag the nodes closer than this to a side, instead of the nodes on the mesh edges.')
+    parser.add_argument('--nl', type=int, default=41, help='Number of levels.')
+    parser.add_argument('--H', type=float, default=4000, help='Depth in m.')
+    parser.add_argument('--alpha', type=float, default=1.1, help='Layer thickness ratio.')
+    parser.add_argument('--levels-file', choices=['aux3d.out', 'depth.out'], default='aux3d.out')
+    args = parser.parse_args()
+
+    polygon = [[float(value) for value in vertex.split(',')] for vertex in args.polygon]
+    nodes, elems, _ = write_basin_mesh(args.path, polygon, args.dx, args.triangles, args.boundary_distance,
+                                       nl=args.nl, H=args.H, alpha=args.alpha, levels_file=args.levels_file)
+    print(f'{nodes.shape[1]} nodes, {len(elems)} elements written to {args.path}')
+
+
+if __name__ == '__main__':
+    main()
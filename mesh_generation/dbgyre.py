@@ -0,0 +1,178 @@
+'''
+Array based generator of the double gyre meshes of mesh2d_dbgyre.py: a square
+basin rotated by 45 degrees, meshed with right triangles along its sides, with
+the western and eastern corner nodes removed. Produces the same nod2d.out,
+elem2d.out and aux3d.out files as the script, with the node numbering, triangles
+and boundary flags computed from index arithmetic and array geometry instead of
+per node searches, so the run time is linear in the number of nodes.
+
+    from mesh_generation.dbgyre import write_dbgyre_mesh
+    write_dbgyre_mesh('meshes/dbgyre_0.1', dx=0.1)
+
+or from the repository root:
+
+    python -m mesh_generation.dbgyre meshes/dbgyre_0.1 --dx 0.1
+'''
+import argparse
+from pathlib import Path
+
+import numpy as np
+
+from mesh_generation.ascii import write_table
+
+
+# corners of the basin in degrees
+P_LEFT = (0, 30)
+P_TOP = (20, 50)
+P_RIGHT = (35, 35)
+P_BOTTOM = (15, 15)
+
+# depths of the level interfaces in m
+ZBAR = [0, 9.03766, 18.9791, 29.9146, 41.9438, 55.1758, 69.731, 85.7418, 103.354, 122.727, 144.037, 167.478,
+        193.264, 221.628, 252.828, 287.149, 324.901, 366.429, 412.11, 462.358, 517.632, 578.433, 645.314, 718.883,
+        799.809, 888.827, 986.747, 1094.46, 1212.94, 1343.28, 1486.64, 1644.34, 1817.81, 2008.63, 2218.53, 2449.43,
+        2703.41, 2982.78, 3290.1, 3628.15, 4000]
+
+
+def dbgyre_grid(dx=0.2, p_left=P_LEFT, p_top=P_TOP, p_bottom=P_BOTTOM):
+    '''
+    Node coordinates on the (i, j) grid of the basin, i along the south-western
+    side and j along the north-western side.
+
+    Parameters
+    ----------
+    dx : float
+        Side of the triangles in degrees.
+    p_left, p_top, p_bottom : tuple
+        Western, northern and southern corners in degrees.
+
+    Returns
+    -------
+    x, y : ndarray
+        Coordinates with shape (ni, nj).
+    '''
+    d_shift = round(dx / np.sqrt(2), 4)
+    total_x = np.sqrt(2) * (p_bottom[0] - p_left[0])
+    total_y = np.sqrt(2) * (p_top[1] - p_left[1])
+    ni, nj = int(total_x / dx) + 1, int(total_y / dx) + 1
+
+    # the script steps along each row adding d_shift until it leaves the basin,
+    # accumulate the same way to get the same round-off. Below 0.06 degrees the
+    # rounding of d_shift makes some rows longer and the script fails, the rows
+    # are then cut at nj nodes like its reshape expects.
+    i = np.arange(ni)
+    steps = np.full((ni, nj), d_shift)
+    steps[:, 0] = p_left[0] + i * d_shift
+    x = np.cumsum(steps, axis=1)
+    steps[:, 0] = p_left[1] - i * d_shift
+    y = np.cumsum(steps, axis=1)
+
+    return x, y
+
+
+def is_edge(x, y, dx, p_left=P_LEFT, p_top=P_TOP, p_right=P_RIGHT, p_bottom=P_BOTTOM):
+    '''
+    1 for the points closer than dx - 0.001 to one of the sides of the basin
+    (the lines through its corners), 0 otherwise.
+    '''
+    on_edge = np.zeros(np.shape(x), dtype=int)
+    for p_1, p_2 in [(p_left, p_top), (p_left, p_bottom), (p_right, p_bottom), (p_right, p_top)]:
+        side = np.subtract(p_1, p_2)
+        distance = np.abs(side[0] * (p_2[1] - y) - side[1] * (p_2[0] - x)) / np.linalg.norm(side)
+        on_edge |= distance < dx - 0.001
+
+    return on_edge
+
+
+def dbgyre_mesh(dx=0.2, p_left=P_LEFT, p_top=P_TOP, p_right=P_RIGHT, p_bottom=P_BOTTOM):
+    '''
+    Nodes, elements and boundary flags of the double gyre basin.
+
+    Parameters
+    ----------
+    See dbgyre_grid.
+
+    Returns
+    -------
+    nodes : ndarray
+        Node coordinates with shape (2, n_nodes).
+    elems : ndarray
+        Zero based node indices with shape (n_elems, 3).
+    boundary : ndarray
+        1 for the nodes on the sides of the basin, 0 otherwise.
+    '''
+    x, y = dbgyre_grid(dx, p_left, p_top, p_bottom)
+    ni, nj = x.shape
+
+    # the western (0, nj - 1) and eastern (ni - 1, 0) corners are removed
+    exists = np.ones((ni + 1, nj + 1), dtype=bool)
+    exists[0, nj - 1] = exists[ni - 1, 0] = False
+    exists[ni, :] = exists[:, nj] = False
+    number = np.zeros((ni + 1, nj + 1), dtype=int)
+    number[exists] = np.arange(exists.sum())
+
+    # two triangles with their right angle at each node, (i, j), (i, j+1),
+    # (i+1, j+1) and (i, j), (i+1, j+1), (i+1, j), when all their nodes exist
+    n, n_j, n_i, n_ij = number[:-1, :-1], number[:-1, 1:], number[1:, :-1], number[1:, 1:]
+    e, e_j, e_i, e_ij = exists[:-1, :-1], exists[:-1, 1:], exists[1:, :-1], exists[1:, 1:]
+    elems = np.stack([np.stack([n, n_j, n_ij], axis=-1), np.stack([n, n_ij, n_i], axis=-1)], axis=2)
+    has_elem = np.stack([e & e_j & e_ij, e & e_ij & e_i], axis=2)
+    elems = elems[has_elem]
+
+    nodes = np.vstack([x[exists[:-1, :-1]], y[exists[:-1, :-1]]])
+    boundary = is_edge(*nodes, dx, p_left, p_top, p_right, p_bottom)
+
+    return nodes, elems, boundary
+
+
+def write_dbgyre_mesh(path, dx=0.2, zbar=ZBAR, p_left=P_LEFT, p_top=P_TOP, p_right=P_RIGHT, p_bottom=P_BOTTOM):
+    '''
+    Writes nod2d.out, elem2d.out and aux3d.out of a double gyre mesh to path, in
+    the format of mesh2d_dbgyre.py.
+
+    Parameters
+    ----------
+    path : str or Path
+        Output folder, created if needed.
+    dx : float
+        Side of the triangles in degrees, e.g. 0.2 or 0.1.
+    zbar : list
+        Depths of the level interfaces in m, the basin is as deep as the last one.
+    p_left, p_top, p_right, p_bottom : tuple
+        Western, northern, eastern and southern corners in degrees.
+
+    Returns
+    -------
+    nodes, elems, boundary
+        As returned by dbgyre_mesh.
+    '''
+    path = Path(path)
+    path.mkdir(parents=True, exist_ok=True)
+
+    nodes, elems, boundary = dbgyre_mesh(dx, p_left, p_top, p_right, p_bottom)
+    n2d = nodes.shape[1]
+
+    number = np.arange(1, n2d + 1)
+    with open(path / 'nod2d.out', 'w') as f:
+        write_table(f, '%d   %.5f  %.5f  %d', [number, *nodes, boundary], header=n2d)
+    with open(path / 'elem2d.out', 'w') as f:
+        write_table(f, '%d    %d    %d', (elems + 1).T, header=len(elems))
+    with open(path / 'aux3d.out', 'w') as f:
+        write_table(f, '-%.5f', [zbar], header=len(zbar))
+        write_table(f, '-%.1f', [np.full(n2d, zbar[-1], dtype=float)])
+
+    return nodes, elems, boundary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('path', help='Output folder.')
+    parser.add_argument('--dx', type=float, default=0.2, help='Resolution in degrees.')
+    args = parser.parse_args()
+
+    nodes, elems, _ = write_dbgyre_mesh(args.path, args.dx)
+    print(f'{nodes.shape[1]} nodes, {len(elems)} elements written to {args.path}')
+
+
+if __name__ == '__main__':
+    main()
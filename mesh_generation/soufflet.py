@@ -0,0 +1,182 @@
+'''
+Array based generator of the Soufflet et al. channel meshes of mesh2d_soufflet.py:
+regular mesh of equilateral triangles, zonally periodic with a cyclic length of
+4.5 degrees. Produces the same nod2d.out, elem2d.out and depth.out files as the
+script, with the node numbering, coordinates, triangles and cyclic reduction
+computed as whole-array operations and the files written in bulk.
+
+    from mesh_generation.soufflet import write_soufflet_mesh
+    write_soufflet_mesh('meshes/souff_2km', dx=2, nl=61, alpha=1.06)
+
+or from the repository root:
+
+    python -m mesh_generation.soufflet meshes/souff_10km --dx 10
+'''
+import argparse
+from pathlib import Path
+
+import numpy as np
+
+from mesh_generation.ascii import write_table
+
+
+def soufflet_grid(dx=20, re=6400, Ly=2010, cyclic_length=4.5):
+    '''
+    Longitudes and latitudes of the node columns and rows, in degrees.
+
+    Parameters
+    ----------
+    dx : float
+        Approximate mesh resolution in km. It is adjusted so the cyclic length
+        and the channel width Ly are an integer number of intervals.
+    re : float
+        Earth's radius in km.
+    Ly : float
+        Channel width in km.
+    cyclic_length : float
+        Zonal length of the channel in degrees.
+
+    Returns
+    -------
+    lon, lat : ndarray
+    '''
+    Lx = cyclic_length * np.pi * re / 180
+    dx = Lx / np.floor(Lx / dx)
+    dy = dx * np.sqrt(3) / 2    # equilateral triangles
+    dy = Ly / np.floor(Ly / dy)
+
+    dx_deg = dx * 180 / np.pi / re
+    dy_deg = dy * 180 / np.pi / re
+
+    lon = np.arange(0, cyclic_length + dx_deg, dx_deg)
+    lat = np.arange(0, 180 * Ly / re / np.pi + dy_deg, dy_deg)
+    return lon, lat
+
+
+def soufflet_mesh(dx=20, re=6400, Ly=2010, cyclic_length=4.5):
+    '''
+    Nodes, elements and boundary flags of the Soufflet channel, after the cyclic
+    reduction. The elements of the last column close the periodicity, so they
+    are the last ny * 2 - 2 elements (see mesh.soufflet_n_elems).
+
+    Parameters
+    ----------
+    See soufflet_grid.
+
+    Returns
+    -------
+    nodes : ndarray
+        Node coordinates with shape (2, n_nodes), numbered along y first.
+    elems : ndarray
+        Zero based node indices with shape (n_elems, 3).
+    boundary : ndarray
+        1 for the nodes on the northern and southern walls, 0 otherwise.
+    '''
+    lon, lat = soufflet_grid(dx, re, Ly, cyclic_length)
+    nx, ny = len(lon), len(lat)
+    dx_deg = lon[1] - lon[0]
+
+    # every second row is shifted by half a triangle
+    xcoord = np.broadcast_to(lon, (ny, nx)).copy()
+    xcoord[1::2] += 0.5 * dx_deg
+    ycoord = np.broadcast_to(lat[:, None], (ny, nx))
+    nodnum = np.arange(nx * ny).reshape((ny, nx), order='F')
+
+    # two triangles per cell, in the order of the loops of the script: column by
+    # column, first the cells of the even rows and then of the odd rows
+    n = np.arange(nx - 1)[:, None]
+    even = np.arange(0, ny - 1, 2)[None, :]
+    odd = np.arange(1, ny - 1, 2)[None, :]
+    tri_even = np.stack([
+        np.stack([nodnum[even, n], nodnum[even + 1, n], nodnum[even, n + 1]], axis=-1),
+        np.stack([nodnum[even + 1, n], nodnum[even + 1, n + 1], nodnum[even, n + 1]], axis=-1),
+    ], axis=2).reshape(nx - 1, -1, 3)
+    tri_odd = np.stack([
+        np.stack([nodnum[odd, n], nodnum[odd + 1, n], nodnum[odd + 1, n + 1]], axis=-1),
+        np.stack([nodnum[odd, n], nodnum[odd + 1, n + 1], nodnum[odd, n + 1]], axis=-1),
+    ], axis=2).reshape(nx - 1, -1, 3)
+    elems = np.concatenate([tri_even, tri_odd], axis=1).reshape(-1, 3)
+
+    # cyclic reduction: the last ny nodes are the first ny nodes
+    n_nodes = (nx - 1) * ny
+    elems[elems >= n_nodes] -= n_nodes
+    nodes = np.vstack([xcoord.ravel(order='F')[:n_nodes], ycoord.ravel(order='F')[:n_nodes]])
+
+    # vertical walls
+    boundary = ((nodes[1] == lat.min()) | (nodes[1] == lat.max())).astype(int)
+
+    return nodes, elems, boundary
+
+
+def soufflet_levels(nl=41, H=4000, alpha=1.1):
+    '''
+    Depths of the nl level interfaces, each layer alpha times thicker than the one
+    above, from 0 to H.
+    '''
+    dz = H * (1 - alpha) / (1 - alpha**(nl - 1))    # thickness of the top layer
+    # cumprod and cumsum accumulate sequentially, so the round-off is that of the script's loops
+    thickness = np.cumprod(np.concatenate(([dz], np.full(nl - 2, alpha))))
+    zbar = np.cumsum(np.concatenate(([0], thickness)))
+
+    return zbar
+
+
+def write_soufflet_mesh(path, dx=20, nl=41, H=4000, alpha=1.1, re=6400, Ly=2010, cyclic_length=4.5):
+    '''
+    Writes nod2d.out, elem2d.out and depth.out of a Soufflet channel mesh to path,
+    in the format of mesh2d_soufflet.py.
+
+    Parameters
+    ----------
+    path : str or Path
+        Output folder, created if needed.
+    dx : float
+        Approximate mesh resolution in km, e.g. 20, 10, 5 or 2.
+    nl : int
+        Number of levels, 41 for 10 km, 61 for 5 km.
+    H : float
+        Depth in m.
+    alpha : float
+        Ratio of the thickness of consecutive layers, 1.1 for 10 km, 1.06 for 5 km.
+    re, Ly, cyclic_length : float
+        See soufflet_grid.
+
+    Returns
+    -------
+    nodes, elems, boundary
+        As returned by soufflet_mesh.
+    '''
+    path = Path(path)
+    path.mkdir(parents=True, exist_ok=True)
+
+    nodes, elems, boundary = soufflet_mesh(dx, re, Ly, cyclic_length)
+    zbar = soufflet_levels(nl, H, alpha)
+    n2d = nodes.shape[1]
+
+    number = np.arange(1, n2d + 1)
+    with open(path / 'nod2d.out', 'w') as f:
+        write_table(f, '%8d %8.4f %8.4f %8d', [number, *nodes, boundary], header=f'{n2d:8d}')
+    with open(path / 'elem2d.out', 'w') as f:
+        write_table(f, '%8d %8d %8d', (elems + 1).T, header=f'{len(elems):8d}')
+    with open(path / 'depth.out', 'w') as f:
+        write_table(f, '%g', [zbar], header=f'{nl:g}')
+        write_table(f, '%7.1f', [np.full(n2d, -H, dtype=float)])
+
+    return nodes, elems, boundary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('path', help='Output folder.')
+    parser.add_argument('--dx', type=float, default=20, help='Resolution in km.')
+    parser.add_argument('--nl', type=int, default=41, help='Number of levels.')
+    parser.add_argument('--H', type=float, default=4000, help='Depth in m.')
+    parser.add_argument('--alpha', type=float, default=1.1, help='Layer thickness ratio.')
+    args = parser.parse_args()
+
+    nodes, elems, _ = write_soufflet_mesh(args.path, args.dx, args.nl, args.H, args.alpha)
+    print(f'{nodes.shape[1]} nodes, {len(elems)} elements written to {args.path}')
+
+
+if __name__ == '__main__':
+    main()
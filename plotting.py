@@ -2,7 +2,9 @@ import matplotlib.pyplot as plt
 import numpy as np
 import xarray as xr
 
-def plot_2d_field_triangular(field, x, y, cmap=None, cbar_label=None, robust=False, soufflet=False, **kwargs):
+from mesh import Mesh
+
+def plot_2d_field_triangular(field, x, y=None, cmap=None, cbar_label=None, robust=False, soufflet=False, **kwargs):
     '''
     Plots a 2d field defined over mesh elements or nodes and returns the Figure and Axes
     objects for further customization. Recommended to add plt.show() after calling this
@@ -17,7 +19,8 @@ def plot_2d_field_triangular(field, x, y, cmap=None, cbar_label=None, robust=Fal
         x and ycoordinates for the nodes or the centroids of the elements. Computed 
         through get_mesh_coordinates() from data_loader.py. Important to pass the
         correct coordinates (either for nodes or elements) depending on where the 
-        variable is defined.
+        variable is defined. x can also be a Mesh (y=None), then the coordinates 
+        and the periodic trimming are taken from it.
     cmap: str, optional
         Colormap to be used.
     cbar_label: str, optional
@@ -35,7 +38,11 @@ def plot_2d_field_triangular(field, x, y, cmap=None, cbar_label=None, robust=Fal
 
     '''
 
-    if soufflet:
+    if isinstance(x, Mesh):
+        field = x.trim(field)
+        x, y = x.coordinates(field)
+
+    elif soufflet:
         # remove westernmost triangles if field is defined over elements (see data_loader.py)
         if isinstance(field, xr.DataArray) and 'elem' in field.dims:
             field = field[:len(y)]
@@ -84,9 +91,10 @@ def plot_2d_field_triangular_tri(field, tri, cmap=None, cbar_label=None, robust=
     ----------
     field : xr.DataArray or array_like
         Defines a 2d field over mesh elements or nodes. So it actually is a 1d array.
-    tri : matplotlib.Triangulation 
+    tri : matplotlib.Triangulation or Mesh
         Triangulation for the unstructured grid obtained by the get_triangulation function
-        located in data_loader.py. 
+        located in data_loader.py. If a Mesh is passed, its triangulation and periodic 
+        trimming are used.
     cmap: str, optional
         Colormap to be used.
     cbar_label: str, optional
@@ -104,7 +112,12 @@ def plot_2d_field_triangular_tri(field, tri, cmap=None, cbar_label=None, robust=
 
     '''
 
-    if soufflet:
+    if isinstance(tri, Mesh):
+        soufflet = soufflet or tri.soufflet
+        field = tri.trim(field)
+        tri = tri.triangulation
+
+    elif soufflet:
         # remove westernmost triangles if field is defined over elements (see data_loader.py)
         if isinstance(field, xr.DataArray) and 'elem' in field.dims:
             field = field[:len(tri.triangles)]
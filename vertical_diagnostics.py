@@ -1,5 +1,10 @@
 import numpy as np
 import xarray as xr
+from scipy import sparse
+
+from mesh import Mesh
+from wet_points import WetPointField, as_wet_points
+from instrumentation import instrument_module
 
 
 def RMS_vertical_velocity(w, nod_area):
@@ -9,14 +14,16 @@ def RMS_vertical_velocity(w, nod_area):
 
     Parameters
     ----------
-    w : DataArray
+    w : DataArray or WetPointField
         3d DataArray with dimensions ['time', 'nz1', 'nod2']. The
-        time extent has already been selected 
+        time extent has already been selected. A WetPointField is reduced
+        over its wet points only.
     nod_area : array_like
         1d array containing the area of each node. Obtained from the
         mesh_diag output file. For the Soufflet configuration all 
         depth layers have the same node areas, so the nod_area variable
         from mesh_diag must be collapsed to 
+        the first depth. A Mesh with data_path can be passed instead.
 
     Returns
     -------
@@ -25,32 +32,80 @@ def RMS_vertical_velocity(w, nod_area):
         of ['nz1'].
 
     '''
+    if isinstance(nod_area, Mesh):
+        nod_area = nod_area.nod_area
+
+    if isinstance(w, WetPointField):
+        w_squared_weighted = w.weighted_mean(nod_area, w.values**2)
+        return np.sqrt(w_squared_weighted.mean('time'))
+
     w_squared_weighted = (w**2).weighted(nod_area).mean('nod2')
     w_rms = np.sqrt(w_squared_weighted.mean('time'))
 
     return w_rms
 
 
-def mean_EKE(u, v, elem_area):
+def mean_EKE(u, v, elem_area, fused=False, time_block=8):
     '''
     Compute the mean Eddy Kinetic Energy vertical profile for given 
     velocity inputs. 
 
+    By default the computation is a lazy xarray expression that builds the
+    anomalies as full (time, nz1, elem) temporaries. With fused=True, u and v
+    are instead read one Dask time chunk at a time (see time_segments) and 
+    reduced on the fly, time_block time steps at a time, into per-location 
+    moments (see EKEAccumulator). The working memory is then one time chunk of
+    u and v, as chosen by load_variable, plus O(time_block x nz1 x elem), and 
+    the result is computed eagerly. In memory inputs are a single chunk. Both 
+    give the same profile as long as the land mask (the NaN values) is static.
+    If u or v is a WetPointField, the profile is computed on the wet points 
+    only (a DataArray passed with it is compressed first) and fused is ignored.
+
     Parameters
     ----------
-    u : DataArray
+    u : DataArray or WetPointField
         Zonal velocity DataArray with dimensions ['time', 'nz1', 'elem']. 
-    v : DataArray
+    v : DataArray or WetPointField
         Meridional velocity DataArray. Same dimensions and time range as
         u. 
     elem_area : array_like
         1d array containing the area of each element. Obtained from the
-        mesh_diag output file.
+        mesh_diag output file. A Mesh with data_path can be passed instead.
+    fused : bool, default=False
+        Use the blocked single pass reduction instead of the xarray expression.
+    time_block : int, default=8
+        Number of time steps per block when fused=True.
 
     Returns
     -------
     DataArray
     '''
+
+    if isinstance(elem_area, Mesh):
+        elem_area = elem_area.elem_area
+
+    if isinstance(u, WetPointField) or isinstance(v, WetPointField):
+        mask = (u if isinstance(u, WetPointField) else v).mask
+        u, v = as_wet_points(u, mask), as_wet_points(v, mask)
+        eke = u.anomaly().values
+        eke **= 2
+        v_dash = v.anomaly().values
+        v_dash **= 2
+        eke += v_dash
+        eke /= 2
+        del v_dash
+        return u.weighted_mean(elem_area, eke).mean('time')
+
+    if fused:
+        accumulator = EKEAccumulator()
+        # every Dask chunk is read once, then reduced time_block steps at a time
+        for start, stop in time_segments(u, v):
+            u_segment = u.isel(time=slice(start, stop)).load()
+            v_segment = v.isel(time=slice(start, stop)).load()
+            for block_start in range(0, stop - start, time_block):
+                block = dict(time=slice(block_start, block_start + time_block))
+                accumulator.update(u_segment.isel(block), v_segment.isel(block))
+        return accumulator.result(elem_area)
     
     u_mean = u.mean('time')
     v_mean = v.mean('time')
@@ -68,16 +123,18 @@ def mean_buyoancy(w, temp, nod_area, alpha=0.00025, density_0=1030.0, temp_0=10.
 
     Parameters
     ----------
-    temp : DataArray
+    temp : DataArray or WetPointField
        3d DataArray of temperature with dimensions ['time', 'nz1', 'nod2']. 
-    w : DataArray
+    w : DataArray or WetPointField
        3d DataArray of vertical velocity with dimensions ['time', 'nz', 'nod2'].
+       If w or temp is a WetPointField, the flux is computed on the wet points
+       only (a DataArray passed with it is compressed first).
     nod_area : array_like
         1d array containing the area of each node. Obtained from the
         mesh_diag output file. For the Soufflet configuration all 
         depth layers have the same node areas, so you can define nod_area
         as the nod_area for the first depthnod_area variable
-        from mesh_diag 
+        from mesh_diag. A Mesh with data_path can be passed instead.
     alpha : float, default=0.00025
         Thermal coefficient used in the calculation of buoyancy from temperature.
     density_0 : float, default=1030.0
@@ -91,18 +148,28 @@ def mean_buyoancy(w, temp, nod_area, alpha=0.00025, density_0=1030.0, temp_0=10.
         
     ''' 
 
-    temp_mean = temp.mean('time')
+    if isinstance(nod_area, Mesh):
+        nod_area = nod_area.nod_area
+
     g = -9.81
 
+    if isinstance(w, WetPointField) or isinstance(temp, WetPointField):
+        w, temp = as_wet_points(w), as_wet_points(temp)
+        staggering = VerticalStaggering(w.coords['nz'], temp.coords['nz1'])
+        buoy_dash = -g * alpha * temp.anomaly().values
+        w_dash = w.anomaly().restagger(staggering, temp).values
+        return temp.weighted_mean(nod_area, w_dash * buoy_dash).mean('time')
+
+    temp_mean = temp.mean('time')
+
     buoy_mean = - g * alpha * (temp_mean - temp_0) + g
     buoy = -g * alpha * (temp - temp_0) + g
     buoy_dash = buoy - buoy_mean
 
     w_dash = w - w.mean('time') # vertical velocity anomaly
 
-    # average w_dash into vertical levels where temp is defined, rename z coord
-    w_dash = w_dash.interp(nz=temp.nz1.data, method='linear') 
-    w_dash = w_dash.rename(dict(nz='nz1'))
+    # average w_dash into vertical levels where temp is defined
+    w_dash = VerticalStaggering.interfaces_to_layers(w, temp)(w_dash)
     
     # compute area weighted mean and time mean of buoyancy flux (w'·b')
     buoy_flux = w_dash * buoy_dash
@@ -110,3 +177,614 @@ def mean_buyoancy(w, temp, nod_area, alpha=0.00025, density_0=1030.0, temp_0=10.
     buoy_flux = buoy_flux.mean('time')
 
     return buoy_flux
+
+
+class Moments:
+    '''
+    Running moments along time of a field, per level and location: number of
+    valid (non NaN) samples, mean and sum of squared deviations from the mean.
+    Chunks are combined with the pairwise update of Chan et al., which is exact
+    and numerically stable, so the time series can be fed in any number of
+    chunks and each value is only read once.
+
+    Parameters
+    ----------
+    count, mean, m2 : ndarray
+        Initial state, e.g. as returned by Moments.from_chunk.
+    '''
+
+    fields = ('count', 'mean', 'm2')
+
+    def __init__(self, count, mean, m2):
+        self.count = count
+        self.mean = mean
+        self.m2 = m2
+
+    @classmethod
+    def from_chunk(cls, x):
+        '''
+        Moments of a chunk of data with time as the first axis. Works in place on
+        a single float64 copy of the chunk to keep the working memory low.
+        '''
+        x = np.array(x, dtype=np.float64)
+        invalid = np.isnan(x)
+        count = x.shape[0] - invalid.sum(axis=0)
+        np.copyto(x, 0, where=invalid)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = x.sum(axis=0) / count
+        mean[count == 0] = 0
+        x -= mean
+        np.copyto(x, 0, where=invalid)
+        x *= x
+        return cls(count, mean, x.sum(axis=0))
+
+    def merge(self, other):
+        count = self.count + other.count
+        with np.errstate(invalid='ignore', divide='ignore'):
+            frac = np.where(count > 0, other.count / count, 0)
+        delta = other.mean - self.mean
+        mean = self.mean + delta * frac
+        m2 = self.m2 + other.m2 + delta**2 * self.count * frac
+        return type(self)(count, mean, m2)
+
+    def update(self, x):
+        merged = self.merge(self.from_chunk(x))
+        self.count, self.mean, self.m2 = merged.count, merged.mean, merged.m2
+        return self
+
+    @property
+    def variance(self):
+        '''Time variance (mean squared anomaly), NaN where there are no samples.'''
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(self.count > 0, self.m2 / self.count, np.nan)
+
+    @property
+    def mean_square(self):
+        '''Time mean of the squared field, NaN where there are no samples.'''
+        return self.variance + self.mean**2
+
+
+class CoMoments:
+    '''
+    Running co-moments along time of two fields on the same levels and locations:
+    number of samples where both are valid, their means and the sum of the products
+    of their deviations. Combined like Moments.
+
+    Parameters
+    ----------
+    count, mean_x, mean_y, c_xy : ndarray
+        Initial state, e.g. as returned by CoMoments.from_chunk.
+    '''
+
+    fields = ('count', 'mean_x', 'mean_y', 'c_xy')
+
+    def __init__(self, count, mean_x, mean_y, c_xy):
+        self.count = count
+        self.mean_x = mean_x
+        self.mean_y = mean_y
+        self.c_xy = c_xy
+
+    @classmethod
+    def from_chunk(cls, x, y):
+        '''
+        Co-moments of chunks of data with time as the first axis.
+        '''
+        x = np.array(x, dtype=np.float64)
+        y = np.array(y, dtype=np.float64)
+        invalid = np.isnan(x) | np.isnan(y)
+        count = x.shape[0] - invalid.sum(axis=0)
+        np.copyto(x, 0, where=invalid)
+        np.copyto(y, 0, where=invalid)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean_x = x.sum(axis=0) / count
+            mean_y = y.sum(axis=0) / count
+        mean_x[count == 0] = 0
+        mean_y[count == 0] = 0
+        x -= mean_x
+        y -= mean_y
+        np.copyto(x, 0, where=invalid)
+        x *= y
+        return cls(count, mean_x, mean_y, x.sum(axis=0))
+
+    def merge(self, other):
+        count = self.count + other.count
+        with np.errstate(invalid='ignore', divide='ignore'):
+            frac = np.where(count > 0, other.count / count, 0)
+        delta_x = other.mean_x - self.mean_x
+        delta_y = other.mean_y - self.mean_y
+        mean_x = self.mean_x + delta_x * frac
+        mean_y = self.mean_y + delta_y * frac
+        c_xy = self.c_xy + other.c_xy + delta_x * delta_y * self.count * frac
+        return type(self)(count, mean_x, mean_y, c_xy)
+
+    def update(self, x, y):
+        merged = self.merge(self.from_chunk(x, y))
+        self.count, self.mean_x, self.mean_y, self.c_xy = merged.count, merged.mean_x, merged.mean_y, merged.c_xy
+        return self
+
+    @property
+    def covariance(self):
+        '''Time covariance (mean product of anomalies), NaN where there are no samples.'''
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(self.count > 0, self.c_xy / self.count, np.nan)
+
+
+def area_weighted_profile(values, area):
+    '''
+    Area weighted horizontal mean of a (level, location) array, skipping NaN 
+    values like DataArray.weighted(area).mean does. 
+
+    Parameters
+    ----------
+    values : ndarray
+        2d array with dimensions (level, location).
+    area : array_like
+        1d array with the area of each location.
+
+    Returns
+    -------
+    ndarray
+        Profile with one value per level, NaN for levels without valid values.
+    '''
+    area = np.asarray(area, dtype=np.float64)
+    valid = ~np.isnan(values)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(valid, values, 0) @ area / (valid @ area)
+
+
+def time_segments(*fields, dim='time'):
+    '''
+    Splits the time axis of fields at the boundaries of their Dask chunks, so
+    every segment lies within one chunk of each field and loading the segments
+    one after the other reads every chunk once. Fields that are not Dask 
+    backed do not split the time axis.
+
+    Returns
+    -------
+    list of tuple
+        (start, stop) index of each segment.
+    '''
+    n_time = fields[0].sizes[dim]
+    bounds = {0, n_time}
+    for field in fields:
+        chunks = field.chunksizes.get(dim)
+        if chunks is not None:
+            bounds.update(np.cumsum(chunks).tolist())
+    bounds = sorted(bounds)
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+class VerticalStaggering:
+    '''
+    Linear operator moving a field between staggered vertical grids, e.g. from
+    the interfaces (nz) to the mid layers (nz1). Each target level is a two point
+    weighted average of the source levels around it, with the same weights as
+    linear interpolation, so for FESOM mid layers it is the plain average of the
+    interfaces above and below. The weights are computed once from the level 
+    coordinates. Applying the operator to a DataArray only slices and adds along
+    the level axis, so it stays lazy and keeps the chunking of the other 
+    dimensions, unlike DataArray.interp.
+
+    Parameters
+    ----------
+    source_levels, target_levels : array_like
+        Level coordinates, the source levels strictly increasing or strictly
+        decreasing (a ValueError is raised otherwise). Target levels outside
+        the source levels are NaN, as with DataArray.interp.
+    source_dim, target_dim : str
+        Names of the level dimensions.
+
+    Attributes
+    ----------
+    upper : ndarray
+        Index of the source level above each target level.
+    weight : ndarray
+        Weight of the source level below each target level, NaN for the target
+        levels outside the source levels.
+    '''
+
+    def __init__(self, source_levels, target_levels, source_dim='nz', target_dim='nz1'):
+        self.source_levels = np.asarray(source_levels, dtype=np.float64)
+        self.target_levels = np.asarray(target_levels, dtype=np.float64)
+        self.source_dim = source_dim
+        self.target_dim = target_dim
+
+        n_source = len(self.source_levels)
+        step = np.diff(self.source_levels)
+        if n_source < 2 or not (np.all(step > 0) or np.all(step < 0)):
+            raise ValueError(f'{source_dim} levels must be strictly monotonic, got {self.source_levels}.')
+
+        # decreasing levels (e.g. negative depths) are negated, which leaves the weights unchanged
+        sign = 1 if step[0] > 0 else -1
+        source_levels, target_levels = sign * self.source_levels, sign * self.target_levels
+
+        self.upper = np.clip(np.searchsorted(source_levels, target_levels, side='right') - 1, 0, n_source - 2)
+        upper_levels = source_levels[self.upper]
+        self.weight = (target_levels - upper_levels) / (source_levels[self.upper + 1] - upper_levels)
+
+        # no extrapolation, like DataArray.interp
+        outside = ~((target_levels >= source_levels[0]) & (target_levels <= source_levels[-1]))
+        self.weight[outside] = np.nan
+
+    def __repr__(self):
+        return (f'VerticalStaggering({self.source_dim}: {len(self.source_levels)} -> '
+                f'{self.target_dim}: {len(self.target_levels)})')
+
+    @classmethod
+    def interfaces_to_layers(cls, w, temp):
+        '''
+        Operator from the nz levels of w to the nz1 levels of temp.
+        '''
+        return cls(w.nz.values, temp.nz1.values)
+
+    @property
+    def matrix(self):
+        '''The operator as a sparse (n_target, n_source) matrix.'''
+        rows = np.repeat(np.arange(len(self.target_levels)), 2)
+        cols = np.column_stack((self.upper, self.upper + 1)).ravel()
+        values = np.column_stack((1 - self.weight, self.weight)).ravel()
+        return sparse.csr_matrix((values, (rows, cols)), shape=(len(self.target_levels), len(self.source_levels)))
+
+    def _indexers(self):
+        # consecutive levels (the usual case) become slices, which keeps Dask graphs simple
+        if np.array_equal(self.upper, np.arange(self.upper[0], self.upper[0] + len(self.upper))):
+            start, stop = self.upper[0], self.upper[0] + len(self.upper)
+            return slice(start, stop), slice(start + 1, stop + 1)
+        return self.upper, self.upper + 1
+
+    def __call__(self, field, axis=1):
+        '''
+        Applies the operator to a DataArray along source_dim, or to an array 
+        along axis.
+        '''
+        upper, lower = self._indexers()
+        # keep float32 fields in float32, as interp does
+        dtype = field.dtype if np.issubdtype(field.dtype, np.floating) else np.float64
+
+        if isinstance(field, xr.DataArray):
+            weight = xr.DataArray(self.weight.astype(dtype), dims=self.target_dim)
+            field_upper = field.isel({self.source_dim: upper}).drop_vars(self.source_dim, errors='ignore')
+            field_lower = field.isel({self.source_dim: lower}).drop_vars(self.source_dim, errors='ignore')
+            field_upper = field_upper.rename({self.source_dim: self.target_dim})
+            field_lower = field_lower.rename({self.source_dim: self.target_dim})
+            result = (1 - weight) * field_upper + weight * field_lower
+            result = result.transpose(*[self.target_dim if d == self.source_dim else d for d in field.dims])
+            return result.assign_coords({self.target_dim: self.target_levels})
+
+        field = np.asarray(field)
+        shape = [1] * field.ndim
+        shape[axis] = len(self.weight)
+        weight = self.weight.astype(dtype).reshape(shape)
+        index = [slice(None)] * field.ndim
+        index[axis] = upper
+        field_upper = field[tuple(index)]
+        index[axis] = lower
+        field_lower = field[tuple(index)]
+        return (1 - weight) * field_upper + weight * field_lower
+
+
+class DiagnosticAccumulator:
+    '''
+    Base class for the mergeable partial statistics of a vertical diagnostic. An
+    accumulator is filled chunk by chunk (e.g. with one year of output), saved to
+    a small .npz file and merged exactly with the accumulators of other years, so
+    years can be processed by independent jobs and new years added later without
+    recomputing the old ones. Subclasses define the moments they keep in 
+    moment_names and how to update them and build the profile from them.
+
+    Parameters
+    ----------
+    levels : array_like, optional
+        Vertical coordinate of the profile. Taken from the first DataArray 
+        passed to update if not given.
+    years : iterable of int, optional
+        Years already folded into the accumulator.
+    '''
+
+    name = None
+    level_dim = None
+    location_dim = None
+    area = None
+    moment_names = ()
+    co_moment_names = ()
+
+    def __init__(self, levels=None, years=()):
+        self.levels = None if levels is None else np.asarray(levels)
+        self.years = sorted(set(years))
+        self.moments = dict.fromkeys(self.moment_names)
+
+    def __repr__(self):
+        return f'{type(self).__name__}(years={self.years})'
+
+    def _add(self, key, moments):
+        current = self.moments[key]
+        self.moments[key] = moments if current is None else current.merge(moments)
+
+    def _set_levels(self, field):
+        if self.levels is None and isinstance(field, xr.DataArray):
+            self.levels = field[self.level_dim].values
+
+    def merge(self, other):
+        '''
+        Returns a new accumulator with the statistics of self and other. Raises a
+        ValueError if both contain the same year, which would count it twice.
+        '''
+        if type(other) is not type(self):
+            raise TypeError(f'Cannot merge {type(self).__name__} with {type(other).__name__}')
+
+        overlap = set(self.years) & set(other.years)
+        if overlap:
+            raise ValueError(f'Both accumulators contain the years {sorted(overlap)}')
+
+        merged = self._copy_empty(other)
+        merged.years = sorted(set(self.years) | set(other.years))
+        for key in self.moment_names:
+            for moments in (self.moments[key], other.moments[key]):
+                if moments is not None:
+                    merged._add(key, moments)
+
+        return merged
+
+    def _copy_empty(self, other):
+        levels = self.levels if self.levels is not None else other.levels
+        return type(self)(levels=levels)
+
+    def _attrs(self):
+        return {}
+
+    def save(self, path):
+        '''
+        Saves the accumulator to a .npz file, see load_accumulator.
+        '''
+        arrays = {}
+        for key, moments in self.moments.items():
+            if moments is not None:
+                arrays.update({f'{key}.{field}': getattr(moments, field) for field in moments.fields})
+
+        levels = self.levels if self.levels is not None else np.array([])
+        np.savez(path, kind=self.name, levels=levels, years=np.asarray(self.years, dtype=int), 
+                 **self._attrs(), **arrays)
+
+    @classmethod
+    def _from_npz(cls, f):
+        levels = f['levels'] if f['levels'].size else None
+        acc = cls(levels=levels, years=f['years'].tolist(), **cls._attrs_from_npz(f))
+        for key in cls.moment_names:
+            moments_class = CoMoments if key in cls.co_moment_names else Moments
+            if f'{key}.count' in f:
+                acc.moments[key] = moments_class(*(f[f'{key}.{field}'] for field in moments_class.fields))
+
+        return acc
+
+    @classmethod
+    def _attrs_from_npz(cls, f):
+        return {}
+
+    def to_dataset(self):
+        '''
+        The state of the accumulator as a Dataset, with one (level, location) 
+        variable per moment and the years and parameters as attributes, so it can
+        be stored next to the profiles (see accumulators_from_dataset).
+        '''
+        prefix = f'{self.name}__'
+        data_vars = {}
+        for key, moments in self.moments.items():
+            if moments is not None:
+                data_vars.update({f'{prefix}{key}__{field}': ((self.level_dim, self.location_dim), getattr(moments, field))
+                                  for field in moments.fields})
+
+        coords = {} if self.levels is None else {self.level_dim: self.levels}
+        attrs = {f'{prefix}{key}': value for key, value in self._attrs().items()}
+        attrs[f'{prefix}years'] = np.asarray(self.years, dtype=int)
+        return xr.Dataset(data_vars, coords=coords, attrs=attrs)
+
+    @classmethod
+    def from_dataset(cls, ds):
+        '''
+        Accumulator stored in ds with to_dataset, or None if ds has none.
+        '''
+        prefix = f'{cls.name}__'
+        if f'{prefix}years' not in ds.attrs:
+            return None
+
+        attrs = {key[len(prefix):]: value for key, value in ds.attrs.items() if key.startswith(prefix)}
+        levels = ds[cls.level_dim].values if cls.level_dim in ds.coords else None
+        years = np.atleast_1d(attrs['years']).tolist()
+        acc = cls(levels=levels, years=years, **cls._attrs_from_npz(attrs))
+        for key in cls.moment_names:
+            moments_class = CoMoments if key in cls.co_moment_names else Moments
+            if f'{prefix}{key}__count' in ds:
+                acc.moments[key] = moments_class(*(ds[f'{prefix}{key}__{field}'].values for field in moments_class.fields))
+
+        return acc
+
+    def _area(self, area):
+        if isinstance(area, Mesh):
+            area = getattr(area, self.area)
+        return area
+
+    def _profile(self, values):
+        return xr.DataArray(values, dims=self.level_dim, coords={self.level_dim: self.levels}, name=self.name)
+
+
+class EKEAccumulator(DiagnosticAccumulator):
+    '''
+    Partial statistics of the mean Eddy Kinetic Energy profile (see mean_EKE).
+    Update with chunks of u and v with dimensions ['time', 'nz1', 'elem'].
+    '''
+
+    name = 'eke'
+    level_dim = 'nz1'
+    location_dim = 'elem'
+    area = 'elem_area'
+    moment_names = ('u', 'v')
+
+    def update(self, u, v):
+        self._set_levels(u)
+        self._add('u', Moments.from_chunk(u))
+        self._add('v', Moments.from_chunk(v))
+        return self
+
+    def result(self, elem_area):
+        '''
+        Mean EKE profile. elem_area can be the area array or a Mesh.
+        '''
+        variance = (self.moments['u'].variance + self.moments['v'].variance) / 2
+        return self._profile(area_weighted_profile(variance, self._area(elem_area)))
+
+
+class WRMSAccumulator(DiagnosticAccumulator):
+    '''
+    Partial statistics of the RMS vertical velocity profile (see RMS_vertical_velocity).
+    Update with chunks of w with dimensions ['time', 'nz', 'nod2'].
+    '''
+
+    name = 'w_rms'
+    level_dim = 'nz'
+    location_dim = 'nod2'
+    area = 'nod_area'
+    moment_names = ('w',)
+
+    def update(self, w):
+        self._set_levels(w)
+        self._add('w', Moments.from_chunk(w))
+        return self
+
+    def result(self, nod_area):
+        '''
+        RMS vertical velocity profile. nod_area can be the area array or a Mesh.
+        '''
+        mean_square = self.moments['w'].mean_square
+        return self._profile(np.sqrt(area_weighted_profile(mean_square, self._area(nod_area))))
+
+
+class BuoyancyFluxAccumulator(DiagnosticAccumulator):
+    '''
+    Partial statistics of the turbulent buoyancy flux profile (see mean_buyoancy).
+    Update with chunks of w with dimensions ['time', 'nz', 'nod2'] and temp with 
+    dimensions ['time', 'nz1', 'nod2']. If plain arrays are passed, the interface
+    and layer depths nz and nz1 are needed to move w to the layers.
+
+    Parameters
+    ----------
+    alpha : float, default=0.00025
+        Thermal coefficient used in the calculation of buoyancy from temperature.
+    '''
+
+    name = 'buoy_flux'
+    level_dim = 'nz1'
+    location_dim = 'nod2'
+    area = 'nod_area'
+    moment_names = ('w_temp',)
+    co_moment_names = ('w_temp',)
+
+    def __init__(self, levels=None, years=(), alpha=0.00025):
+        super().__init__(levels, years)
+        self.alpha = alpha
+        self.staggering = None
+
+    def _copy_empty(self, other):
+        if other.alpha != self.alpha:
+            raise ValueError('Cannot merge buoyancy flux accumulators with different alpha')
+        merged = super()._copy_empty(other)
+        merged.alpha = self.alpha
+        return merged
+
+    def _attrs(self):
+        return {'alpha': self.alpha}
+
+    @classmethod
+    def _attrs_from_npz(cls, f):
+        return {'alpha': float(f['alpha'])}
+
+    def update(self, w, temp, nz=None, nz1=None):
+        self._set_levels(temp)
+        if self.staggering is None:
+            if nz is None:
+                self.staggering = VerticalStaggering.interfaces_to_layers(w, temp)
+            else:
+                self.staggering = VerticalStaggering(nz, nz1)
+        w_layers = self.staggering(np.asarray(w, dtype=np.float64))
+        self._add('w_temp', CoMoments.from_chunk(w_layers, temp))
+        return self
+
+    def result(self, nod_area):
+        '''
+        Mean turbulent buoyancy flux profile. nod_area can be the area array or a Mesh.
+        '''
+        g = -9.81
+        covariance = self.moments['w_temp'].covariance
+        return self._profile(-g * self.alpha * area_weighted_profile(covariance, self._area(nod_area)))
+
+
+ACCUMULATORS = {acc.name: acc for acc in (WRMSAccumulator, EKEAccumulator, BuoyancyFluxAccumulator)}
+
+
+def load_accumulator(path):
+    '''
+    Loads an accumulator saved with DiagnosticAccumulator.save.
+
+    Parameters
+    ----------
+    path : str or Path
+        .npz file.
+
+    Returns
+    -------
+    DiagnosticAccumulator
+    '''
+    with np.load(path) as f:
+        return ACCUMULATORS[str(f['kind'])]._from_npz(f)
+
+
+def merge_accumulators(accumulators):
+    '''
+    Merges accumulators (or paths to saved accumulators) of the same diagnostics
+    computed for different years.
+
+    Parameters
+    ----------
+    accumulators : iterable
+        DiagnosticAccumulator objects or paths to .npz files, in any order.
+
+    Returns
+    -------
+    dict
+        One merged accumulator per diagnostic, keyed by diagnostic name.
+    '''
+    merged = {}
+    for acc in accumulators:
+        if not isinstance(acc, DiagnosticAccumulator):
+            acc = load_accumulator(acc)
+        merged[acc.name] = merged[acc.name].merge(acc) if acc.name in merged else acc
+
+    return merged
+
+
+def accumulators_to_dataset(accumulators):
+    '''
+    Stores the state of several accumulators in a single Dataset.
+
+    Parameters
+    ----------
+    accumulators : dict or iterable
+        DiagnosticAccumulator objects, e.g. as returned by merge_accumulators.
+
+    Returns
+    -------
+    xr.Dataset
+    '''
+    if isinstance(accumulators, dict):
+        accumulators = accumulators.values()
+    return xr.merge([acc.to_dataset() for acc in accumulators], combine_attrs='no_conflicts')
+
+
+def accumulators_from_dataset(ds):
+    '''
+    Accumulators stored in ds with accumulators_to_dataset, keyed by diagnostic name.
+    '''
+    accumulators = {name: acc.from_dataset(ds) for name, acc in ACCUMULATORS.items()}
+    return {name: acc for name, acc in accumulators.items() if acc is not None}
+
+
+instrument_module(globals())
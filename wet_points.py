@@ -0,0 +1,218 @@
+import numpy as np
+import xarray as xr
+
+
+class WetPointField:
+    '''
+    Compressed (time, level, location) field that only stores the wet points. The
+    values are kept as a (time, n_wet) array in level-major order, like a CSR
+    matrix with one row per level: the wet points of level k are
+    values[:, indptr[k]:indptr[k + 1]] and indices gives their location (node or
+    element). With topography a large part of the dense field is land, so memory
+    and the work of the reductions shrink with the dry fraction.
+
+    Parameters
+    ----------
+    values : ndarray
+        Values at the wet points, shape (n_time, n_wet).
+    mask : ndarray
+        Boolean (n_levels, n_locations) array, True at the wet points.
+    dims : tuple of str, default=('time', 'nz1', 'nod2')
+        Names of the dimensions of the dense field.
+    coords : dict, optional
+        Coordinates of the dense field, e.g. time and levels.
+    name : str, optional
+        Name of the variable.
+
+    Attributes
+    ----------
+    indptr : ndarray
+        Offset of the first wet point of each level, length n_levels + 1.
+    indices : ndarray
+        Location of each wet point.
+    level_index : ndarray
+        Level of each wet point.
+    bottom : ndarray
+        Number of wet levels of each column (the bottom level index + 1 when the
+        column is wet from the top).
+    '''
+
+    def __init__(self, values, mask, dims=('time', 'nz1', 'nod2'), coords=None, name=None):
+        self.values = values
+        self.mask = np.asarray(mask, dtype=bool)
+        self.dims = tuple(dims)
+        self.coords = dict(coords or {})
+        self.name = name
+
+        if values.shape[-1] != self.mask.sum():
+            raise ValueError(f'values has {values.shape[-1]} points but the mask has {self.mask.sum()} wet points')
+
+        self.level_index, self.indices = np.nonzero(self.mask)
+        self.indptr = np.concatenate(([0], np.cumsum(self.mask.sum(axis=1))))
+
+    def __repr__(self):
+        return (f'WetPointField({self.name}, dims={self.dims}, shape={self.shape}, '
+                f'wet fraction={self.wet_fraction:.2f})')
+
+    @property
+    def shape(self):
+        '''Shape of the dense field.'''
+        return (self.values.shape[0],) + self.mask.shape
+
+    @property
+    def sizes(self):
+        return dict(zip(self.dims, self.shape))
+
+    @property
+    def level_dim(self):
+        return self.dims[1]
+
+    @property
+    def location_dim(self):
+        return self.dims[2]
+
+    @property
+    def wet_fraction(self):
+        return self.mask.mean()
+
+    @property
+    def bottom(self):
+        return self.mask.sum(axis=0)
+
+    @property
+    def nbytes(self):
+        return self.values.nbytes
+
+    @classmethod
+    def from_dataarray(cls, field, mask=None, time_block=30):
+        '''
+        Compresses a dense (time, level, location) DataArray, e.g. the output of
+        data_loader.load_variable. Dask backed fields are read time_block time
+        steps at a time, so the dense field is never in memory at once.
+
+        Parameters
+        ----------
+        field : DataArray
+            Dense field with NaN on land.
+        mask : array_like, optional
+            Boolean (level, location) wet mask, e.g. from data_loader.get_wet_mask.
+            By default the points that are not NaN at the first time step.
+        time_block : int, default=30
+            Number of time steps read at once.
+
+        Returns
+        -------
+        WetPointField
+        '''
+        if mask is None:
+            mask = field.isel(time=0).notnull()
+        mask = np.asarray(mask, dtype=bool)
+
+        n_time = field.sizes['time']
+        values = np.empty((n_time, mask.sum()), dtype=field.dtype)
+        for start in range(0, n_time, time_block):
+            block = np.asarray(field.isel(time=slice(start, start + time_block)).values)
+            values[start:start + len(block)] = block[:, mask]
+
+        coords = {dim: field[dim].values for dim in field.dims if dim in field.coords}
+        return cls(values, mask, dims=field.dims, coords=coords, name=field.name)
+
+    def to_dataarray(self):
+        '''
+        Dense DataArray with NaN at the dry points.
+        '''
+        dtype = np.result_type(self.values.dtype, np.float32)
+        dense = np.full(self.shape, np.nan, dtype=dtype)
+        dense[:, self.mask] = self.values
+        return xr.DataArray(dense, dims=self.dims, coords=self.coords, name=self.name)
+
+    def _new(self, values):
+        return type(self)(values, self.mask, dims=self.dims, coords=self.coords, name=self.name)
+
+    def time_mean(self):
+        '''Time mean of each wet point, skipping NaN values.'''
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.nanmean(self.values, axis=0, dtype=np.float64)
+
+    def anomaly(self):
+        '''Deviation from the time mean, with the dtype of the values.'''
+        dtype = np.result_type(self.values.dtype, np.float32)
+        return self._new(self.values - self.time_mean().astype(dtype))
+
+    def take(self, level_index, location_index):
+        '''
+        Values at the given (level, location) points, shape (n_time, n_points).
+        Dry points are NaN.
+        '''
+        position = np.full(self.mask.shape, -1)
+        position[self.mask] = np.arange(self.values.shape[-1])
+        position = position[level_index, location_index]
+
+        values = self.values[:, np.maximum(position, 0)].astype(np.result_type(self.values.dtype, np.float32))
+        values[:, position < 0] = np.nan
+        return values
+
+    def restagger(self, staggering, target):
+        '''
+        Applies a vertical_diagnostics.VerticalStaggering operator, returning the
+        values at the wet points of target (a WetPointField on the target levels).
+        Target points with a dry source level above or below are NaN, as in the
+        dense computation.
+        '''
+        upper = staggering.upper[target.level_index]
+        weight = staggering.weight[target.level_index]
+        field_upper = self.take(upper, target.indices)
+        field_lower = self.take(upper + 1, target.indices)
+        return target._new((1 - weight) * field_upper + weight * field_lower)
+
+    def weighted_mean(self, area, values=None):
+        '''
+        Area weighted horizontal mean of each level and time step, skipping NaN
+        values like DataArray.weighted(area).mean(location_dim).
+
+        Parameters
+        ----------
+        area : array_like
+            Area of each location.
+        values : ndarray, optional
+            (n_time, n_wet) values on the wet points of this field. Defaults to
+            self.values.
+
+        Returns
+        -------
+        DataArray
+            Dimensions (time, level).
+        '''
+        values = self.values if values is None else values
+        area = np.asarray(area, dtype=np.float64)
+        n_levels = self.mask.shape[0]
+
+        # one matrix-vector product per level on a float64 copy of its wet points only
+        profile = np.full((values.shape[0], n_levels), np.nan)
+        for k in range(n_levels):
+            start, stop = self.indptr[k], self.indptr[k + 1]
+            if start == stop:
+                continue
+            level_values = values[:, start:stop].astype(np.float64)
+            level_area = area[self.indices[start:stop]]
+            invalid = np.isnan(level_values)
+            if invalid.any():
+                np.copyto(level_values, 0, where=invalid)
+                total_area = ~invalid @ level_area
+            else:
+                total_area = level_area.sum()
+            with np.errstate(invalid='ignore', divide='ignore'):
+                profile[:, k] = level_values @ level_area / total_area
+
+        dims = self.dims[:2]
+        coords = {dim: self.coords[dim] for dim in dims if dim in self.coords}
+        return xr.DataArray(profile, dims=dims, coords=coords)
+
+
+def as_wet_points(field, mask=None):
+    '''
+    Returns field as a WetPointField, compressing it if it is a DataArray.
+    '''
+    if isinstance(field, WetPointField):
+        return field
+    return WetPointField.from_dataarray(field, mask=mask)